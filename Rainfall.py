@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+One command line for quick answers: weekday means, heavy rain days and
+yearly totals as a text table, JSON or a graph.
+
+Text answers have to be fast enough for cron jobs and the shell, so this
+script imports only the standard library at start. Answers are computed
+once per cutoff and kept in .rainfall_cache/answers_<data root>.json
+together with a fingerprint of the files under the data root (paths,
+sizes and modification times); as long as no file changes, a question is answered from there
+without NumPy or pandas. Otherwise the answer comes from the aggregate
+cube of RainfallCube if it exists and the cutoff is one of its bin edges,
+and from RainfallEngine if not. matplotlib is only imported for --format
+png. --timings prints how long each step took; for the time of every
+single import run it with python -X importtime.
+
+Run it from the project folder, e.g.:
+
+    python Rainfall.py weekday --station Flughafen
+    python Rainfall.py heavy --cutoff 10 --lang de
+    python Rainfall.py yearly --station Muenchen-Stadt --format json
+    python Rainfall.py weekday --format png --timings
+
+@author: Merlin <|:3
+"""
+import time
+
+_START = time.perf_counter()
+
+import os  # operating system dependent functionality
+import sys
+import json
+import hashlib
+import argparse
+
+# Durations of the steps of this run, printed with --timings
+TIMINGS = [('import standard library', time.perf_counter() - _START)]
+
+# Same as RainfallLoader.WEEKDAY_ORDER and RainfallEngine.RAINY_DAY_CUTOFF, repeated so text answers need no pandas
+WEEKDAY_ORDER = ['Mo', 'Di', 'Mi', 'Do', 'Fr', 'Sa', 'So']
+RAINY_DAY_CUTOFF = 5
+
+# Stored answers: one file per data root in CACHE_DIR (like RainfallLoader.CACHE_DIR), one entry per cutoff,
+# the oldest is dropped beyond MAX_ANSWERS
+CACHE_DIR = '.rainfall_cache'
+ANSWER_VERSION = 1
+MAX_ANSWERS = 32
+
+# Columns of every command: statistics table, columns, graph of RainfallRender
+COMMANDS = {
+    'weekday': ('weekday', ['station', 'Weekday', 'mean', 'days'], 'weekday_mean'),
+    'heavy': ('weekday', ['station', 'Weekday', 'heavy_days', 'days'], 'heavy_days'),
+    'yearly': ('yearly', ['station', 'Year', 'total', 'heavy_days', 'days'], 'yearly'),
+}
+
+# Column headers of the text table
+LABELS = {
+    'en': {'station': 'Station', 'Weekday': 'Weekday', 'Year': 'Year', 'mean': 'Mean l/m²',
+           'heavy_days': 'Days >{cutoff:g} l/m²', 'total': 'Total l/m²', 'days': 'Days'},
+    'de': {'station': 'Station', 'Weekday': 'Wochentag', 'Year': 'Jahr', 'mean': 'Mittel l/m²',
+           'heavy_days': 'Tage >{cutoff:g} l/m²', 'total': 'Summe l/m²', 'days': 'Tage'},
+}
+
+# Decimals of the columns in the text table
+DECIMALS = {'mean': 3, 'total': 1}
+
+
+class timed:
+    """Context manager that adds the duration of a step to TIMINGS."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        TIMINGS.append((self.name, time.perf_counter() - self.start))
+
+
+def answer_path(data_root='Data', cache_dir=CACHE_DIR):
+    """File of the stored answers of a data root (named like RainfallLoader.root_key, without importing it)."""
+    path = os.path.abspath(data_root)
+    key = f"{os.path.basename(path)}_{hashlib.sha1(path.encode('utf-8')).hexdigest()[:8]}"
+    return os.path.join(cache_dir, f'answers_{key}.json')
+
+
+def fingerprint(data_root='Data'):
+    """Hash of the path, size and modification time of every station file (like RainfallLoader.discover_stations)."""
+    digest = hashlib.sha1()
+    for station in sorted(os.listdir(data_root)):
+        station_dir = os.path.join(data_root, station)
+        if not os.path.isdir(station_dir):
+            continue
+        for entry in sorted(os.scandir(station_dir), key=lambda entry: entry.name):
+            if entry.name.endswith('.csv') and entry.is_file():
+                stat = entry.stat()
+                digest.update(f'{entry.path}\0{stat.st_size}\0{stat.st_mtime_ns}\n'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def load_answers(path):
+    """Read the stored answers, or an empty store if there is no usable file."""
+    try:
+        with open(path, encoding='utf-8') as answer_file:
+            answers = json.load(answer_file)
+    except (OSError, ValueError):
+        return {'version': ANSWER_VERSION, 'fingerprint': None, 'answers': {}}
+    if answers.get('version') != ANSWER_VERSION:
+        return {'version': ANSWER_VERSION, 'fingerprint': None, 'answers': {}}
+    return answers
+
+
+def save_answers(answers, path):
+    """Write the stored answers, replacing the file atomically."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as tmp_file:
+        json.dump(answers, tmp_file)
+    os.replace(tmp_path, path)
+
+
+def _records(table):
+    """Rows of a statistics table as plain dicts (JSON types only)."""
+    return json.loads(table.to_json(orient='records'))
+
+
+def compute_statistics(data_root='Data', cutoff=RAINY_DAY_CUTOFF):
+    """
+    Compute the weekday, yearly and year range tables of every station as plain rows.
+
+    Uses the aggregate cube if it exists and cutoff is one of its bin
+    edges, RainfallEngine otherwise. Returns the tables and the source.
+    """
+    with timed('import numpy, pandas'):
+        import RainfallCube
+
+    if os.path.exists(RainfallCube.cube_path(data_root)):
+        try:
+            RainfallCube.heavy_bins(cutoff)
+        except ValueError:
+            pass
+        else:
+            with timed('aggregate cube'):
+                cube = RainfallCube.get_cube(data_root)
+                weekday = RainfallCube.query(cube, ['station', 'weekday'], cutoff=cutoff)
+                weekday = weekday.rename(columns={'weekday': 'Weekday'})
+                yearly = RainfallCube.query(cube, ['station', 'year'], cutoff=cutoff).rename(columns={'year': 'Year'})
+                yearly = yearly[yearly['days'] > 0]
+                years = yearly.groupby('station', sort=False)['Year'].agg(['min', 'max']).reset_index()
+                years.columns = ['station', 'min_year', 'max_year']
+            return {'weekday': _records(weekday), 'yearly': _records(yearly), 'years': _records(years)}, 'cube'
+
+    with timed('import engine'):
+        import RainfallEngine
+    with timed('load and aggregate'):
+        statistics = RainfallEngine.analyze(data_root=data_root, cutoff=cutoff)
+    return {name: _records(statistics[name]) for name in ('weekday', 'yearly', 'years')}, 'engine'
+
+
+def get_statistics(data_root='Data', cutoff=RAINY_DAY_CUTOFF, path=None):
+    """Return the statistics of a cutoff from the stored answers, computing and storing them if needed."""
+    path = path or answer_path(data_root)
+    with timed('fingerprint data'):
+        current = fingerprint(data_root)
+    with timed('read stored answers'):
+        answers = load_answers(path)
+    if answers['fingerprint'] != current:
+        answers = {'version': ANSWER_VERSION, 'fingerprint': current, 'answers': {}}
+
+    key = f'{float(cutoff):g}'
+    if key in answers['answers']:
+        return answers['answers'][key], 'stored'
+
+    statistics, source = compute_statistics(data_root, cutoff)
+    answers['answers'][key] = statistics
+    while len(answers['answers']) > MAX_ANSWERS:
+        del answers['answers'][next(iter(answers['answers']))]
+    with timed('store answers'):
+        save_answers(answers, path)
+    return statistics, source
+
+
+def resolve_stations(statistics, names):
+    """
+    Full station names for the given names or unique parts of names (case-insensitive).
+
+    None selects every station.
+    """
+    stations = [row['station'] for row in statistics['years']]
+    if not names:
+        return stations
+    resolved = []
+    for name in names:
+        matches = [station for station in stations if station == name] or \
+                  [station for station in stations if name.lower() in station.lower()]
+        if len(matches) != 1:
+            raise ValueError(f'{"Ambiguous" if matches else "Unknown"} station: {name} '
+                             f'(stations: {", ".join(stations)})')
+        resolved.append(matches[0])
+    return resolved
+
+
+def answer_rows(statistics, command, stations):
+    """Rows of a command for the selected stations, in the order of the stations."""
+    table, columns, _ = COMMANDS[command]
+    rows = [row for station in stations for row in statistics[table] if row['station'] == station]
+    return [{column: row[column] for column in columns} for row in rows]
+
+
+def format_table(rows, command, cutoff, lang='en'):
+    """Plain text table of answer rows with aligned columns."""
+    columns = COMMANDS[command][1]
+    header = [LABELS[lang][column].format(cutoff=cutoff) for column in columns]
+    cells = [[
+        '' if row[column] is None else f'{row[column]:.{DECIMALS[column]}f}' if column in DECIMALS else str(row[column])
+        for column in columns
+    ] for row in rows]
+    widths = [max([len(header[i])] + [len(line[i]) for line in cells]) for i in range(len(columns))]
+    lines = [header] + cells
+    return '\n'.join(
+        '  '.join(cell.ljust(width) if i == 0 else cell.rjust(width) for i, (cell, width) in enumerate(zip(line, widths)))
+        for line in lines
+    )
+
+
+def render_png(statistics, command, stations, cutoff, lang='en', output_dir='graphs'):
+    """Render the graph of a command for every selected station and return the paths (unchanged graphs are kept)."""
+    with timed('import matplotlib'):
+        import pandas as pd
+        import RainfallRender
+    with timed('render'):
+        tables = {name: pd.DataFrame(rows) for name, rows in statistics.items()}
+        tables = {name: table[table['station'].isin(stations)].reset_index(drop=True) for name, table in tables.items()}
+        tables['weekday']['Weekday'] = pd.Categorical(tables['weekday']['Weekday'], categories=WEEKDAY_ORDER,
+                                                      ordered=True)
+        tables['cutoff'] = cutoff
+        return RainfallRender.render_all(tables, [lang], [COMMANDS[command][2]], output_dir, workers=1)
+
+
+def print_timings(source, stream=sys.stderr):
+    """Print the duration of every step and the total time since the start of the script."""
+    for name, seconds in TIMINGS:
+        print(f'{seconds * 1000:8.1f} ms  {name}', file=stream)
+    print(f'{(time.perf_counter() - _START) * 1000:8.1f} ms  total (answer source: {source})', file=stream)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Quick answers about the rainfall per weekday and year.')
+    parser.add_argument('command', choices=list(COMMANDS), help='weekday means, heavy rain days or yearly totals')
+    parser.add_argument('--data-root', default='Data', help='folder with one sub folder per station')
+    parser.add_argument('--station', nargs='*', default=None, help='station names or unique parts of them, default all')
+    parser.add_argument('--cutoff', type=float, default=RAINY_DAY_CUTOFF, help='heavy rain day threshold in l/m²')
+    parser.add_argument('--lang', default='en', choices=list(LABELS), help='language of the table or graph')
+    parser.add_argument('--format', default='table', choices=['table', 'json', 'png'], help='output format')
+    parser.add_argument('--output-dir', default='graphs', help='folder of the graphs (png only)')
+    parser.add_argument('--timings', action='store_true', help='print the duration of every step to stderr')
+    args = parser.parse_args()
+
+    statistics, source = get_statistics(args.data_root, args.cutoff)
+    try:
+        stations = resolve_stations(statistics, args.station)
+    except ValueError as exc:
+        parser.error(str(exc))
+
+    if args.format == 'png':
+        for output_path in render_png(statistics, args.command, stations, args.cutoff, args.lang, args.output_dir):
+            print(f'Graph saved as: {output_path}')
+    else:
+        with timed('format answer'):
+            rows = answer_rows(statistics, args.command, stations)
+            if args.format == 'json':
+                output = json.dumps({'command': args.command, 'cutoff': args.cutoff, 'rows': rows}, ensure_ascii=False)
+            else:
+                output = format_table(rows, args.command, args.cutoff, args.lang)
+        try:
+            print(output)
+            sys.stdout.flush()
+        except BrokenPipeError:
+            # The reader (e.g. head) stopped early: exit quietly like other command line tools
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            sys.exit(1)
+    if args.timings:
+        print_timings(source)
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the rainfall pipeline.
+
+The parser benchmark compares the bulk CSV parser against the original
+per-file loop on the real data. The scale suite writes synthetic datasets
+of several sizes (see RainfallSynthetic) and times the load, clean,
+aggregate and render stages separately. Its results are saved as JSON, and
+a previous result file can be given to compare against it.
+
+Run it from the project folder:
+
+    python RainfallBenchmark.py --data-root Data --min-speedup 10
+    python RainfallBenchmark.py --suite --scales 1x10 3x45 10x45 --json benchmark.json
+
+@author: Merlin <|:3
+"""
+import os  # operating system dependent functionality
+import glob  # finds all the pathnames matching a specified pattern
+import re  # Regex for extracting year
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+import RainfallLoader
+import RainfallEngine
+import RainfallRender
+import RainfallSynthetic
+
+# Default scales of the suite as (stations, years)
+SCALES = [(1, 10), (3, 45), (10, 45)]
+STAGES = ['load', 'clean', 'aggregate', 'render']
+
+
+def legacy_load(station_dir):
+    """The loading loop of the original scripts, kept as reference."""
+    colnames = ['Date', 'Rainfall_in_Liters_per_m²']
+    df_list = []
+
+    for filename in sorted(glob.glob(os.path.join(station_dir, '*.csv'))):
+        temp_df = pd.read_csv(filename, names=colnames, header=0, engine='python')
+
+        year_match = re.search(r'(\d{4})', os.path.basename(filename))
+        if year_match:
+            extracted_year = year_match.group(1)
+            temp_df['Year'] = int(extracted_year)
+
+        temp_df['Weekday'] = temp_df['Date'].str.extract(r'(^\w{2})')
+        temp_df['Date'] = temp_df['Date'].str.extract(r'(\d{2}\.\d{2}\.)')
+        temp_df['Full_Date'] = temp_df['Date'] + extracted_year
+        temp_df['Full_Date'] = pd.to_datetime(temp_df['Full_Date'], format='%d.%m.%Y', errors='coerce')
+        temp_df = temp_df[temp_df['Rainfall_in_Liters_per_m²'] >= 0]
+
+        df_list.append(temp_df)
+
+    return pd.concat(df_list, ignore_index=True)
+
+
+def bulk_load(station_dir):
+    """Parse a station with the bulk parser, bypassing the cache."""
+    return RainfallLoader.load_station(station_dir, use_cache=False)
+
+
+def same_rows(legacy_df, bulk_df):
+    """Check that both loaders returned the same rows in the same order."""
+    return all(
+        (legacy_df[column].astype(str).to_numpy() == bulk_df[column].astype(str).to_numpy()).all()
+        for column in RainfallLoader.COLUMNS
+    ) if len(legacy_df) == len(bulk_df) else False
+
+
+def best_time(function, argument, repeat):
+    """Return the best wall time of several calls, in seconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(argument)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def benchmark_parsing(data_root, repeat=3):
+    """Time the legacy loop and the bulk parser for every station under data_root."""
+    results = []
+    for station_dir in sorted(glob.glob(os.path.join(data_root, '*', ''))):
+        legacy = best_time(legacy_load, station_dir, repeat)
+        bulk = best_time(bulk_load, station_dir, repeat)
+        results.append({
+            'station': os.path.basename(os.path.normpath(station_dir)),
+            'files': len(RainfallLoader.list_station_files(station_dir)),
+            'legacy_s': legacy,
+            'bulk_s': bulk,
+            'speedup': legacy / bulk,
+            'identical': same_rows(legacy_load(station_dir), bulk_load(station_dir)),
+        })
+    return results
+
+
+def timed(function, *arguments):
+    """Call function once and return its result and wall time in seconds."""
+    start = time.perf_counter()
+    result = function(*arguments)
+    return result, time.perf_counter() - start
+
+
+def benchmark_scale(n_stations, n_years, work_dir, repeat=3, dpi=100, seed=0):
+    """
+    Time every pipeline stage on a synthetic dataset of n_stations × n_years.
+
+    load parses all files (no cache), clean builds the cleaned data frame,
+    aggregate computes the engine's statistics and render draws every graph
+    of every station in English on one process. Each stage's best time of
+    repeat runs counts.
+    """
+    data_root = os.path.join(work_dir, f'{n_stations}x{n_years}')
+    station_dirs = RainfallSynthetic.generate_dataset(data_root, n_stations, n_years, seed=seed)
+    stations = [RainfallLoader.station_name(station_dir) for station_dir in station_dirs]
+    files = [path for station_dir in station_dirs for path in RainfallLoader.list_station_files(station_dir)]
+
+    timings = {stage: [] for stage in STAGES}
+    for _ in range(repeat):
+        arrays, seconds = timed(RainfallLoader.load_stations_arrays, station_dirs, 1, RainfallLoader.CACHE_DIR, False)
+        timings['load'].append(seconds)
+        df_final, seconds = timed(RainfallLoader.to_frame, arrays, True, stations)
+        timings['clean'].append(seconds)
+        statistics, seconds = timed(RainfallEngine.compute_statistics, df_final)
+        timings['aggregate'].append(seconds)
+        _, seconds = timed(RainfallRender.render_all, statistics, ('en',), RainfallRender.GRAPHS,
+                           os.path.join(work_dir, 'graphs'), dpi, RainfallRender.DEFAULT_STYLE, 1, False)
+        timings['render'].append(seconds)
+
+    result = {
+        'stations': n_stations,
+        'years': n_years,
+        'files': len(files),
+        'bytes': sum(os.path.getsize(path) for path in files),
+        'rows': int(len(arrays['year'])),
+        'clean_rows': int(len(df_final)),
+    }
+    result.update({f'{stage}_s': min(timings[stage]) for stage in STAGES})
+    return result
+
+
+def benchmark_suite(scales=SCALES, repeat=3, dpi=100, work_dir=None, seed=0):
+    """Run benchmark_scale for every (stations, years) scale and return the JSON-ready results."""
+    own_dir = work_dir is None
+    work_dir = tempfile.mkdtemp(prefix='rainfall_benchmark_') if own_dir else work_dir
+    try:
+        results = [benchmark_scale(n_stations, n_years, work_dir, repeat, dpi, seed) for n_stations, n_years in scales]
+    finally:
+        if own_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'machine': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+        },
+        'repeat': repeat,
+        'dpi': dpi,
+        'seed': seed,
+        'scales': results,
+    }
+
+
+def compare_suites(baseline, current):
+    """Return the time ratio current / baseline per scale and stage (> 1 means slower)."""
+    previous = {(row['stations'], row['years']): row for row in baseline['scales']}
+    ratios = []
+    for row in current['scales']:
+        old = previous.get((row['stations'], row['years']))
+        if old is None:
+            continue
+        ratios.append({'stations': row['stations'], 'years': row['years'],
+                       **{stage: row[f'{stage}_s'] / old[f'{stage}_s'] for stage in STAGES}})
+    return ratios
+
+
+def parse_scale(text):
+    """Parse a "<stations>x<years>" scale argument."""
+    n_stations, _, n_years = text.partition('x')
+    return int(n_stations), int(n_years)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the rainfall CSV parser and pipeline.')
+    parser.add_argument('--data-root', default='Data', help='folder with one sub folder per station')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per measurement (best one counts)')
+    parser.add_argument('--min-speedup', type=float, default=10.0, help='fail if the total speedup is lower')
+    parser.add_argument('--suite', action='store_true', help='run the scale suite on synthetic data instead')
+    parser.add_argument('--scales', nargs='*', type=parse_scale, default=SCALES,
+                        help='suite scales as <stations>x<years>, e.g. 1x10 3x45')
+    parser.add_argument('--dpi', type=int, default=100, help='resolution of the graphs rendered by the suite')
+    parser.add_argument('--json', default=None, help='save the suite results to this JSON file')
+    parser.add_argument('--compare', default=None, help='JSON file of an earlier suite run to compare against')
+    parser.add_argument('--max-slowdown', type=float, default=None, help='fail if any stage got slower than this factor')
+    args = parser.parse_args()
+
+    if args.suite:
+        suite = benchmark_suite(args.scales, args.repeat, args.dpi)
+        for row in suite['scales']:
+            print(f"{row['stations']:>3} stations x {row['years']:>3} years  {row['rows']:>9} rows  "
+                  + '  '.join(f"{stage} {row[f'{stage}_s']:.3f} s" for stage in STAGES))
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as json_file:
+                json.dump(suite, json_file, indent=2)
+            print(f'Results saved as: {args.json}')
+        if args.compare:
+            with open(args.compare, encoding='utf-8') as json_file:
+                ratios = compare_suites(json.load(json_file), suite)
+            for row in ratios:
+                print(f"{row['stations']:>3} stations x {row['years']:>3} years  "
+                      + '  '.join(f'{stage} {row[stage]:.2f}x' for stage in STAGES))
+            if args.max_slowdown and any(row[stage] > args.max_slowdown for row in ratios for stage in STAGES):
+                raise SystemExit(f'A stage got slower than {args.max_slowdown}x')
+    else:
+        results = benchmark_parsing(args.data_root, args.repeat)
+        for row in results:
+            print(f"{row['station']:<28} {row['files']:>4} files  legacy {row['legacy_s']:.3f} s"
+                  f"  bulk {row['bulk_s']:.3f} s  speedup {row['speedup']:.1f}x"
+                  f"  {'identical' if row['identical'] else 'DIFFERENT'}")
+
+        total_speedup = sum(row['legacy_s'] for row in results) / sum(row['bulk_s'] for row in results)
+        print(f'Total speedup: {total_speedup:.1f}x')
+        if not all(row['identical'] for row in results):
+            raise SystemExit('Bulk parser output differs from the legacy loop')
+        if total_speedup < args.min_speedup:
+            raise SystemExit(f'Speedup below {args.min_speedup}x')
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+Calendar-date index for "how often does it rain on my birthday" queries.
+
+The daily values of every station are sorted by (station, month, day,
+year) and stored once with an offset table, like the rows of a sparse
+matrix: the values of one calendar date are one contiguous slice, found
+in O(1) through the offsets. A date range within a year (e.g. 01.07. to
+31.08.) is a single slice as well, a range over the turn of the year
+(24.12. to 06.01.) two slices.
+
+Every year's files are joined before sorting, so the tertial and quarter
+file boundaries make no difference; a date found twice for the same year
+(overlapping files) counts once. 29.02. only holds the values of leap
+years, so its statistics are based on fewer years.
+
+The index is persisted next to the loader cache, one file per data root,
+and rebuilt when a file under the data root changes. Run it from the project folder, e.g.:
+
+    python RainfallCalendar.py --date 24.12.
+    python RainfallCalendar.py --station Muenchen-Stadt --from 24.12. --to 06.01. --cutoff 10
+
+@author: Merlin <|:3
+"""
+import os  # operating system dependent functionality
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import RainfallLoader
+import RainfallCube
+import RainfallEngine
+
+# Format version of the persisted index (its path is given by calendar_path)
+CALENDAR_VERSION = 1
+
+# A day counts as a rain day if its rainfall is above this value in l/m²
+RAIN_THRESHOLD = 0
+
+# Slots per station: months 0-12 × days 0-31 (0 is unused), so slot = month * 32 + day
+_SLOTS = 13 * 32
+
+
+def calendar_path(data_root='Data', cache_dir=RainfallLoader.CACHE_DIR):
+    """Return the index file of a data root, next to the loader cache in cache_dir."""
+    return os.path.join(cache_dir, f'calendar_{RainfallLoader.root_key(data_root)}.npz')
+
+
+def build_calendar(station_dirs=None, data_root='Data', workers=None, cache_dir=RainfallLoader.CACHE_DIR):
+    """Build the index of the given station directories (default: all under data_root)."""
+    if station_dirs is None:
+        station_dirs = RainfallLoader.discover_stations(data_root)
+    arrays = RainfallLoader.load_stations_arrays(station_dirs, workers, cache_dir)
+    stations = [RainfallLoader.station_name(station_dir) for station_dir in station_dirs]
+    calendar = calendar_from_arrays(arrays, stations)
+    calendar['paths'], calendar['sizes'], calendar['mtimes'] = RainfallCube._fingerprint(station_dirs)
+    return calendar
+
+
+def calendar_from_arrays(arrays, stations):
+    """
+    Sort valid rows (with a 'station' code array) into the calendar layout.
+
+    Rows without a valid date or with erroneous rainfall are left out.
+    """
+    year = arrays['year'].astype(np.int64)
+    month = arrays['month'].astype(np.int64)
+    day = arrays['day'].astype(np.int64)
+    valid = ~np.isnat(RainfallLoader.build_dates(year, month, day)) & (arrays['rainfall'] >= 0)
+
+    station = arrays['station'][valid].astype(np.int64)
+    slot = station * _SLOTS + month[valid] * 32 + day[valid]
+    year, rainfall = year[valid], arrays['rainfall'][valid]
+
+    # Sort by slot and year; a (slot, year) pair found twice counts once
+    order = np.lexsort((year, slot))
+    slot, year, rainfall = slot[order], year[order], rainfall[order]
+    first = np.ones(len(slot), dtype=bool)
+    first[1:] = (slot[1:] != slot[:-1]) | (year[1:] != year[:-1])
+    slot, year, rainfall = slot[first], year[first], rainfall[first]
+
+    offsets = np.zeros(len(stations) * _SLOTS + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(slot, minlength=len(stations) * _SLOTS))
+    return {
+        'stations': np.array(stations, dtype=str),
+        'offsets': offsets,
+        'years': year.astype(np.int16),
+        'rainfall': rainfall,
+    }
+
+
+def save_calendar(calendar, path):
+    """Write the index to an .npz file, replacing it atomically."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as tmp_file:
+        np.savez(tmp_file, version=np.int64(CALENDAR_VERSION), **calendar)
+    os.replace(tmp_path, path)
+
+
+def load_calendar(path):
+    """Read an index written by save_calendar, or return None if there is no usable one."""
+    if not os.path.exists(path):
+        return None
+    with np.load(path, allow_pickle=False) as data:
+        if int(data['version']) != CALENDAR_VERSION:
+            return None
+        return {name: data[name] for name in data.files if name != 'version'}
+
+
+def get_calendar(data_root='Data', path=None, workers=None, cache_dir=RainfallLoader.CACHE_DIR):
+    """Return the persisted index of data_root (at calendar_path by default), rebuilding it if any file changed."""
+    station_dirs = RainfallLoader.discover_stations(data_root)
+    path = path or calendar_path(data_root, cache_dir)
+    calendar = load_calendar(path)
+    if calendar is not None:
+        paths, sizes, mtimes = RainfallCube._fingerprint(station_dirs)
+        if (np.array_equal(calendar['paths'], paths) and np.array_equal(calendar['sizes'], sizes)
+                and np.array_equal(calendar['mtimes'], mtimes)):
+            return calendar
+    calendar = build_calendar(station_dirs, workers=workers, cache_dir=cache_dir)
+    save_calendar(calendar, path)
+    return calendar
+
+
+def parse_date(text):
+    """Parse a "dd.mm." calendar date (the trailing dot is optional) into (month, day)."""
+    day, _, month = text.strip().rstrip('.').partition('.')
+    month, day = int(month), int(day)
+    # 2000 was a leap year, so 29.02. is accepted
+    if np.isnat(RainfallLoader.build_dates(np.array([2000]), np.array([month]), np.array([day])))[0]:
+        raise ValueError(f'Invalid calendar date: {text}')
+    return month, day
+
+
+def _station_base(calendar, station):
+    """First slot of a station."""
+    stations = list(calendar['stations'])
+    if station not in stations:
+        raise ValueError(f'Unknown station: {station}')
+    return stations.index(station) * _SLOTS
+
+
+def lookup(calendar, station, month, day):
+    """Years and rainfall of one calendar date at one station (views into the index, O(1))."""
+    slot = _station_base(calendar, station) + month * 32 + day
+    start, stop = calendar['offsets'][slot], calendar['offsets'][slot + 1]
+    return calendar['years'][start:stop], calendar['rainfall'][start:stop]
+
+
+def lookup_range(calendar, station, first, last):
+    """
+    Years and rainfall of all dates from first to last, both (month, day) and inclusive.
+
+    A range over the turn of the year (last before first) wraps around.
+    """
+    base = _station_base(calendar, station)
+    offsets = calendar['offsets']
+    start = offsets[base + first[0] * 32 + first[1]]
+    stop = offsets[base + last[0] * 32 + last[1] + 1]
+    # Compare the dates, not the offsets: empty dates share their offset with the next date
+    if tuple(first) <= tuple(last):
+        return calendar['years'][start:stop], calendar['rainfall'][start:stop]
+    # Over the turn of the year: from first to the end of the year and from the start of the year to last
+    end_of_year, start_of_year = offsets[base + _SLOTS], offsets[base]
+    years = np.concatenate([calendar['years'][start:end_of_year], calendar['years'][start_of_year:stop]])
+    rainfall = np.concatenate([calendar['rainfall'][start:end_of_year], calendar['rainfall'][start_of_year:stop]])
+    return years, rainfall
+
+
+def statistics(rainfall, cutoff=RainfallEngine.RAINY_DAY_CUTOFF, rain_threshold=RAIN_THRESHOLD):
+    """Probability of rain, mean rainfall and frequency of heavy rain days of the given values."""
+    days = len(rainfall)
+    if not days:
+        return {'days': 0, 'rain_probability': np.nan, 'mean': np.nan, 'heavy_frequency': np.nan}
+    return {
+        'days': days,
+        'rain_probability': float(np.count_nonzero(rainfall > rain_threshold) / days),
+        'mean': float(rainfall.mean()),
+        'heavy_frequency': float(np.count_nonzero(rainfall > cutoff) / days),
+    }
+
+
+def query(calendar, date, until=None, stations=None, cutoff=RainfallEngine.RAINY_DAY_CUTOFF,
+          rain_threshold=RAIN_THRESHOLD):
+    """
+    Statistics of a calendar date ("24.12.") or a date range (date to until) per station.
+
+    Returns one row per station with the number of years and days and the
+    rain probability, mean and heavy rain day frequency.
+    """
+    first = parse_date(date)
+    last = parse_date(until) if until else first
+    stations = list(calendar['stations']) if stations is None else [stations] if isinstance(stations, str) else stations
+
+    rows = []
+    for station in stations:
+        years, rainfall = lookup_range(calendar, station, first, last)
+        rows.append({
+            'station': station,
+            'first_year': int(years.min()) if len(years) else None,
+            'last_year': int(years.max()) if len(years) else None,
+            'years': len(np.unique(years)),
+            **statistics(rainfall, cutoff, rain_threshold),
+        })
+    return pd.DataFrame(rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rain statistics of a calendar date or date range.')
+    parser.add_argument('--data-root', default='Data', help='folder with one sub folder per station')
+    parser.add_argument('--date', '--from', dest='date', required=True, help='calendar date as dd.mm., e.g. 24.12.')
+    parser.add_argument('--to', default=None, help='last date of a range as dd.mm. (may wrap over the new year)')
+    parser.add_argument('--station', nargs='*', default=None, help='station name(s), default all')
+    parser.add_argument('--cutoff', type=float, default=RainfallEngine.RAINY_DAY_CUTOFF, help='heavy rain day threshold in l/m²')
+    parser.add_argument('--rain-threshold', type=float, default=RAIN_THRESHOLD, help='a rain day has more than this in l/m²')
+    parser.add_argument('--cache-dir', default=RainfallLoader.CACHE_DIR, help='folder of the loader cache and the index')
+    args = parser.parse_args()
+
+    calendar = get_calendar(args.data_root, cache_dir=args.cache_dir)
+    result = query(calendar, args.date, args.to, args.station, args.cutoff, args.rain_threshold)
+    print(result.to_string(index=False))
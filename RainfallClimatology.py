@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Sliding-window climatology: how the weekday pattern and the number of
+heavy rain days per year drift over time.
+
+The data is grouped once into sums and counts per station, year and
+weekday (RainfallEngine.aggregate). A window of e.g. 30 years is then
+moved over the years by adding the year that enters and subtracting the
+year that leaves, so all windows together cost about one pass over the
+yearly sums instead of one grouping per window. Sums are integer
+thousandths of a l/m², so every window is exact. A step equal to the
+window length gives a decade-by-decade (or any period) comparison.
+
+Run it from the project folder, e.g.:
+
+    python RainfallClimatology.py --window 30 --step 1 --render
+    python RainfallClimatology.py --window 10 --step 10 --station Muenchen-Stadt
+
+@author: Merlin <|:3
+"""
+import os  # operating system dependent functionality
+import argparse
+
+import numpy as np
+import pandas as pd
+import matplotlib.style
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+import RainfallLoader
+import RainfallEngine
+import RainfallRender
+from RainfallLoader import STATION_COLUMN, WEEKDAY_ORDER
+
+# Labels of the trend graph
+LANGUAGES = {
+    'en': {
+        'window': 'Last Year of the {window}-Year Window',
+        'mean_ylabel': 'Average Rainfall (Liters per m²)',
+        'heavy_ylabel': 'Heavy Rain Days per Year (>{cutoff:g} L/m²)',
+        'title': 'Rolling {window}-Year Climatology',
+    },
+    'de': {
+        'window': 'Letztes Jahr des {window}-Jahres-Fensters',
+        'mean_ylabel': 'Durchschnittlicher Niederschlag (Liter pro m²)',
+        'heavy_ylabel': 'Starke Regentage pro Jahr (>{cutoff:g} Liter/m²)',
+        'title': 'Gleitende {window}-Jahres-Klimatologie',
+    },
+}
+
+# Sums are kept per weekday plus one slot for rows without a weekday
+_SLOTS = 8
+
+
+def year_sums(partial, station):
+    """
+    Sums and counts of one station per year and weekday slot, from a partial table of RainfallEngine.aggregate.
+
+    Returns the first year and arrays of shape years × 8 ('total_milli',
+    'days', 'heavy_days'); slot 7 holds rows without a weekday.
+    """
+    rows = partial[partial[STATION_COLUMN] == station]
+    year = rows['Year'].to_numpy(np.int64)
+    first_year = int(year.min())
+    codes = pd.Categorical(rows['Weekday'], categories=WEEKDAY_ORDER).codes.astype(np.int64)
+    cell = (year - first_year) * _SLOTS + np.where(codes >= 0, codes, _SLOTS - 1)
+    n_cells = (int(year.max()) - first_year + 1) * _SLOTS
+    sums = {
+        column: np.bincount(cell, weights=rows[column].to_numpy(np.int64), minlength=n_cells)
+        .astype(np.int64).reshape(-1, _SLOTS)
+        for column in ('total_milli', 'days', 'heavy_days')
+    }
+    return first_year, sums
+
+
+def sliding_sums(values, window, step=1):
+    """
+    Sums of values[start:start + window] for start = 0, step, 2·step, ...
+
+    Each window is derived from the previous one by adding the entering
+    and subtracting the leaving rows, so every row is touched twice at
+    most. Returns the window starts and the sums (windows × remaining axes).
+    """
+    starts = np.arange(0, len(values) - window + 1, step)
+    sums = np.zeros((len(starts),) + values.shape[1:], dtype=values.dtype)
+    if not len(starts):
+        return starts, sums
+
+    running = values[:window].sum(axis=0)
+    sums[0] = running
+    for i in range(1, len(starts)):
+        previous, start = starts[i - 1], starts[i]
+        running += values[max(previous + window, start):start + window].sum(axis=0)
+        running -= values[previous:min(start, previous + window)].sum(axis=0)
+        sums[i] = running
+    return starts, sums
+
+
+# Columns of the weekday and yearly tables of rolling_climatology
+WEEKDAY_COLUMNS = [STATION_COLUMN, 'first_year', 'last_year', 'Weekday', 'mean', 'heavy_days', 'total', 'days']
+YEARLY_COLUMNS = [STATION_COLUMN, 'first_year', 'last_year', 'years', 'total_per_year', 'heavy_days_per_year']
+
+
+def rolling_climatology(partial, window=30, step=1):
+    """
+    Weekday and yearly statistics of every window of every station.
+
+    Returns a dict with a 'weekday' table (station, first_year, last_year,
+    Weekday, mean, heavy_days, total, days) and a 'yearly' table (station,
+    first_year, last_year, years, total_per_year, heavy_days_per_year),
+    where years counts the years with data in the window. Stations with
+    fewer years than the window have no rows; the tables keep their
+    columns even if no station has a complete window.
+    """
+    weekday_parts, yearly_parts = [], []
+    for station in partial[STATION_COLUMN].unique():
+        first_year, sums = year_sums(partial, station)
+        starts, windows = sliding_sums(np.stack([sums['total_milli'], sums['days'], sums['heavy_days']], axis=-1),
+                                       window, step)
+        _, years_with_data = sliding_sums((sums['days'].sum(axis=1) > 0).astype(np.int64), window, step)
+        if not len(starts):
+            continue
+        first = first_year + starts
+        total = windows[..., 0] / RainfallEngine.SUM_SCALE
+        days, heavy = windows[..., 1], windows[..., 2]
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            weekday_parts.append(pd.DataFrame({
+                STATION_COLUMN: station,
+                'first_year': np.repeat(first, 7),
+                'last_year': np.repeat(first + window - 1, 7),
+                'Weekday': np.tile(WEEKDAY_ORDER, len(starts)),
+                'mean': (total[:, :7] / days[:, :7]).ravel(),
+                'heavy_days': heavy[:, :7].ravel(),
+                'total': total[:, :7].ravel(),
+                'days': days[:, :7].ravel(),
+            }))
+            yearly_parts.append(pd.DataFrame({
+                STATION_COLUMN: station,
+                'first_year': first,
+                'last_year': first + window - 1,
+                'years': years_with_data,
+                'total_per_year': total.sum(axis=1) / years_with_data,
+                'heavy_days_per_year': heavy.sum(axis=1) / years_with_data,
+            }))
+
+    weekday = pd.concat(weekday_parts, ignore_index=True) if weekday_parts else pd.DataFrame(columns=WEEKDAY_COLUMNS)
+    weekday['Weekday'] = pd.Categorical(weekday['Weekday'], categories=WEEKDAY_ORDER, ordered=True)
+    yearly = pd.concat(yearly_parts, ignore_index=True) if yearly_parts else pd.DataFrame(columns=YEARLY_COLUMNS)
+    return {'window': window, 'step': step, 'weekday': weekday, 'yearly': yearly}
+
+
+def weekday_matrix(climatology, station, value='mean'):
+    """Time × weekday matrix of one station: one row per window (first, last year), one column per weekday."""
+    rows = RainfallEngine.station_rows(climatology['weekday'], station)
+    return rows.pivot(index=['first_year', 'last_year'], columns='Weekday', values=value)
+
+
+def draw_trend(fig, climatology, station, cutoff, lang='en'):
+    """Lines of the weekday means and the heavy rain days per year over the windows of one station."""
+    labels = LANGUAGES[lang]
+    window = climatology['window']
+    matrix = weekday_matrix(climatology, station)
+    yearly = RainfallEngine.station_rows(climatology['yearly'], station)
+    last_years = matrix.index.get_level_values('last_year')
+
+    ax_mean, ax_heavy = fig.subplots(2, 1, sharex=True)
+    for weekday in WEEKDAY_ORDER:
+        ax_mean.plot(last_years, matrix[weekday], label=weekday, linewidth=1.5)
+    ax_mean.set_ylabel(labels['mean_ylabel'])
+    ax_mean.legend(ncol=7, fontsize='small')
+    ax_mean.set_title(f"{labels['title'].format(window=window)}\n{station}")
+
+    ax_heavy.plot(yearly['last_year'], yearly['heavy_days_per_year'], color='deepskyblue', linewidth=2)
+    ax_heavy.set_ylabel(labels['heavy_ylabel'].format(cutoff=cutoff))
+    ax_heavy.set_xlabel(labels['window'].format(window=window))
+    for ax in (ax_mean, ax_heavy):
+        ax.grid(visible=True, color='gray', linestyle='--', linewidth=1, alpha=0.5)
+    fig.tight_layout()
+    return ax_mean
+
+
+def render_trend(climatology, station, cutoff, lang='en', output_dir='graphs', dpi=300,
+                 style=RainfallRender.DEFAULT_STYLE):
+    """Render the trend graph of one station headlessly into <output_dir>/<station>/ and return its path."""
+    with matplotlib.style.context(style):
+        fig = Figure(figsize=(10, 8))
+        FigureCanvasAgg(fig)
+        draw_trend(fig, climatology, station, cutoff, lang)
+        window = climatology['window']
+        yearly = RainfallEngine.station_rows(climatology['yearly'], station)
+        output_path = os.path.join(output_dir, station, f'Climatology_{window}y_{lang}_'
+                                   f"{yearly['first_year'].min()}-{yearly['last_year'].max()}.png")
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        fig.savefig(output_path, dpi=dpi)
+    return output_path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rolling-window climatology of the weekday pattern.')
+    parser.add_argument('--data-root', default='Data', help='folder with one sub folder per station')
+    parser.add_argument('--cutoff', type=float, default=RainfallEngine.RAINY_DAY_CUTOFF, help='heavy rain day threshold in l/m²')
+    parser.add_argument('--window', type=int, default=30, help='window length in years')
+    parser.add_argument('--step', type=int, default=1, help='years between window starts')
+    parser.add_argument('--station', nargs='*', default=None, help='station name(s), default all')
+    parser.add_argument('--value', default='mean', choices=['mean', 'heavy_days', 'total', 'days'],
+                        help='value of the printed time × weekday matrix')
+    parser.add_argument('--csv-prefix', default=None, help='write <prefix>_weekday.csv and <prefix>_yearly.csv')
+    parser.add_argument('--render', action='store_true', help='render the trend graph of every station')
+    parser.add_argument('--lang', nargs='*', default=['en'], choices=list(LANGUAGES), help='languages of the graph')
+    args = parser.parse_args()
+
+    df_final = RainfallLoader.load_all_stations(args.data_root)
+    climatology = rolling_climatology(RainfallEngine.aggregate(df_final, args.cutoff), args.window, args.step)
+    with_windows = list(climatology['yearly'][STATION_COLUMN].unique())
+    if not with_windows:
+        print(f'No complete windows of {args.window} years: every station has fewer years of data.')
+    stations = [station for station in args.station or with_windows if station in with_windows]
+    for station in sorted(set(args.station or []) - set(with_windows)):
+        print(f'No complete windows of {args.window} years for {station}.')
+    with pd.option_context('display.max_rows', None, 'display.width', 160):
+        for station in stations:
+            print(station)
+            print(weekday_matrix(climatology, station, args.value).round(3).to_string())
+            print(RainfallEngine.station_rows(climatology['yearly'], station).round(3).to_string(index=False))
+            print()
+
+    if args.csv_prefix:
+        for name in ('weekday', 'yearly'):
+            climatology[name].to_csv(f'{args.csv_prefix}_{name}.csv', index=False)
+            print(f'Climatology saved as: {args.csv_prefix}_{name}.csv')
+    if args.render:
+        for station in stations:
+            for lang in args.lang:
+                print(f'Graph saved as: {render_trend(climatology, station, args.cutoff, lang)}')
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""
+Precomputed aggregate cube of the rainfall data for instant re-slicing.
+
+The cube has the dimensions station × year × month × weekday. Every cell
+holds the rainfall sum, the number of valid days, the number of missing
+values (empty cells, negative values and the -999 sentinel) and a
+histogram of the daily rainfall in fixed bins. Any slice, e.g. summer
+months of 1993–2024 at one station, is answered by summing cells without
+touching the raw data. Heavy rain day counts come from the histogram, so
+every cutoff on a bin edge (0.1 steps up to 1, 0.5 steps up to 20, 1 steps
+up to 50, 5 steps up to 100 l/m²) is exact.
+
+Run it from the project folder, e.g.:
+
+    python RainfallCube.py --by weekday --years 1993 2024 --months 6 7 8 --cutoff 5
+
+@author: Merlin <|:3
+"""
+import os  # operating system dependent functionality
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import RainfallLoader
+from RainfallLoader import WEEKDAY_ORDER
+
+# Format version of the persisted cube (its path is given by cube_path)
+CUBE_VERSION = 1
+
+# Histogram bin edges in l/m², bin i holds values in (edges[i-1], edges[i]]
+BIN_EDGES = np.unique(np.round(np.concatenate([
+    np.arange(0, 1, 0.1),
+    np.arange(1, 20, 0.5),
+    np.arange(20, 50, 1),
+    np.arange(50, 100.001, 5),
+]), 1))
+
+DIMENSIONS = ['station', 'year', 'month', 'weekday']
+
+
+def _fingerprint(station_dirs):
+    """Return the path, size and mtime of every station file (the cube's validity key)."""
+    paths = [path for station_dir in station_dirs for path in RainfallLoader.list_station_files(station_dir)]
+    stats = [os.stat(path) for path in paths]
+    return (
+        np.array(paths, dtype=str),
+        np.array([stat.st_size for stat in stats], dtype=np.int64),
+        np.array([stat.st_mtime_ns for stat in stats], dtype=np.int64),
+    )
+
+
+def cube_path(data_root='Data', cache_dir=RainfallLoader.CACHE_DIR):
+    """Return the cube file of a data root, next to the loader cache in cache_dir."""
+    return os.path.join(cache_dir, f'cube_{RainfallLoader.root_key(data_root)}.npz')
+
+
+def build_cube(station_dirs=None, data_root='Data', workers=None, cache_dir=RainfallLoader.CACHE_DIR):
+    """Build the cube of the given station directories (default: all under data_root)."""
+    if station_dirs is None:
+        station_dirs = RainfallLoader.discover_stations(data_root)
+    arrays = RainfallLoader.load_stations_arrays(station_dirs, workers, cache_dir)
+    stations = [RainfallLoader.station_name(station_dir) for station_dir in station_dirs]
+    cube = cube_from_arrays(arrays, stations)
+    cube['paths'], cube['sizes'], cube['mtimes'] = _fingerprint(station_dirs)
+    return cube
+
+
+def cube_from_arrays(arrays, stations):
+    """
+    Fold row arrays (with a 'station' code array) into cube cells.
+
+    Rows without a valid month or weekday cannot be placed in a cell and
+    are left out.
+    """
+    placed = (arrays['month'] >= 1) & (arrays['month'] <= 12) & (arrays['weekday'] >= 0)
+    year = arrays['year'][placed].astype(np.int64)
+    first_year = int(year.min()) if len(year) else 0
+    n_years = int(year.max()) - first_year + 1 if len(year) else 0
+    shape = (len(stations), n_years, 12, 7)
+
+    # Flat cell index of every row
+    cell = np.ravel_multi_index((
+        arrays['station'][placed].astype(np.int64),
+        year - first_year,
+        arrays['month'][placed].astype(np.int64) - 1,
+        arrays['weekday'][placed].astype(np.int64),
+    ), shape) if len(year) else np.empty(0, dtype=np.int64)
+
+    rainfall = arrays['rainfall'][placed]
+    valid = rainfall >= 0
+    n_cells, n_bins = int(np.prod(shape)), len(BIN_EDGES) + 1
+    bins = np.searchsorted(BIN_EDGES, rainfall[valid], side='left')
+
+    return {
+        'stations': np.array(stations, dtype=str),
+        'first_year': first_year,
+        'total': np.bincount(cell[valid], weights=rainfall[valid], minlength=n_cells).reshape(shape),
+        'days': np.bincount(cell[valid], minlength=n_cells).astype(np.int32).reshape(shape),
+        'missing': np.bincount(cell[~valid], minlength=n_cells).astype(np.int32).reshape(shape),
+        'histogram': np.bincount(cell[valid] * n_bins + bins, minlength=n_cells * n_bins)
+        .astype(np.int32).reshape(shape + (n_bins,)),
+    }
+
+
+def save_cube(cube, path):
+    """Write a cube to a compressed .npz file, replacing it atomically."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as tmp_file:
+        np.savez_compressed(tmp_file, version=np.int64(CUBE_VERSION), bin_edges=BIN_EDGES, **cube)
+    os.replace(tmp_path, path)
+
+
+def load_cube(path):
+    """Read a cube written by save_cube, or return None if there is no usable one."""
+    if not os.path.exists(path):
+        return None
+    with np.load(path, allow_pickle=False) as data:
+        if int(data['version']) != CUBE_VERSION or not np.array_equal(data['bin_edges'], BIN_EDGES):
+            return None
+        cube = {name: data[name] for name in data.files if name not in ('version', 'bin_edges')}
+    cube['first_year'] = int(cube['first_year'])
+    return cube
+
+
+def get_cube(data_root='Data', path=None, workers=None, cache_dir=RainfallLoader.CACHE_DIR):
+    """Return the persisted cube of data_root (at cube_path by default), rebuilding it if any file changed."""
+    station_dirs = RainfallLoader.discover_stations(data_root)
+    path = path or cube_path(data_root, cache_dir)
+    cube = load_cube(path)
+    if cube is not None and 'paths' in cube:
+        paths, sizes, mtimes = _fingerprint(station_dirs)
+        if (np.array_equal(cube['paths'], paths) and np.array_equal(cube['sizes'], sizes)
+                and np.array_equal(cube['mtimes'], mtimes)):
+            return cube
+    cube = build_cube(station_dirs, workers=workers, cache_dir=cache_dir)
+    save_cube(cube, path)
+    return cube
+
+
+def _selection(cube, stations=None, years=None, months=None, weekdays=None):
+    """Translate query parameters into index arrays along the four cube dimensions."""
+    station_names = list(cube['stations'])
+    n_years = cube['total'].shape[1]
+
+    if stations is None:
+        station_index = np.arange(len(station_names))
+    else:
+        stations = [stations] if isinstance(stations, str) else stations
+        unknown = [station for station in stations if station not in station_names]
+        if unknown:
+            raise ValueError(f'Unknown station(s): {", ".join(unknown)}')
+        station_index = np.array([station_names.index(station) for station in stations])
+
+    if years is None:
+        year_index = np.arange(n_years)
+    else:
+        # A (first, last) pair is an inclusive range, anything else a list of years
+        if isinstance(years, tuple) and len(years) == 2:
+            years = range(years[0], years[1] + 1)
+        year_index = np.array([year - cube['first_year'] for year in years], dtype=np.int64)
+        year_index = year_index[(year_index >= 0) & (year_index < n_years)]
+
+    if months is None:
+        month_index = np.arange(12)
+    else:
+        invalid = [month for month in months if not 1 <= month <= 12]
+        if invalid:
+            raise ValueError(f'Months must be between 1 and 12, got: {", ".join(map(str, invalid))}')
+        month_index = np.array(months, dtype=np.int64) - 1
+    if weekdays is None:
+        weekday_index = np.arange(7)
+    else:
+        unknown = [weekday for weekday in weekdays if weekday not in WEEKDAY_ORDER]
+        if unknown:
+            raise ValueError(f'Unknown weekday(s): {", ".join(unknown)} (weekdays: {", ".join(WEEKDAY_ORDER)})')
+        weekday_index = np.array([WEEKDAY_ORDER.index(weekday) for weekday in weekdays])
+
+    return np.ix_(station_index, year_index, month_index, weekday_index), {
+        'station': np.array(station_names)[station_index],
+        'year': cube['first_year'] + year_index,
+        'month': month_index + 1,
+        'weekday': np.array(WEEKDAY_ORDER)[weekday_index],
+    }
+
+
+def heavy_bins(cutoff):
+    """Return the first histogram bin holding values > cutoff (cutoff must be a bin edge)."""
+    edge = np.searchsorted(BIN_EDGES, cutoff)
+    if edge >= len(BIN_EDGES) or not np.isclose(BIN_EDGES[edge], cutoff):
+        raise ValueError(f'Cutoff {cutoff} is not a histogram bin edge')
+    return edge + 1
+
+
+def query_arrays(cube, by='weekday', stations=None, years=None, months=None, weekdays=None, cutoff=None):
+    """
+    Answer a slice of the cube by summing its cells, as plain NumPy arrays.
+
+    by names the dimension(s) to keep ('station', 'year', 'month',
+    'weekday', a list of them, or None for one grand total). Years can be
+    a (first, last) tuple or a list. Returns the labels of the kept
+    dimensions and the summed 'total', 'days', 'missing' and, with a
+    cutoff, 'heavy_days' arrays (one axis per kept dimension).
+    """
+    keep = [] if by is None else [by] if isinstance(by, str) else list(by)
+    unknown = [dimension for dimension in keep if dimension not in DIMENSIONS]
+    if unknown:
+        raise ValueError(f'Unknown dimension(s): {", ".join(unknown)} (dimensions: {", ".join(DIMENSIONS)})')
+    index, labels = _selection(cube, stations, years, months, weekdays)
+    axes = tuple(axis for axis, dimension in enumerate(DIMENSIONS) if dimension not in keep)
+
+    result = {
+        'labels': {dimension: labels[dimension] for dimension in DIMENSIONS if dimension in keep},
+        'total': cube['total'][index].sum(axis=axes),
+        'days': cube['days'][index].sum(axis=axes),
+        'missing': cube['missing'][index].sum(axis=axes),
+    }
+    if cutoff is not None:
+        # Only the bins above the cutoff are summed
+        histogram = cube['histogram'][index + (slice(heavy_bins(cutoff), None),)]
+        result['heavy_days'] = histogram.sum(axis=-1).sum(axis=axes)
+    return result
+
+
+def query(cube, by='weekday', stations=None, years=None, months=None, weekdays=None, cutoff=None):
+    """
+    Answer a slice of the cube as a data frame (see query_arrays).
+
+    Returns one row per combination of the kept dimensions with the
+    rainfall 'total', 'days', 'missing', 'mean' and, with a cutoff,
+    'heavy_days'.
+    """
+    result = query_arrays(cube, by, stations, years, months, weekdays, cutoff)
+    labels = result.pop('labels')
+
+    if labels:
+        row_index = pd.MultiIndex.from_product(list(labels.values()), names=list(labels))
+    else:
+        row_index = pd.RangeIndex(1)
+    frame = pd.DataFrame({name: np.ravel(values) for name, values in result.items()}, index=row_index)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        frame['mean'] = frame['total'] / frame['days']
+    return frame.reset_index() if labels else frame
+
+
+def year_range(cube, stations=None):
+    """Return the first and last year with valid data of the selected station(s)."""
+    index, labels = _selection(cube, stations)
+    days_per_year = cube['days'][index].sum(axis=(0, 2, 3))
+    years = labels['year'][days_per_year > 0]
+    return (int(years.min()), int(years.max())) if len(years) else (None, None)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Query the rainfall aggregate cube.')
+    parser.add_argument('--data-root', default='Data', help='folder with one sub folder per station')
+    parser.add_argument('--by', nargs='*', default=['weekday'], choices=DIMENSIONS, help='dimensions to keep')
+    parser.add_argument('--station', nargs='*', default=None, help='station name(s), default all')
+    parser.add_argument('--years', nargs=2, type=int, default=None, help='first and last year')
+    parser.add_argument('--months', nargs='*', type=int, default=None, help='months 1-12, default all')
+    parser.add_argument('--cutoff', type=float, default=5, help='heavy rain day threshold in l/m²')
+    parser.add_argument('--cache-dir', default=RainfallLoader.CACHE_DIR, help='folder of the loader cache and the cube')
+    args = parser.parse_args()
+
+    cube = get_cube(args.data_root, cache_dir=args.cache_dir)
+    years = tuple(args.years) if args.years else None
+    try:
+        result = query(cube, args.by or None, args.station, years, args.months, cutoff=args.cutoff)
+    except ValueError as exc:
+        parser.error(str(exc))
+    print(result.to_string(index=False))
+    print(f'Years with data: {year_range(cube, args.station)}')
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+Memory-mapped fixed-stride daily series, one file per station.
+
+A station has at most one value per day, so its whole history fits a
+dense float32 array indexed by the days since the start date (1980-01-01,
+or the first day of earlier data). Every file starts with a small JSON
+header line (station, start date, number of days), followed by the
+array; missing days, empty cells and the -999 sentinel are NaN. The
+reader opens the array with np.memmap: any date range is a zero-copy
+slice, and all processes reading the files share one page-cached copy
+instead of each parsing the CSVs again.
+
+The weekday and yearly statistics of RainfallEngine run on these arrays
+through the compact frame of RainfallSeries (see analyze).
+
+Run it from the project folder to export all stations, and to print the
+statistics of a date range from the exported files:
+
+    python RainfallDense.py --export
+    python RainfallDense.py --first 1993-01-01 --last 2024-12-31 --cutoff 5
+
+@author: Merlin <|:3
+"""
+import os  # operating system dependent functionality
+import json
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import RainfallLoader
+import RainfallEngine
+import RainfallSeries
+from RainfallLoader import STATION_COLUMN
+
+# Default folder of the exported files
+DENSE_DIR = os.path.join(RainfallLoader.CACHE_DIR, 'dense')
+DENSE_VERSION = 1
+EXTENSION = '.f32'
+
+# Day 0 of the arrays, unless a station has earlier data
+EPOCH = np.datetime64('1980-01-01', 'D')
+
+# Every file starts with this magic, then the JSON header line padded to a multiple of _HEADER_ALIGN bytes
+MAGIC = b'RAINF32\n'
+_HEADER_ALIGN = 64
+
+
+def dense_path(station, output_dir=DENSE_DIR):
+    """File of one station."""
+    return os.path.join(output_dir, station + EXTENSION)
+
+
+def dense_series(arrays):
+    """
+    Place the row arrays of one station on the day axis.
+
+    Returns the start date and the float32 array; days without a valid
+    value are NaN, and of a date found twice the first value counts.
+    """
+    dates = RainfallLoader.build_dates(
+        arrays['year'].astype(np.int64), arrays['month'].astype(np.int64), arrays['day'].astype(np.int64)
+    ).astype('datetime64[D]')
+    valid = ~np.isnat(dates) & (arrays['rainfall'] >= 0)
+    dates, rainfall = dates[valid], arrays['rainfall'][valid]
+    if not len(dates):
+        return EPOCH, np.empty(0, dtype=np.float32)
+
+    start = min(EPOCH, dates.min())
+    index = (dates - start).astype(np.int64)
+    series = np.full(int(index.max()) + 1, np.nan, dtype=np.float32)
+    series[index[::-1]] = rainfall[::-1]  # written last to first, so the first value of a date wins
+    return start, series
+
+
+def write_dense(path, station, start, series):
+    """Write one station's series with its JSON header, replacing the file atomically."""
+    header = json.dumps({
+        'version': DENSE_VERSION, 'station': station, 'start': str(start), 'days': len(series), 'dtype': 'float32',
+    }).encode('utf-8')
+    header_size = -(-(len(MAGIC) + len(header) + 1) // _HEADER_ALIGN) * _HEADER_ALIGN
+    header = MAGIC + header.ljust(header_size - len(MAGIC) - 1) + b'\n'
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as dense_file:
+        dense_file.write(header)
+        dense_file.write(series.astype('<f4').tobytes())
+    os.replace(tmp_path, path)
+
+
+def export_dense(data_root='Data', output_dir=DENSE_DIR, workers=None, cache_dir=RainfallLoader.CACHE_DIR):
+    """
+    Export every station under data_root and return the written paths.
+
+    Files of stations that are no longer under data_root are removed, so
+    open_all only finds the stations of the current export.
+    """
+    station_dirs = RainfallLoader.discover_stations(data_root)
+    arrays = RainfallLoader.load_stations_arrays(station_dirs, workers, cache_dir)
+    paths = []
+    for code, station_dir in enumerate(station_dirs):
+        station = RainfallLoader.station_name(station_dir)
+        rows = arrays['station'] == code
+        start, series = dense_series({field: arrays[field][rows] for field in RainfallLoader.ROW_FIELDS})
+        path = dense_path(station, output_dir)
+        write_dense(path, station, start, series)
+        paths.append(path)
+
+    for name in os.listdir(output_dir) if os.path.isdir(output_dir) else []:
+        path = os.path.join(output_dir, name)
+        if name.endswith(EXTENSION) and path not in paths:
+            os.remove(path)
+    return paths
+
+
+def open_dense(path):
+    """
+    Open one station file read-only.
+
+    Returns the header dict and the series as a np.memmap, so slices are
+    views into the page cache.
+    """
+    with open(path, 'rb') as dense_file:
+        if dense_file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'Not a dense rainfall file: {path}')
+        header_line = dense_file.readline()
+    header = json.loads(header_line)
+    if header['version'] != DENSE_VERSION:
+        raise ValueError(f'Unsupported dense file version {header["version"]} in {path}')
+    header['start'] = np.datetime64(header['start'], 'D')
+    if not header['days']:
+        return header, np.empty(0, dtype=np.float32)
+    series = np.memmap(path, dtype='<f4', mode='r', offset=len(MAGIC) + len(header_line), shape=(header['days'],))
+    return header, series
+
+
+def open_all(output_dir=DENSE_DIR):
+    """Open every station file of output_dir: {station: (header, series)}, sorted by station."""
+    names = sorted(name for name in os.listdir(output_dir) if name.endswith(EXTENSION))
+    opened = [open_dense(os.path.join(output_dir, name)) for name in names]
+    return {header['station']: (header, series) for header, series in opened}
+
+
+def date_slice(header, series, first=None, last=None):
+    """
+    Zero-copy view of the days from first to last (inclusive dates or None for open ends).
+
+    Returns the date of the first day of the view and the view.
+    """
+    start = header['start']
+    begin = 0 if first is None else int((np.datetime64(first, 'D') - start).astype(np.int64))
+    end = len(series) if last is None else int((np.datetime64(last, 'D') - start).astype(np.int64)) + 1
+    begin = min(max(begin, 0), len(series))
+    end = min(max(end, begin), len(series))
+    return start + begin, series[begin:end]
+
+
+def to_compact(opened, first=None, last=None):
+    """
+    Build the compact frame of RainfallSeries from opened series ({station: (header, series)}).
+
+    Only days with a value in the date range are kept, so RainfallEngine
+    can run its aggregations on the result.
+    """
+    stations = list(opened)
+    parts = []
+    for code, (header, series) in enumerate(opened.values()):
+        start, view = date_slice(header, series, first, last)
+        valid = ~np.isnan(view)
+        day = (start - np.datetime64('1970-01-01', 'D')).astype(np.int64) + np.flatnonzero(valid)
+        parts.append((code, day, view[valid]))
+
+    if not parts:
+        parts.append((0, np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)))
+
+    day = np.concatenate([part[1] for part in parts])
+    frame = pd.DataFrame({
+        RainfallSeries.DAY_COLUMN: day.astype(np.int32),
+        RainfallSeries.WEEKDAY_COLUMN: ((day + 3) % 7).astype(np.uint8),  # 1970-01-01 was a Thursday
+        RainfallSeries.RAINFALL_COLUMN: np.concatenate([part[2] for part in parts]),
+    })
+    codes = np.concatenate([np.full(len(part[1]), part[0], dtype=np.int32) for part in parts])
+    frame.insert(0, STATION_COLUMN, pd.Categorical.from_codes(codes, categories=stations))
+    return frame
+
+
+def analyze(output_dir=DENSE_DIR, cutoff=RainfallEngine.RAINY_DAY_CUTOFF, first=None, last=None):
+    """Compute RainfallEngine's statistics from the exported files, optionally for a date range only."""
+    return RainfallEngine.compute_statistics(to_compact(open_all(output_dir), first, last), cutoff)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export or analyze the memory-mapped daily series.')
+    parser.add_argument('--data-root', default='Data', help='folder with one sub folder per station')
+    parser.add_argument('--output-dir', default=DENSE_DIR, help='folder of the exported files')
+    parser.add_argument('--export', action='store_true', help='export every station before analyzing')
+    parser.add_argument('--first', default=None, help='first date (YYYY-MM-DD)')
+    parser.add_argument('--last', default=None, help='last date (YYYY-MM-DD)')
+    parser.add_argument('--cutoff', type=float, default=RainfallEngine.RAINY_DAY_CUTOFF, help='heavy rain day threshold in l/m²')
+    args = parser.parse_args()
+
+    if args.export or not os.path.isdir(args.output_dir):
+        for path in export_dense(args.data_root, args.output_dir):
+            print(f'Exported: {path}')
+    statistics = analyze(args.output_dir, args.cutoff, args.first, args.last)
+    with pd.option_context('display.max_rows', None, 'display.width', 120):
+        for name in ['years', 'weekday', 'yearly']:
+            print(statistics[name].to_string(index=False))
+            print()
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Analysis engine computing all weekday and yearly rainfall statistics at once.
+
+The data is loaded once and grouped in a single pass by station, year and
+weekday. All tables the scripts plot are then derived from that small
+grouped table:
+
+- weekday: mean rainfall and number of heavy rain days per weekday
+- yearly: total rainfall and number of heavy rain days per year
+- years: first and last year of each station
+
+Run it from the project folder to print the tables for every station:
+
+    python RainfallEngine.py --cutoff 5
+
+@author: Merlin <|:3
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import RainfallLoader
+import RainfallQuality
+import RainfallSeries
+import RainfallTrace
+from RainfallLoader import RAINFALL_COLUMN, STATION_COLUMN, WEEKDAY_ORDER
+
+# Default threshold for a "heavy rain day" in l/m²
+RAINY_DAY_CUTOFF = 5
+
+# Rainfall sums are computed as integers in this fraction of a l/m²
+SUM_SCALE = 1000
+
+
+def to_milli(rainfall):
+    """Rainfall in integer thousandths of a l/m² (0 for empty values), for exact sums in any order."""
+    rainfall = np.asarray(rainfall, dtype=np.float64)
+    return np.where(np.isnan(rainfall), 0, np.rint(np.nan_to_num(rainfall) * SUM_SCALE)).astype(np.int64)
+
+
+def aggregate(df_final, cutoff=RAINY_DAY_CUTOFF):
+    """
+    Group the rows once by station, year and weekday.
+
+    Works on the loader's data frame as well as on the compact frame of
+    RainfallSeries. Returns a table with the rainfall sum ('total_milli',
+    see SUM_SCALE), the number of 'days' and the number of 'heavy_days'
+    (rainfall > cutoff) of every group. Rows without a weekday are kept in
+    their own group, so they still count per year. Because the sums are
+    integers, partial tables of any split of the rows can be merged
+    exactly (see merge_partials).
+    """
+    keys = [STATION_COLUMN, 'Year', 'Weekday'] if STATION_COLUMN in df_final else ['Year', 'Weekday']
+    if RainfallSeries.DAY_COLUMN in df_final:
+        # Compact frame: derive year and weekday on demand and compare in float32
+        rainfall = df_final[RainfallSeries.RAINFALL_COLUMN].to_numpy()
+        key_frame = pd.DataFrame({'Year': RainfallSeries.years(df_final), 'Weekday': RainfallSeries.weekdays(df_final)})
+        if STATION_COLUMN in df_final:
+            key_frame.insert(0, STATION_COLUMN, df_final[STATION_COLUMN].array)
+        heavy = rainfall > np.float32(cutoff)
+    else:
+        key_frame = df_final[keys]
+        rainfall = df_final[RAINFALL_COLUMN].to_numpy()
+        heavy = rainfall > cutoff
+
+    with RainfallTrace.stage('groupby', rows=len(rainfall)):
+        grouped = key_frame.assign(
+            total_milli=to_milli(rainfall), days=~np.isnan(rainfall), heavy_days=heavy
+        ).groupby(keys, observed=True, dropna=False, sort=True)
+        partial = grouped[['total_milli', 'days', 'heavy_days']].sum().reset_index()
+
+    if STATION_COLUMN not in partial:
+        partial.insert(0, STATION_COLUMN, pd.Categorical([''] * len(partial)))
+    partial[['days', 'heavy_days']] = partial[['days', 'heavy_days']].astype('int64')
+    return partial
+
+
+def merge_partials(partials):
+    """Merge partial tables of aggregate (e.g. of different chunks of rows) into one."""
+    partials = list(partials)
+    if len(partials) == 1:
+        return partials[0]
+    merged = pd.concat(partials, ignore_index=True).groupby(
+        [STATION_COLUMN, 'Year', 'Weekday'], observed=True, dropna=False, sort=True
+    )[['total_milli', 'days', 'heavy_days']].sum()
+    return merged.reset_index()
+
+
+def weekday_table(partial):
+    """Mean rainfall and heavy rain days per station and weekday, all seven weekdays per station."""
+    per_weekday = partial.dropna(subset=['Weekday']).groupby(
+        [STATION_COLUMN, 'Weekday'], observed=False, sort=True
+    )[['total_milli', 'days', 'heavy_days']].sum()
+
+    per_weekday['total'] = per_weekday['total_milli'] / SUM_SCALE
+    per_weekday['mean'] = per_weekday['total'] / per_weekday['days']
+    per_weekday = per_weekday.reset_index()
+    per_weekday['Weekday'] = pd.Categorical(per_weekday['Weekday'], categories=WEEKDAY_ORDER, ordered=True)
+    return per_weekday[[STATION_COLUMN, 'Weekday', 'mean', 'heavy_days', 'total', 'days']]
+
+
+def yearly_table(partial):
+    """Total rainfall and heavy rain days per station and year."""
+    per_year = partial.groupby([STATION_COLUMN, 'Year'], observed=True, sort=True)[
+        ['total_milli', 'days', 'heavy_days']
+    ].sum()
+    per_year['total'] = per_year['total_milli'] / SUM_SCALE
+    per_year = per_year.reset_index()
+    # The compact representation keys on int16 years; the tables always have int64 years
+    per_year['Year'] = per_year['Year'].astype('int64')
+    return per_year[[STATION_COLUMN, 'Year', 'total', 'heavy_days', 'days']]
+
+
+def year_range_table(partial):
+    """First and last year with data per station."""
+    years = partial.groupby(STATION_COLUMN, observed=True, sort=True)['Year'].agg(['min', 'max']).astype('int64')
+    return years.rename(columns={'min': 'min_year', 'max': 'max_year'}).reset_index()
+
+
+def statistics_from_partial(partial, cutoff=RAINY_DAY_CUTOFF):
+    """Derive all statistics tables from a (merged) partial table of aggregate."""
+    with RainfallTrace.stage('tables', rows=len(partial)):
+        return {
+            'cutoff': cutoff,
+            'weekday': weekday_table(partial),
+            'yearly': yearly_table(partial),
+            'years': year_range_table(partial),
+        }
+
+
+def compute_statistics(df_final, cutoff=RAINY_DAY_CUTOFF):
+    """Compute all weekday and yearly statistics of a loaded data frame in one grouped pass."""
+    return statistics_from_partial(aggregate(df_final, cutoff), cutoff)
+
+
+def analyze(station_dirs=None, data_root='Data', cutoff=RAINY_DAY_CUTOFF, workers=None,
+            cache_dir=RainfallLoader.CACHE_DIR, compact=False, min_coverage=None):
+    """
+    Load the given station directories (default: all under data_root) once
+    and compute all statistics (see compute_statistics). With compact, the
+    analyses run on the compact representation of RainfallSeries. With
+    min_coverage, years below that share of valid days are left out, based
+    on the quality data RainfallQuality persists per station in cache_dir.
+    """
+    if station_dirs is None:
+        station_dirs = RainfallLoader.discover_stations(data_root)
+    arrays = RainfallLoader.load_stations_arrays(station_dirs, workers, cache_dir)
+    stations = [RainfallLoader.station_name(station_dir) for station_dir in station_dirs]
+    if min_coverage is not None:
+        quality = RainfallQuality.build_quality(station_dirs, workers=workers, cache_dir=cache_dir)
+        arrays = RainfallQuality.filter_arrays(arrays, stations, quality, min_coverage)
+    if compact:
+        return compute_statistics(RainfallSeries.to_compact(arrays, stations), cutoff)
+    return compute_statistics(RainfallLoader.to_frame(arrays, stations=stations), cutoff)
+
+
+def station_rows(table, station):
+    """Select the rows of one station from a statistics table."""
+    return table[table[STATION_COLUMN] == station].reset_index(drop=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Print weekday and yearly rainfall statistics.')
+    parser.add_argument('--data-root', default='Data', help='folder with one sub folder per station')
+    parser.add_argument('--cutoff', type=float, default=RAINY_DAY_CUTOFF, help='heavy rain day threshold in l/m²')
+    parser.add_argument('--workers', type=int, default=None, help='number of loader processes')
+    parser.add_argument('--compact', action='store_true', help='run on the compact representation')
+    parser.add_argument('--min-coverage', type=float, default=None, help='leave out years below this coverage (0-1)')
+    args = parser.parse_args()
+
+    statistics = analyze(data_root=args.data_root, cutoff=args.cutoff, workers=args.workers, compact=args.compact,
+                         min_coverage=args.min_coverage)
+    with pd.option_context('display.max_rows', None, 'display.width', 120):
+        for name in ['years', 'weekday', 'yearly']:
+            print(statistics[name].to_string(index=False))
+            print()
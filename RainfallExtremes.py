@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+"""
+Multi-day rainfall extremes and return levels of all stations.
+
+Flood planning looks at rainfall totals over several days, not only at
+single heavy rain days. On the aligned stations × days matrix of
+RainfallMatrix this module computes
+
+- the rolling 1-, 2-, 3-, 5- and 7-day totals of every station from one
+  cumulative sum per station (integer thousandths of a l/m², so exact); a
+  total only counts if every day of its window has a valid value
+- the annual maximum of every duration, for years in which enough windows
+  are valid
+- a Gumbel or GEV fit of the annual maxima by L-moments, batched over all
+  stations and durations, and the return levels (e.g. the 10-, 50- and
+  100-year event) derived from it
+
+Run it from the project folder, e.g.:
+
+    python RainfallExtremes.py --durations 1 2 3 5 7 --return-periods 10 50 100 --render
+    python RainfallExtremes.py --distribution gev --station Muenchen-Stadt
+
+@author: Merlin <|:3
+"""
+import os  # operating system dependent functionality
+import math
+import argparse
+
+import numpy as np
+import pandas as pd
+import matplotlib.style
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+import RainfallEngine
+import RainfallMatrix
+import RainfallQuality
+import RainfallRender
+from RainfallLoader import STATION_COLUMN
+
+DURATIONS = [1, 2, 3, 5, 7]
+RETURN_PERIODS = [10, 50, 100]
+DISTRIBUTIONS = ['gumbel', 'gev']
+
+# A year's maximum only counts if at least this share of its windows is valid
+MIN_COVERAGE = RainfallQuality.MIN_COVERAGE
+
+# Euler–Mascheroni constant, the mean of the standard Gumbel distribution
+_EULER = 0.5772156649015329
+
+# Labels of the return level graph
+LANGUAGES = {
+    'en': {
+        'period': 'Return Period (Years)',
+        'ylabel': 'Rainfall (Liters per m²)',
+        'duration': '{duration}-day total',
+        'title': 'Return Levels of Multi-Day Rainfall ({distribution}, {first}–{last})',
+    },
+    'de': {
+        'period': 'Wiederkehrperiode (Jahre)',
+        'ylabel': 'Niederschlag (Liter pro m²)',
+        'duration': '{duration}-Tages-Summe',
+        'title': 'Wiederkehrwerte mehrtägigen Niederschlags ({distribution}, {first}–{last})',
+    },
+}
+
+
+def rolling_sums(matrix, durations=DURATIONS):
+    """
+    Rolling totals of every duration for every station, as of the last day of the window.
+
+    Returns a float array of shape durations × stations × days; windows
+    with a day without a valid value (and the first days, before a full
+    window) are NaN.
+    """
+    valid = matrix['valid']
+    milli = RainfallEngine.to_milli(np.where(valid, matrix['values'], 0))
+    n_stations, n_days = milli.shape
+
+    # Cumulative sums with a leading zero column: the total of days (a, b] is cumsum[b] - cumsum[a]
+    totals = np.zeros((n_stations, n_days + 1), dtype=np.int64)
+    np.cumsum(milli, axis=1, out=totals[:, 1:])
+    counts = np.zeros((n_stations, n_days + 1), dtype=np.int64)
+    np.cumsum(valid, axis=1, out=counts[:, 1:])
+
+    sums = np.full((len(durations), n_stations, n_days), np.nan)
+    for i, duration in enumerate(durations):
+        window = totals[:, duration:] - totals[:, :-duration]
+        complete = (counts[:, duration:] - counts[:, :-duration]) == duration
+        sums[i, :, duration - 1:] = np.where(complete, window / RainfallEngine.SUM_SCALE, np.nan)
+    return sums
+
+
+def annual_maxima(matrix, sums, durations=DURATIONS, min_coverage=MIN_COVERAGE):
+    """
+    Annual maximum of every duration and station from rolling_sums.
+
+    A window belongs to the year of its last day. Returns a table with
+    station, duration, Year, maximum and coverage (share of the year's
+    windows that are valid); years below min_coverage are left out.
+    """
+    day_years = RainfallMatrix.dates(matrix).astype('datetime64[Y]').astype(np.int64) + 1970
+    if not len(day_years):
+        return pd.DataFrame(columns=[STATION_COLUMN, 'duration', 'Year', 'maximum', 'coverage'])
+    starts = np.flatnonzero(np.diff(day_years, prepend=day_years[0] - 1))
+    years = day_years[starts]
+    days_in_year = 365 + ((years % 4 == 0) & ((years % 100 != 0) | (years % 400 == 0)))
+
+    # One reduceat per quantity over all durations and stations at once
+    with np.errstate(invalid='ignore'):
+        maxima = np.fmax.reduceat(sums, starts, axis=2)
+    coverage = np.add.reduceat(~np.isnan(sums), starts, axis=2) / days_in_year
+
+    n_durations, n_stations, n_years = maxima.shape
+    table = pd.DataFrame({
+        STATION_COLUMN: np.tile(np.repeat(matrix['stations'], n_years), n_durations),
+        'duration': np.repeat(durations, n_stations * n_years),
+        'Year': np.tile(years, n_durations * n_stations),
+        'maximum': maxima.ravel(),
+        'coverage': coverage.ravel(),
+    })
+    return table[table['coverage'] >= min_coverage].reset_index(drop=True)
+
+
+def _padded(maxima):
+    """
+    Sorted annual maxima of every (station, duration) as rows of a NaN-padded array.
+
+    Returns the (station, duration) keys, the array, the number of years
+    and the first and last year of every row.
+    """
+    groups = list(maxima.groupby([STATION_COLUMN, 'duration']))
+    sizes = np.array([len(group) for _, group in groups], dtype=np.int64)
+    values = np.full((len(groups), max(sizes, default=0)), np.nan)
+    for row, (_, group) in enumerate(groups):
+        values[row, :len(group)] = np.sort(group['maximum'].to_numpy())
+    first_year = np.array([group['Year'].min() for _, group in groups], dtype=np.int64)
+    last_year = np.array([group['Year'].max() for _, group in groups], dtype=np.int64)
+    return [key for key, _ in groups], values, sizes, first_year, last_year
+
+
+def l_moments(values, sizes):
+    """
+    First three sample L-moments of every row of ascending, NaN-padded values.
+
+    Returns l1, l2 and the L-skewness t3 as arrays, one entry per row.
+    """
+    n = sizes[:, None].astype(np.float64)
+    rank = np.arange(values.shape[1])[None, :].astype(np.float64)  # i - 1 for the i-th smallest value
+    x = np.nan_to_num(values)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        b0 = x.sum(axis=1) / n[:, 0]
+        b1 = (x * rank / (n - 1)).sum(axis=1) / n[:, 0]
+        b2 = (x * rank * (rank - 1) / ((n - 1) * (n - 2))).sum(axis=1) / n[:, 0]
+        l2 = 2 * b1 - b0
+        t3 = (6 * b2 - 6 * b1 + b0) / l2
+    return b0, l2, t3
+
+
+def fit(maxima, distribution='gumbel'):
+    """
+    Fit a Gumbel or GEV distribution to the annual maxima of every station and duration by L-moments.
+
+    Returns a table with station, duration, years, first_year, last_year,
+    location, scale and shape (0 for Gumbel; GEV in Hosking's sign
+    convention, negative for a heavy upper tail).
+    """
+    keys, values, sizes, first_year, last_year = _padded(maxima)
+    l1, l2, t3 = l_moments(values, sizes)
+    if distribution == 'gumbel':
+        shape = np.zeros(len(keys))
+        scale = l2 / math.log(2)
+        location = l1 - _EULER * scale
+    elif distribution == 'gev':
+        # Hosking, Wallis and Wood (1985) approximation of the shape from the L-skewness
+        z = 2 / (3 + t3) - math.log(2) / math.log(3)
+        shape = 7.8590 * z + 2.9554 * z ** 2
+        gamma = np.array([math.gamma(1 + k) if np.isfinite(k) else np.nan for k in shape])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            scale = np.where(np.abs(shape) > 1e-6, l2 * shape / ((1 - 2 ** -shape) * gamma), l2 / math.log(2))
+            location = np.where(np.abs(shape) > 1e-6, l1 - scale * (1 - gamma) / shape, l1 - _EULER * scale)
+    else:
+        raise ValueError(f'Unknown distribution: {distribution}')
+
+    return pd.DataFrame({
+        STATION_COLUMN: [key[0] for key in keys],
+        'duration': [key[1] for key in keys],
+        'years': sizes,
+        'first_year': first_year,
+        'last_year': last_year,
+        'distribution': distribution,
+        'location': location,
+        'scale': scale,
+        'shape': shape,
+    })
+
+
+def quantiles(fits, return_periods=RETURN_PERIODS):
+    """Return levels of fitted distributions: fits × return periods array of the T-year events."""
+    y = -np.log(1 - 1 / np.asarray(return_periods, dtype=np.float64))[None, :]  # -ln(F) of the T-year event
+    location, scale = fits['location'].to_numpy()[:, None], fits['scale'].to_numpy()[:, None]
+    shape = fits['shape'].to_numpy()[:, None]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        gev = location + scale / shape * (1 - y ** shape)
+    return np.where(np.abs(shape) > 1e-6, gev, location - scale * np.log(y))
+
+
+def return_levels(fits, return_periods=RETURN_PERIODS):
+    """Table of the fits with one return_<T>y column per return period."""
+    levels = quantiles(fits, return_periods)
+    table = fits[[STATION_COLUMN, 'duration', 'years', 'first_year', 'last_year']].copy()
+    for i, period in enumerate(return_periods):
+        table[f'return_{period:g}y'] = levels[:, i]
+    return table
+
+
+def extremes(matrix, durations=DURATIONS, return_periods=RETURN_PERIODS, distribution='gumbel',
+             min_coverage=MIN_COVERAGE):
+    """Annual maxima, fits and return levels of every station and duration in one call."""
+    maxima = annual_maxima(matrix, rolling_sums(matrix, durations), durations, min_coverage)
+    fits = fit(maxima, distribution)
+    return {'maxima': maxima, 'fits': fits, 'return_levels': return_levels(fits, return_periods)}
+
+
+def draw_return_levels(fig, result, station, lang='en'):
+    """
+    Fitted return level curves and the annual maxima at their plotting positions, one color per duration.
+
+    Raises ValueError if the station has no fitted duration (no year with
+    enough valid windows).
+    """
+    labels = LANGUAGES[lang]
+    fits = RainfallEngine.station_rows(result['fits'], station)
+    if fits.empty:
+        raise ValueError(f'No year with enough valid windows to fit: {station}')
+    maxima = RainfallEngine.station_rows(result['maxima'], station)
+    periods = np.logspace(np.log10(1.1), np.log10(200), 100)
+    levels = quantiles(fits, periods)
+
+    ax = fig.add_subplot()
+    for i, row in fits.iterrows():
+        values = np.sort(maxima.loc[maxima['duration'] == row['duration'], 'maximum'].to_numpy())
+        # Gringorten plotting positions of the sorted annual maxima
+        empirical = 1 / (1 - (np.arange(1, len(values) + 1) - 0.44) / (len(values) + 0.12))
+        line, = ax.plot(periods, levels[i], linewidth=2, label=labels['duration'].format(duration=row['duration']))
+        ax.scatter(empirical, values, color=line.get_color(), s=12)
+    ax.set_xscale('log')
+    ax.set_xlabel(labels['period'])
+    ax.set_ylabel(labels['ylabel'])
+    title = labels['title'].format(distribution=fits.loc[0, 'distribution'].upper(), first=fits['first_year'].min(),
+                                   last=fits['last_year'].max())
+    ax.set_title(f'{title}\n{station}')
+    ax.grid(visible=True, color='gray', linestyle='--', linewidth=1, alpha=0.5)
+    ax.legend()
+    fig.tight_layout()
+    return ax
+
+
+def fitted_stations(result):
+    """Stations with at least one fitted duration, in the order of the fits."""
+    return list(dict.fromkeys(result['fits'][STATION_COLUMN]))
+
+
+def render_return_levels(result, station, lang='en', output_dir='graphs', dpi=300, style=RainfallRender.DEFAULT_STYLE):
+    """Render the return level graph of one station headlessly into <output_dir>/<station>/ and return its path."""
+    with matplotlib.style.context(style):
+        fig = Figure(figsize=(10, 6))
+        FigureCanvasAgg(fig)
+        draw_return_levels(fig, result, station, lang)
+        fits = RainfallEngine.station_rows(result['fits'], station)
+        output_path = os.path.join(output_dir, station, f"ReturnLevels_{fits.loc[0, 'distribution']}_{lang}_"
+                                   f"{fits['first_year'].min()}-{fits['last_year'].max()}.png")
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        fig.savefig(output_path, dpi=dpi)
+    return output_path
+
+
+def return_period(text):
+    """Parse a return period in years; it has to be longer than one year."""
+    period = float(text)
+    if not period > 1:
+        raise argparse.ArgumentTypeError(f'return periods must be greater than 1 year, got {text}')
+    return period
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Multi-day rainfall extremes and return levels.')
+    parser.add_argument('--data-root', default='Data', help='folder with one sub folder per station')
+    parser.add_argument('--station', nargs='*', default=None, help='station name(s), default all')
+    parser.add_argument('--durations', type=int, nargs='*', default=DURATIONS, help='window lengths in days')
+    parser.add_argument('--return-periods', type=return_period, nargs='*', default=RETURN_PERIODS, help='return periods in years')
+    parser.add_argument('--distribution', default='gumbel', choices=DISTRIBUTIONS, help='extreme value distribution')
+    parser.add_argument('--min-coverage', type=float, default=MIN_COVERAGE, help='share of valid windows of a year (0-1)')
+    parser.add_argument('--csv-prefix', default=None, help='write <prefix>_maxima.csv and <prefix>_return_levels.csv')
+    parser.add_argument('--render', action='store_true', help='render the return level graph of every station')
+    parser.add_argument('--lang', nargs='*', default=['en'], choices=list(LANGUAGES), help='languages of the graph')
+    args = parser.parse_args()
+
+    matrix = RainfallMatrix.select(RainfallMatrix.build_matrix(data_root=args.data_root), args.station)
+    result = extremes(matrix, args.durations, args.return_periods, args.distribution, args.min_coverage)
+    with pd.option_context('display.max_rows', None, 'display.width', 160):
+        print(result['return_levels'].round(1).to_string(index=False))
+
+    if args.csv_prefix:
+        for name in ('maxima', 'return_levels'):
+            result[name].to_csv(f'{args.csv_prefix}_{name}.csv', index=False)
+            print(f'Extremes saved as: {args.csv_prefix}_{name}.csv')
+    if args.render:
+        fitted = fitted_stations(result)
+        for station in matrix['stations']:
+            if station not in fitted:
+                print(f'No graph for {station}: no year with at least {args.min_coverage:.0%} valid windows')
+                continue
+            for lang in args.lang:
+                print(f'Graph saved as: {render_return_levels(result, station, lang)}')
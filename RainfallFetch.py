@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+"""
+Concurrent downloader of station data from wetterkontor.de.
+
+Every file in Data/<Station>/ covers one period of a year: four-month
+periods (T1-T3) up to 2019 and quarters (Q1-Q4) from 2020 on. The
+downloader plans one request per station × period that has no file yet
+and runs them concurrently with asyncio:
+
+- a pool of keep-alive HTTP/1.1 connections per host, built on asyncio
+  streams (no extra packages needed), limits the open connections
+- a rate limit spaces the requests out evenly
+- failed requests (connection errors, timeouts, 429 and 5xx answers) are
+  retried with exponential backoff
+- each file is written under its final name only when complete, so an
+  interrupted run simply continues with the missing files when restarted
+
+Answers must be in the CSV format of the files in Data/ (the chart export
+with the "category,Niederschlag (6 bis 6 UTC)" header); anything else is
+reported as failed and not written. The new files are then handed to the
+loader, which parses them into its cache.
+
+The station IDs are the "id" parameter of the wetterkontor.de review page
+of a station. The CSV export address of the site is not known here, so
+the download address has to be given as --url-template. To try the
+downloader without the internet, serve an existing data folder as a
+stand-in for the site and fetch from it:
+
+    python RainfallFetch.py --serve 8000 --data-root Data --station Muenchen-Stadt=175
+    python RainfallFetch.py --data-root Download --station Muenchen-Stadt=175 --years 1980 2024 \\
+        --url-template "http://127.0.0.1:8000/rueckblick.asp?id={station_id}&datum0={first:%d.%m.%Y}&datum1={last:%d.%m.%Y}"
+
+@author: Merlin <|:3
+"""
+import os  # operating system dependent functionality
+import re
+import ssl
+import codecs
+import asyncio
+import argparse
+import datetime
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import RainfallLoader
+from RainfallLoader import PERIODS, QUARTER_YEAR, period_dates
+
+# Review page of a station; it answers with HTML, not CSV, so it only documents the parameters
+REVIEW_URL = ('https://www.wetterkontor.de/de/wetter/deutschland/rueckblick.asp'
+              '?id={station_id}&datum0={first:%d.%m.%Y}&datum1={last:%d.%m.%Y}&t=8&part=0')
+
+# Defaults: open connections, requests per second, retries per request, first backoff and timeout in seconds
+CONNECTIONS = 4
+RATE = 2.0
+RETRIES = 4
+BACKOFF = 1.0
+TIMEOUT = 30.0
+
+# Answers worth another try
+RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+
+USER_AGENT = 'Rainfall-Rituals'
+
+
+class FetchError(Exception):
+    """An answer that cannot become a data file."""
+
+
+def plan_downloads(stations, first_year, last_year, data_root, url_template, today=None):
+    """
+    List the downloads of every station × period without a file yet.
+
+    stations maps station names to their wetterkontor.de IDs; url_template
+    is the address of a CSV download with {station_id}, {first} and {last}
+    (datetime.date objects). Periods that
+    are not over yet (by today) are left out, so no incomplete file gets
+    written. Returns (path, url) pairs; the file names follow Data/, e.g.
+    Data/Muenchen-Stadt/Muenchen_Stadt_2020Q1.csv.
+    """
+    today = today or datetime.date.today()
+    downloads = []
+    for station, station_id in stations.items():
+        prefix = station.replace('-', '_')
+        for year in range(first_year, last_year + 1):
+            kind = 'Q' if year >= QUARTER_YEAR else 'T'
+            months = 12 // len(PERIODS[kind])
+            for number, first_month in enumerate(PERIODS[kind], start=1):
+                dates = period_dates(year, first_month, months)
+                first, last = dates[0].astype(object), dates[-1].astype(object)
+                path = os.path.join(data_root, station, f'{prefix}_{year}{kind}{number}.csv')
+                if last >= today or os.path.exists(path):
+                    continue
+                downloads.append((path, url_template.format(station_id=station_id, first=first, last=last)))
+    return downloads
+
+
+class RateLimiter:
+    """Spaces out the start of requests to at most rate per second (None or 0: no limit)."""
+
+    def __init__(self, rate=RATE):
+        self.interval = 1 / rate if rate else 0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        """Wait for the next free slot; slots are handed out in order without holding the lock while sleeping."""
+        async with self._lock:
+            now = asyncio.get_running_loop().time()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+
+class ConnectionPool:
+    """
+    Keep-alive HTTP/1.1 connections for GET requests, at most size open at once.
+
+    Connections are kept per (scheme, host, port) and reused by the next
+    request to the same host. A reused connection the server has closed
+    in the meantime is replaced by a new one transparently.
+    """
+
+    def __init__(self, size=CONNECTIONS, timeout=TIMEOUT):
+        self.timeout = timeout
+        self.opened = 0
+        self._idle = {}
+        self._slots = asyncio.Semaphore(size)
+
+    async def get(self, url):
+        """GET url and return the status, the headers (lower-case names) and the body."""
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80))
+        async with self._slots:
+            idle = self._idle.setdefault(key, [])
+            while True:
+                reused = bool(idle)
+                reader, writer = idle.pop() if reused else await self._connect(key)
+                try:
+                    status, headers, body, keep_alive = await asyncio.wait_for(
+                        self._exchange(reader, writer, parts), self.timeout)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    writer.close()
+                    if reused:
+                        continue
+                    raise
+                except BaseException:
+                    writer.close()
+                    raise
+                if keep_alive:
+                    idle.append((reader, writer))
+                else:
+                    writer.close()
+                return status, headers, body
+
+    async def _connect(self, key):
+        scheme, host, port = key
+        self.opened += 1
+        return await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=ssl.create_default_context() if scheme == 'https' else None),
+            self.timeout)
+
+    async def _exchange(self, reader, writer, parts):
+        target = parts.path or '/'
+        if parts.query:
+            target += '?' + parts.query
+        writer.write((f'GET {target} HTTP/1.1\r\nHost: {parts.netloc}\r\nUser-Agent: {USER_AGENT}\r\n'
+                      'Accept-Encoding: identity\r\nConnection: keep-alive\r\n\r\n').encode('latin-1'))
+        await writer.drain()
+
+        # "HTTP/1.1 200 OK"; the reason phrase may be missing
+        version, _, status = (await reader.readuntil(b'\r\n')).decode('latin-1').strip().partition(' ')
+        status = status.partition(' ')[0]
+        headers = {}
+        while True:
+            line = await reader.readuntil(b'\r\n')
+            if line == b'\r\n':
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readuntil(b'\r\n')).split(b';')[0], 16)
+                chunks.append(await reader.readexactly(size + 2))
+                if not size:
+                    break
+            body = b''.join(chunk[:-2] for chunk in chunks)
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        else:
+            body = await reader.read()
+            keep_alive = False
+        return int(status), headers, body, keep_alive
+
+    def close(self):
+        """Close all idle connections."""
+        for connections in self._idle.values():
+            for _, writer in connections:
+                writer.close()
+        self._idle.clear()
+
+
+def check_body(body):
+    """Raise FetchError unless the answer looks like a data file (BOM optional, CSV header, data lines)."""
+    text = body[len(codecs.BOM_UTF8):] if body.startswith(codecs.BOM_UTF8) else body
+    if not text.startswith(b'category') or not re.search(rb'\n[A-Z][a-z] \d\d\.\d\d\.,', text):
+        raise FetchError('answer is not in the CSV format of the data files')
+
+
+def write_file(path, body):
+    """Write a downloaded file under its final name only once it is complete."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    part_path = path + '.part'
+    with open(part_path, 'wb') as part_file:
+        part_file.write(body)
+    os.replace(part_path, path)
+
+
+async def fetch_one(pool, limiter, path, url, retries=RETRIES, backoff=BACKOFF):
+    """Download one file with retries; returns a dict with path, url, attempts and error (None if written)."""
+    error = None
+    for attempt in range(retries + 1):
+        if attempt:
+            await asyncio.sleep(delay)
+        await limiter.wait()
+        delay = backoff * 2 ** attempt
+        try:
+            status, headers, body = await pool.get(url)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as exc:
+            error = f'{type(exc).__name__}: {exc}'
+            continue
+        if status in RETRY_STATUS:
+            error = f'HTTP {status}'
+            if headers.get('retry-after', '').isdigit():
+                delay = max(delay, int(headers['retry-after']))
+            continue
+        try:
+            if status != 200:
+                raise FetchError(f'HTTP {status}')
+            check_body(body)
+        except FetchError as exc:
+            return {'path': path, 'url': url, 'attempts': attempt + 1, 'error': str(exc)}
+        write_file(path, body)
+        return {'path': path, 'url': url, 'attempts': attempt + 1, 'error': None}
+    return {'path': path, 'url': url, 'attempts': retries + 1, 'error': error}
+
+
+async def fetch_all(downloads, connections=CONNECTIONS, rate=RATE, retries=RETRIES, backoff=BACKOFF,
+                    timeout=TIMEOUT):
+    """Run all (path, url) downloads concurrently over one connection pool and return their results."""
+    pool = ConnectionPool(connections, timeout)
+    limiter = RateLimiter(rate)
+    try:
+        return await asyncio.gather(*(fetch_one(pool, limiter, path, url, retries, backoff)
+                                      for path, url in downloads))
+    finally:
+        pool.close()
+
+
+def fetch(stations, first_year, last_year, data_root, url_template, connections=CONNECTIONS,
+          rate=RATE, retries=RETRIES, backoff=BACKOFF, timeout=TIMEOUT, ingest=True):
+    """
+    Download all missing files of the stations ({name: ID}) and years.
+
+    With ingest, every station that got new files is loaded once, so the
+    loader parses the new files into its cache right away. Returns the
+    results of fetch_one.
+    """
+    downloads = plan_downloads(stations, first_year, last_year, data_root, url_template)
+    results = asyncio.run(fetch_all(downloads, connections, rate, retries, backoff, timeout)) if downloads else []
+    if ingest:
+        written = {os.path.dirname(result['path']) for result in results if result['error'] is None}
+        for station_dir in sorted(written):
+            RainfallLoader.load_station_arrays(station_dir)
+    return results
+
+
+class RecordedHandler(BaseHTTPRequestHandler):
+    """Answers download requests with the matching file of a data folder, like the site would."""
+
+    protocol_version = 'HTTP/1.1'
+    data_root = 'Data'
+    stations = {}  # ID → station name
+
+    def do_GET(self):
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+        try:
+            station = self.stations[query['id'][0]]
+            first = datetime.datetime.strptime(query['datum0'][0], '%d.%m.%Y').date()
+        except (KeyError, ValueError):
+            self.send_error(400)
+            return
+        kind = 'Q' if first.year >= QUARTER_YEAR else 'T'
+        number = PERIODS[kind].index(first.month) + 1 if first.month in PERIODS[kind] else 0
+        path = os.path.join(self.data_root, station, f"{station.replace('-', '_')}_{first.year}{kind}{number}.csv")
+        if not os.path.exists(path):
+            self.send_error(404)
+            return
+        with open(path, 'rb') as csv_file:
+            body = csv_file.read()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/csv; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_recorded(data_root, stations, host='127.0.0.1', port=0):
+    """
+    Start a stand-in for the site that serves the files of data_root.
+
+    stations maps station names to the IDs to answer for. Returns the
+    (not yet serving) server; its port is server.server_address[1].
+    """
+    handler = type('Handler', (RecordedHandler,), {
+        'data_root': data_root, 'stations': {str(station_id): station for station, station_id in stations.items()},
+    })
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def parse_station(text):
+    """Parse a "Name=ID" station argument."""
+    name, separator, station_id = text.partition('=')
+    if not separator or not name or not station_id:
+        raise argparse.ArgumentTypeError(f'expected Name=ID, got {text!r}')
+    return name, station_id
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Download missing station files from wetterkontor.de.')
+    parser.add_argument('--data-root', default='Data', help='folder with one sub folder per station')
+    parser.add_argument('--station', type=parse_station, nargs='+', required=True,
+                        help='station folder name and wetterkontor.de ID, e.g. Muenchen-Stadt=175')
+    parser.add_argument('--years', type=int, nargs=2, default=[1980, datetime.date.today().year],
+                        metavar=('FIRST', 'LAST'), help='years to download')
+    parser.add_argument('--url-template', default=None,
+                        help='CSV download address with {station_id}, {first}, {last} (required unless --serve)')
+    parser.add_argument('--connections', type=int, default=CONNECTIONS, help='open connections at most')
+    parser.add_argument('--rate', type=float, default=RATE, help='requests per second at most (0: no limit)')
+    parser.add_argument('--retries', type=int, default=RETRIES, help='retries of a failed request')
+    parser.add_argument('--no-ingest', action='store_true', help='do not parse the new files into the loader cache')
+    parser.add_argument('--serve', type=int, default=None, metavar='PORT',
+                        help='serve the files of --data-root as a stand-in for the site instead')
+    args = parser.parse_args()
+    if args.serve is None and not args.url_template:
+        parser.error('--url-template is required: the review page of wetterkontor.de answers with HTML, not CSV')
+
+    if args.serve is not None:
+        server = serve_recorded(args.data_root, dict(args.station), port=args.serve)
+        print(f'Serving {args.data_root} on http://127.0.0.1:{server.server_address[1]}/')
+        server.serve_forever()
+    else:
+        results = fetch(dict(args.station), args.years[0], args.years[1], args.data_root, args.url_template,
+                        args.connections, args.rate, args.retries, ingest=not args.no_ingest)
+        for result in results:
+            if result['error'] is None:
+                print(f"Downloaded: {result['path']}")
+            else:
+                print(f"Failed after {result['attempts']} attempts: {result['path']} ({result['error']})")
+        print(f"{sum(result['error'] is None for result in results)} of {len(results)} files downloaded")
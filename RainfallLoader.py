@@ -0,0 +1,431 @@
+# -*- coding: utf-8 -*-
+"""
+Shared loader for the daily rainfall CSV files of the weather stations.
+
+A station directory is parsed once and stored as a compact columnar .npz
+cache. Every cached file is keyed on its path, size and modification time,
+so later runs load the cache and only re-parse files that were added or
+changed. Whenever the cache of a station is written, RainfallQuality
+checks its data once and stores the result next to it. Several stations
+can be loaded in parallel into one data frame.
+
+@author: Merlin <|:3
+"""
+import os  # operating system dependent functionality
+import io  # in-memory buffer for the bulk parser
+import codecs  # UTF-8 byte order mark
+import glob  # finds all the pathnames matching a specified pattern
+import re  # Regex for extracting year
+import hashlib  # names of per data root cache files
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+import pandas as pd
+
+import RainfallTrace
+
+# Weekday initials as they appear in the source data, in calendar order
+WEEKDAY_ORDER = ['Mo', 'Di', 'Mi', 'Do', 'Fr', 'Sa', 'So']
+
+# Column names of the loaded data frame
+RAINFALL_COLUMN = 'Rainfall_in_Liters_per_m²'
+COLUMNS = ['Date', RAINFALL_COLUMN, 'Year', 'Weekday', 'Full_Date']
+
+STATION_COLUMN = 'station'
+
+# German column names, used by the *Ge.py scripts
+GERMAN_COLUMNS = {
+    STATION_COLUMN: 'Station',
+    'Date': 'Datum',
+    RAINFALL_COLUMN: 'Niederschlag_in_Liter_pro_m²',
+    'Year': 'Jahr',
+    'Weekday': 'Wochentag',
+    'Full_Date': 'Vollständiges_Datum',
+}
+
+# Default cache location and format version (bump when the layout changes)
+CACHE_DIR = '.rainfall_cache'
+CACHE_VERSION = 1
+
+# Per-row arrays stored in the cache, with their compact dtypes
+ROW_FIELDS = {
+    'year': np.int16,
+    'month': np.int8,  # 0 if the date could not be parsed
+    'day': np.int8,  # 0 if the date could not be parsed
+    'weekday': np.int8,  # index into WEEKDAY_ORDER, -1 if unknown
+    'rainfall': np.float64,
+}
+
+# Files are split into quarters (Q1-Q4) instead of four-month periods (T1-T3) from this year on
+QUARTER_YEAR = 2020
+
+# First month of every file period
+PERIODS = {
+    'T': [1, 5, 9],
+    'Q': [1, 4, 7, 10],
+}
+
+# Weekday code for each pair of weekday letters read as a 16-bit number
+_WEEKDAY_LOOKUP = np.full(1 << 16, -1, dtype=np.int8)
+for _code, _weekday in enumerate(WEEKDAY_ORDER):
+    _WEEKDAY_LOOKUP[ord(_weekday[0]) << 8 | ord(_weekday[1])] = _code
+
+# "dd.mm." labels indexed by [month, day], used to rebuild the Date column
+_DATE_LABELS = np.full((13, 32), np.nan, dtype=object)
+for _month in range(1, 13):
+    for _day in range(1, 32):
+        _DATE_LABELS[_month, _day] = f'{_day:02d}.{_month:02d}.'
+
+
+def station_name(station_dir):
+    """Return the station name of a directory (e.g. "Data/Muenchen-Stadt" → "Muenchen-Stadt")."""
+    return os.path.basename(os.path.normpath(station_dir))
+
+
+def root_key(data_root):
+    """
+    Name part of the cache files of a data root: its folder name and a short hash of its absolute path.
+
+    E.g. "Data" → "Data_1a2b3c4d"; different data roots never share a file.
+    """
+    path = os.path.abspath(data_root)
+    return f"{os.path.basename(path)}_{hashlib.sha1(path.encode('utf-8')).hexdigest()[:8]}"
+
+
+def discover_stations(data_root='Data'):
+    """Return the sorted station directories (sub folders with CSV files) of data_root."""
+    return [
+        os.path.join(data_root, entry)
+        for entry in sorted(os.listdir(data_root))
+        if os.path.isdir(os.path.join(data_root, entry)) and list_station_files(os.path.join(data_root, entry))
+    ]
+
+
+def list_station_files(station_dir):
+    """Return the sorted CSV file paths of a station directory."""
+    with RainfallTrace.stage('glob', file=station_dir):
+        return sorted(glob.glob(os.path.join(station_dir, '*.csv')))
+
+
+def period_dates(year, first_month, months):
+    """All days of the period starting at first_month of year and lasting the given number of months."""
+    start = np.datetime64(f'{year}-{first_month:02d}', 'M')
+    return np.arange(start.astype('datetime64[D]'), (start + months).astype('datetime64[D]'))
+
+
+def year_from_filename(filename):
+    """
+    Extract the year from a file name (e.g. "Muenchen_Stadt_1982T3.csv" → 1982).
+
+    The year in front of the period suffix (T1-T3, Q1-Q4) is taken, so
+    digits in the station name do not count; other names fall back to
+    the first four digits.
+    """
+    basename = os.path.basename(filename)
+    year_match = re.search(r'(\d{4})[TQ]\d\.csv$', basename, re.IGNORECASE) or re.search(r'(\d{4})', basename)
+    if not year_match:
+        raise ValueError(f'No year found in file name: {filename}')
+    return int(year_match.group(1))
+
+
+def _read_body(filename):
+    """Read the data lines of a CSV file as bytes, without BOM and header line."""
+    with open(filename, 'rb') as csv_file:
+        body = csv_file.read()
+
+    # Drop the UTF-8 BOM and the "category,Niederschlag (6 bis 6 UTC)" header
+    if body.startswith(codecs.BOM_UTF8):
+        body = body[len(codecs.BOM_UTF8):]
+    if body.startswith(b'category'):
+        newline = body.find(b'\n')
+        body = body[newline + 1:] if newline >= 0 else b''
+
+    # Normalize line endings and drop blank lines, so lines and rows match up
+    body = body.replace(b'\r\n', b'\n')
+    if b'\n\n' in body or body.startswith(b'\n'):
+        body = re.sub(rb'\n\s*(?=\n)', b'', body).lstrip(b'\n')
+    return body.rstrip(b'\n')
+
+
+def decode_dates(labels):
+    """
+    Decode fixed-width "Mo 01.01." date cells by position.
+
+    Returns the weekday codes (index into WEEKDAY_ORDER), days and months;
+    cells not in this format get weekday -1 and day/month 0.
+    """
+    try:
+        cells = np.asarray(labels, dtype='S9')
+    except UnicodeEncodeError:
+        cells = np.array([str(label).encode('ascii', 'replace') for label in labels], dtype='S9')
+    chars = cells.view(np.uint8).reshape(len(cells), 9)
+    digits = chars[:, [3, 4, 6, 7]].astype(np.int16) - ord('0')
+
+    valid = (
+        (chars[:, 2] == ord(' ')) & (chars[:, 5] == ord('.')) & (chars[:, 8] == ord('.'))
+        & ((digits >= 0) & (digits <= 9)).all(axis=1)
+    )
+    day = np.where(valid, digits[:, 0] * 10 + digits[:, 1], 0)
+    month = np.where(valid, digits[:, 2] * 10 + digits[:, 3], 0)
+
+    # Look up the two weekday letters as one 16-bit number
+    weekday = _WEEKDAY_LOOKUP[chars[:, 0].astype(np.uint16) << 8 | chars[:, 1]]
+    weekday = np.where(valid, weekday, -1)
+
+    return (
+        weekday.astype(ROW_FIELDS['weekday']),
+        day.astype(ROW_FIELDS['day']),
+        month.astype(ROW_FIELDS['month']),
+    )
+
+
+def parse_files(filenames):
+    """
+    Parse several CSV files in one pass, returning one array dict per file.
+
+    The data lines of all files are joined into one buffer and read with a
+    single call of the C parser; the year of every row comes from its file
+    name and the date cells are decoded by position (see decode_dates).
+    """
+    years, bodies, counts, traced_files = [], [], [], []
+    for filename in filenames:
+        with RainfallTrace.stage('read', file=filename) as traced:
+            body = _read_body(filename)
+            traced.set(bytes=len(body))
+        traced_files.append(traced)
+        years.append(year_from_filename(filename))
+        bodies.append(body)
+        counts.append(body.count(b'\n') + 1 if body else 0)
+    if not filenames:
+        return []
+
+    buffer = b'\n'.join(body for body in bodies if body)
+    with RainfallTrace.stage('read_csv', bytes=len(buffer)) as traced:
+        if buffer:
+            temp_df = pd.read_csv(
+                io.BytesIO(buffer), names=['Date', 'Rainfall'], header=None,
+                dtype={'Date': str}, skip_blank_lines=False, engine='c',
+            )
+        else:
+            temp_df = pd.DataFrame({'Date': [], 'Rainfall': []})
+        traced.set(rows=len(temp_df))
+    if len(temp_df) != sum(counts):
+        raise ValueError(f'Row count mismatch while parsing {len(filenames)} files')
+
+    with RainfallTrace.stage('decode_dates', rows=len(temp_df)):
+        weekday, day, month = decode_dates(temp_df['Date'].fillna(''))
+        rainfall = pd.to_numeric(temp_df['Rainfall'], errors='coerce').to_numpy(ROW_FIELDS['rainfall'])
+        year = np.repeat(np.array(years, dtype=ROW_FIELDS['year']), counts)
+
+    # Split the combined arrays back into one part per file
+    bounds = np.cumsum(counts)[:-1]
+    columns = {'year': year, 'month': month, 'day': day, 'weekday': weekday, 'rainfall': rainfall}
+    split = {field: np.split(values, bounds) for field, values in columns.items()}
+    for traced, count in zip(traced_files, counts):
+        traced.set(rows=count)
+    return [{field: split[field][i] for field in ROW_FIELDS} for i in range(len(filenames))]
+
+
+def parse_file(filename):
+    """Parse one CSV file into a dict of NumPy arrays (see ROW_FIELDS)."""
+    return parse_files([filename])[0]
+
+
+def _file_key(filename):
+    """Return the (size, mtime) pair a cached file is validated against."""
+    stat = os.stat(filename)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def station_cache_dir(station_dir, cache_dir=CACHE_DIR):
+    """
+    Return the folder of the cache files of a station directory: one sub folder of cache_dir per data root.
+
+    Stations of the same name under different data roots never share a file.
+    """
+    return os.path.join(cache_dir, root_key(os.path.dirname(os.path.normpath(station_dir)) or '.'))
+
+
+def _cache_path(station_dir, cache_dir):
+    """Return the cache file of a station directory."""
+    return os.path.join(station_cache_dir(station_dir, cache_dir), f'{station_name(station_dir)}.npz')
+
+
+def _read_cache(cache_path):
+    """Read a cache file, mapping each cached path to its (size, mtime, arrays)."""
+    if not os.path.exists(cache_path):
+        return {}
+    try:
+        with np.load(cache_path, allow_pickle=False) as cache:
+            if int(cache['version']) != CACHE_VERSION:
+                return {}
+            paths, sizes, mtimes = cache['paths'], cache['sizes'], cache['mtimes']
+            offsets = cache['offsets']
+            columns = {field: cache[field] for field in ROW_FIELDS}
+    except (OSError, KeyError, ValueError):
+        # A broken or foreign cache file is simply rebuilt
+        return {}
+
+    entries = {}
+    for i, path in enumerate(paths.tolist()):
+        start, end = offsets[i], offsets[i + 1]
+        arrays = {field: values[start:end] for field, values in columns.items()}
+        entries[path] = (int(sizes[i]), int(mtimes[i]), arrays)
+    return entries
+
+
+def _write_cache(cache_path, paths, keys, parts):
+    """Write the parsed files to the cache file, replacing it atomically."""
+    os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+    offsets = np.zeros(len(parts) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(part['year']) for part in parts])
+
+    tmp_path = cache_path + '.tmp'
+    with open(tmp_path, 'wb') as tmp_file:
+        np.savez(
+            tmp_file,
+            version=np.int64(CACHE_VERSION),
+            paths=np.array(paths, dtype=str),
+            sizes=np.array([key[0] for key in keys], dtype=np.int64),
+            mtimes=np.array([key[1] for key in keys], dtype=np.int64),
+            offsets=offsets,
+            **concat_parts(parts),
+        )
+    os.replace(tmp_path, cache_path)
+
+
+def concat_parts(parts):
+    """Concatenate per-file array dicts into one dict of row arrays."""
+    with RainfallTrace.stage('concat') as traced:
+        arrays = {
+            field: np.concatenate([part[field] for part in parts]) if parts else np.empty(0, dtype=dtype)
+            for field, dtype in ROW_FIELDS.items()
+        }
+        traced.set(rows=len(arrays['year']))
+    return arrays
+
+
+def load_station_parts(station_dir, cache_dir=CACHE_DIR, use_cache=True):
+    """
+    Load the files of a station directory as one dict of NumPy arrays per file.
+
+    Returns the file paths and their array dicts. With use_cache, unchanged
+    files are taken from the cache and only new or modified files are
+    parsed; the cache is updated if anything changed.
+    """
+    paths = list_station_files(station_dir)
+    cache_path = _cache_path(station_dir, cache_dir)
+    with RainfallTrace.stage('read_cache', file=cache_path):
+        cached = _read_cache(cache_path) if use_cache else {}
+
+    keys = [_file_key(path) for path in paths]
+    parts = [None] * len(paths)
+    missing = []
+    for i, (path, key) in enumerate(zip(paths, keys)):
+        entry = cached.get(path)
+        if entry is not None and entry[:2] == key:
+            parts[i] = entry[2]
+        else:
+            missing.append(i)
+
+    # Parse all new or modified files in one bulk pass
+    for i, part in zip(missing, parse_files([paths[i] for i in missing])):
+        parts[i] = part
+    changed = bool(missing) or len(cached) != len(paths)
+
+    if use_cache and changed:
+        with RainfallTrace.stage('write_cache', file=cache_path):
+            _write_cache(cache_path, paths, keys, parts)
+        # Check the data quality at ingest (imported here, RainfallQuality imports this module)
+        import RainfallQuality
+        with RainfallTrace.stage('quality', file=station_dir):
+            RainfallQuality.write_station_quality(station_dir, cache_dir, paths, parts, keys)
+
+    return paths, parts
+
+
+def load_station_arrays(station_dir, cache_dir=CACHE_DIR, use_cache=True):
+    """Load all rows of a station directory as a dict of NumPy arrays (see load_station_parts)."""
+    return concat_parts(load_station_parts(station_dir, cache_dir, use_cache)[1])
+
+
+def build_dates(year, month, day):
+    """Build datetime64 dates from year, month and day arrays, invalid dates become NaT."""
+    months = ((year - 1970) * 12 + month - 1).astype('datetime64[M]')
+    dates = months.astype('datetime64[D]') + (day - 1)
+
+    # Days that overflow into the next month (e.g. 31.04.) are invalid
+    valid = (month >= 1) & (month <= 12) & (day >= 1) & (dates.astype('datetime64[M]') == months)
+    dates[~valid] = np.datetime64('NaT')
+    return dates.astype('datetime64[ns]')
+
+
+def to_frame(arrays, clean=True, stations=None):
+    """
+    Build the data frame the analysis scripts work on from row arrays.
+
+    With clean, erroneous rainfall data (negative values and the -999
+    sentinel, as well as empty cells) is removed. If the arrays carry a
+    'station' code array, stations lists the names for a categorical
+    station column.
+    """
+    if clean:
+        with RainfallTrace.stage('clean', rows=len(arrays['rainfall'])):
+            keep = arrays['rainfall'] >= 0
+            arrays = {field: values[keep] for field, values in arrays.items()}
+
+    month = arrays['month'].astype(np.int64)
+    day = arrays['day'].astype(np.int64)
+    year = arrays['year'].astype(np.int64)
+    with RainfallTrace.stage('build_dates', rows=len(year)):
+        full_dates = build_dates(year, month, day)
+
+    with RainfallTrace.stage('to_frame', rows=len(year)):
+        frame = pd.DataFrame({
+            'Date': _DATE_LABELS[month, day],
+            RAINFALL_COLUMN: arrays['rainfall'],
+            'Year': year,
+            'Weekday': pd.Categorical.from_codes(arrays['weekday'], categories=WEEKDAY_ORDER, ordered=True),
+            'Full_Date': full_dates,
+        }, columns=COLUMNS)
+
+        if 'station' in arrays:
+            frame.insert(0, STATION_COLUMN, pd.Categorical.from_codes(arrays['station'], categories=stations))
+    return frame
+
+
+def load_station(station_dir, cache_dir=CACHE_DIR, use_cache=True, clean=True):
+    """Load a station directory into a data frame (see to_frame)."""
+    return to_frame(load_station_arrays(station_dir, cache_dir, use_cache), clean=clean)
+
+
+def load_stations_arrays(station_dirs, workers=None, cache_dir=CACHE_DIR, use_cache=True):
+    """
+    Load several station directories into one dict of row arrays.
+
+    The stations are parsed concurrently in a process pool with the given
+    number of workers (default: one per CPU, 1 loads serially). Rows keep
+    the order of station_dirs, and a 'station' array holds the index of
+    each row's station, so the result does not depend on the worker count.
+    """
+    with RainfallTrace.stage('load') as traced:
+        if workers == 1 or len(station_dirs) <= 1:
+            results = [load_station_arrays(station_dir, cache_dir, use_cache) for station_dir in station_dirs]
+        else:
+            workers = min(workers or os.cpu_count() or 1, len(station_dirs))
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(load_station_arrays, station_dirs, repeat(cache_dir), repeat(use_cache)))
+
+        arrays = concat_parts(results)
+        counts = [len(result['year']) for result in results]
+        arrays['station'] = np.repeat(np.arange(len(results), dtype=np.int32), counts)
+        traced.set(rows=len(arrays['year']))
+    return arrays
+
+
+def load_all_stations(data_root='Data', workers=None, cache_dir=CACHE_DIR, use_cache=True, clean=True):
+    """Load every station under data_root into one data frame with a categorical station column."""
+    station_dirs = discover_stations(data_root)
+    arrays = load_stations_arrays(station_dirs, workers, cache_dir, use_cache)
+    return to_frame(arrays, clean=clean, stations=[station_name(station_dir) for station_dir in station_dirs])
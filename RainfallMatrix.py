@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+Aligned stations × days matrix for comparing the weather stations.
+
+All stations are placed on one day axis: a float32 matrix with one row
+per station and one column per day from the first to the last date of
+any station, and a boolean mask of the days that have a valid value.
+Cross-station comparisons are then a handful of array operations:
+
+- pairwise correlation over the days both stations have data
+- daily differences to a reference station
+- weekday means and heavy rain days over the days all stations have data
+- side-by-side weekday graphs of the common period
+
+Run it from the project folder:
+
+    python RainfallMatrix.py --cutoff 5 --render
+
+@author: Merlin <|:3
+"""
+import os  # operating system dependent functionality
+import argparse
+
+import numpy as np
+import pandas as pd
+import matplotlib.style
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+import RainfallLoader
+import RainfallEngine
+import RainfallRender
+from RainfallLoader import STATION_COLUMN, WEEKDAY_ORDER
+
+# Labels of the side-by-side graph
+LANGUAGES = {
+    'en': {
+        'ylabel_mean': 'Average Rainfall (Liters per m²)',
+        'ylabel_heavy_days': 'Number of Rainy Days (>{cutoff:g} L/m²)',
+        'title': 'Stations Compared per Weekday, Common Period {first}–{last}',
+    },
+    'de': {
+        'ylabel_mean': 'Durchschnittlicher Niederschlag (Liter pro m²)',
+        'ylabel_heavy_days': 'Anzahl der Regentage (>{cutoff:g} Liter/m²)',
+        'title': 'Stationen im Vergleich pro Wochentag, gemeinsamer Zeitraum {first}–{last}',
+    },
+}
+
+
+def build_matrix(station_dirs=None, data_root='Data', workers=None, cache_dir=RainfallLoader.CACHE_DIR):
+    """Load the given station directories (default: all under data_root) into one aligned matrix."""
+    if station_dirs is None:
+        station_dirs = RainfallLoader.discover_stations(data_root)
+    arrays = RainfallLoader.load_stations_arrays(station_dirs, workers, cache_dir)
+    return matrix_from_arrays(arrays, [RainfallLoader.station_name(station_dir) for station_dir in station_dirs])
+
+
+def matrix_from_arrays(arrays, stations):
+    """
+    Place row arrays (with a 'station' code array) on a common day axis.
+
+    Returns a dict with the 'stations', the 'start' date, the float32
+    'values' (stations × days, NaN without data) and the 'valid' mask.
+    Of a date found twice at a station the first value counts.
+    """
+    dates = RainfallLoader.build_dates(
+        arrays['year'].astype(np.int64), arrays['month'].astype(np.int64), arrays['day'].astype(np.int64)
+    ).astype('datetime64[D]')
+    keep = ~np.isnat(dates) & (arrays['rainfall'] >= 0)
+    dates, station, rainfall = dates[keep], arrays['station'][keep], arrays['rainfall'][keep]
+
+    start = dates.min() if len(dates) else np.datetime64('1980-01-01', 'D')
+    day = (dates - start).astype(np.int64)
+    values = np.full((len(stations), int(day.max()) + 1 if len(day) else 0), np.nan, dtype=np.float32)
+    values[station[::-1], day[::-1]] = rainfall[::-1]  # written last to first, so the first value wins
+    return {'stations': list(stations), 'start': start, 'values': values, 'valid': ~np.isnan(values)}
+
+
+def select(matrix, stations=None):
+    """The matrix restricted to some stations (in the given order)."""
+    if stations is None:
+        return matrix
+    rows = [matrix['stations'].index(station) for station in stations]
+    return {**matrix, 'stations': list(stations), 'values': matrix['values'][rows], 'valid': matrix['valid'][rows]}
+
+
+def dates(matrix):
+    """Date of every column."""
+    return matrix['start'] + np.arange(matrix['values'].shape[1])
+
+
+def common_period(matrix):
+    """First and last date on which every station has data, or (None, None)."""
+    shared = np.flatnonzero(matrix['valid'].all(axis=0))
+    if not len(shared):
+        return None, None
+    return matrix['start'] + shared[0], matrix['start'] + shared[-1]
+
+
+def overlap_days(matrix):
+    """Number of days with data at both stations, for every pair of stations."""
+    valid = matrix['valid'].astype(np.float64)
+    return pd.DataFrame((valid @ valid.T).astype(np.int64), index=matrix['stations'], columns=matrix['stations'])
+
+
+def correlation(matrix):
+    """
+    Pearson correlation of the daily rainfall of every pair of stations.
+
+    Each pair uses all days on which both stations have data, computed for
+    all pairs at once from a few matrix products.
+    """
+    valid = matrix['valid'].astype(np.float64)
+    values = np.where(matrix['valid'], matrix['values'], 0).astype(np.float64)
+
+    n = valid @ valid.T
+    sum_x = values @ valid.T  # sum of station i over the days station j has data too
+    sum_xx = (values * values) @ valid.T
+    sum_xy = values @ values.T
+    with np.errstate(invalid='ignore', divide='ignore'):
+        covariance = n * sum_xy - sum_x * sum_x.T
+        variance_x = n * sum_xx - sum_x ** 2
+        result = covariance / np.sqrt(variance_x * variance_x.T)
+    return pd.DataFrame(result, index=matrix['stations'], columns=matrix['stations'])
+
+
+def differences(matrix, reference):
+    """Daily rainfall of every station minus the reference station (NaN unless both have data)."""
+    reference_values = matrix['values'][matrix['stations'].index(reference)]
+    return matrix['values'] - reference_values[None, :]
+
+
+def weekday_comparison(matrix, cutoff=RainfallEngine.RAINY_DAY_CUTOFF, overlap=True):
+    """
+    Weekday means and heavy rain days of every station.
+
+    With overlap, only the days on which every station has data count, so
+    the stations are compared over exactly the same days. Returns a table
+    with station, Weekday, mean, heavy_days and days.
+    """
+    valid = matrix['valid'] & matrix['valid'].all(axis=0) if overlap else matrix['valid']
+    weekday = (dates(matrix).astype(np.int64) + 3) % 7  # 1970-01-01 was a Thursday
+    values = np.where(valid, matrix['values'], 0).astype(np.float64)
+
+    # One bincount per quantity over all stations: cell = station * 7 + weekday
+    cell = (np.arange(len(matrix['stations']))[:, None] * 7 + weekday[None, :]).ravel()
+    n_cells = len(matrix['stations']) * 7
+    days = np.bincount(cell, weights=valid.ravel(), minlength=n_cells).astype(np.int64)
+    total = np.bincount(cell, weights=values.ravel(), minlength=n_cells)
+    heavy = np.bincount(cell, weights=(valid & (values > cutoff)).ravel(), minlength=n_cells).astype(np.int64)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        table = pd.DataFrame({
+            STATION_COLUMN: np.repeat(matrix['stations'], 7),
+            'Weekday': pd.Categorical(np.tile(WEEKDAY_ORDER, len(matrix['stations'])), categories=WEEKDAY_ORDER,
+                                      ordered=True),
+            'mean': total / days,
+            'heavy_days': heavy,
+            'days': days,
+        })
+    return table
+
+
+def draw_comparison(fig, comparison, value, first, last, cutoff, lang='en'):
+    """Grouped bar chart of a weekday_comparison value ('mean' or 'heavy_days'), one bar per station."""
+    labels = LANGUAGES[lang]
+    stations = list(dict.fromkeys(comparison[STATION_COLUMN]))
+    width = 0.8 / max(len(stations), 1)
+    ax = fig.add_subplot()
+    positions = np.arange(7)
+    for i, station in enumerate(stations):
+        rows = RainfallEngine.station_rows(comparison, station)
+        ax.bar(positions + (i - (len(stations) - 1) / 2) * width, rows[value], width, label=station,
+               edgecolor='black', linewidth=0.8)
+    ax.set_xticks(positions, WEEKDAY_ORDER)
+    ax.set_xlabel(RainfallRender.LANGUAGES[lang]['weekday'])
+    ax.set_ylabel(labels[f'ylabel_{value}'].format(cutoff=cutoff))
+    ax.set_title(labels['title'].format(first=first, last=last))
+    ax.grid(visible=True, color='gray', linestyle='--', linewidth=1, alpha=0.5)
+    ax.legend()
+    fig.tight_layout()
+    return ax
+
+
+def render_comparison(matrix, cutoff=RainfallEngine.RAINY_DAY_CUTOFF, languages=('en', 'de'), output_dir='graphs',
+                      dpi=300, style=RainfallRender.DEFAULT_STYLE):
+    """Render the side-by-side weekday graphs of the common period and return their paths."""
+    first, last = common_period(matrix)
+    if first is None:
+        return []
+    comparison = weekday_comparison(matrix, cutoff)
+    first_year, last_year = first.astype(object).year, last.astype(object).year
+    paths = []
+    for value in ('mean', 'heavy_days'):
+        for lang in languages:
+            with matplotlib.style.context(style):
+                fig = Figure(figsize=(10, 6))
+                FigureCanvasAgg(fig)
+                ax = draw_comparison(fig, comparison, value, first, last, cutoff, lang)
+                paths.append(RainfallRender.save_graph(fig, ax, os.path.join(output_dir, 'comparison'),
+                                                       first_year, last_year, dpi))
+    return paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the stations over their common days.')
+    parser.add_argument('--data-root', default='Data', help='folder with one sub folder per station')
+    parser.add_argument('--station', nargs='*', default=None, help='station names to compare, default all')
+    parser.add_argument('--cutoff', type=float, default=RainfallEngine.RAINY_DAY_CUTOFF, help='heavy rain day threshold in l/m²')
+    parser.add_argument('--render', action='store_true', help='render side-by-side graphs of the common period')
+    parser.add_argument('--lang', nargs='*', default=['en', 'de'], choices=list(LANGUAGES), help='languages of the graphs')
+    args = parser.parse_args()
+
+    matrix = select(build_matrix(data_root=args.data_root), args.station)
+    first, last = common_period(matrix)
+    with pd.option_context('display.width', 160):
+        print(f'Common period: {first} – {last}')
+        print()
+        print('Days with data at both stations:')
+        print(overlap_days(matrix).to_string())
+        print()
+        print('Correlation of the daily rainfall:')
+        print(correlation(matrix).round(3).to_string())
+        print()
+        print(weekday_comparison(matrix, args.cutoff).pivot(index='Weekday', columns=STATION_COLUMN,
+                                                            values=['mean', 'heavy_days']).round(3).to_string())
+    if args.render:
+        for output_path in render_comparison(matrix, args.cutoff, args.lang):
+            print(f'Graph saved as: {output_path}')
@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+"""
+Data-quality pass over the raw station files, run once at ingest.
+
+The analysis scripts only drop negative values. This module checks the
+data behind them, all with array operations over the loader's row arrays:
+
+- a completeness bitmap per station and year (one bit per day of the
+  year with a valid value) and the coverage derived from it
+- the -999 sentinels, other negative values, empty cells and dates that
+  could not be parsed, counted per station and year
+- dates found more than once (overlapping tertial and quarter files),
+  with a flag whether the values disagree
+- runs of missing days between the first and last valid day of a station
+- files whose name year disagrees with their contents: the weekday in
+  the date cells does not match the date in the year of the file name
+
+The loader runs the checks of a station whenever it writes that
+station's cache, and the result is persisted per station next to it
+(<cache_dir>/<data root>_<hash>/quality/<Station>.npz), so analyses can filter on it (e.g.
+leave out years with less than 95% coverage) without checking the data
+again. Run it from the project folder for a report:
+
+    python RainfallQuality.py --min-coverage 0.95
+
+@author: Merlin <|:3
+"""
+import os  # operating system dependent functionality
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+import pandas as pd
+
+import RainfallLoader
+from RainfallLoader import STATION_COLUMN
+
+# Format version of the persisted quality data (bump when the layout changes)
+QUALITY_VERSION = 2
+
+# Value the source uses for a missing measurement
+SENTINEL = -999
+
+# Years with less than this share of days with a valid value count as incomplete
+MIN_COVERAGE = 0.95
+
+# Values counted per station and year
+COUNTS = ['rows', 'valid_days', 'sentinels', 'negatives', 'empty', 'invalid_dates']
+
+_EPOCH = np.datetime64('1970-01-01', 'D')
+
+
+def check_parts(paths, parts):
+    """Check the parsed files of one station (see the module docstring) and return the results as arrays."""
+    arrays = RainfallLoader.concat_parts(parts)
+    file_index = np.repeat(np.arange(len(parts)), [len(part['year']) for part in parts])
+
+    year = arrays['year'].astype(np.int64)
+    dates = RainfallLoader.build_dates(
+        year, arrays['month'].astype(np.int64), arrays['day'].astype(np.int64)
+    ).astype('datetime64[D]')
+    rainfall = arrays['rainfall']
+    dated = ~np.isnat(dates)
+    valid = dated & (rainfall >= 0)
+    sentinel = rainfall == SENTINEL
+    day = np.where(dated, (dates - _EPOCH).astype(np.int64), 0)
+    mismatch = dated & (arrays['weekday'] >= 0) & (arrays['weekday'] != (day + 3) % 7)  # 1970-01-01 was a Thursday
+
+    # Counts and completeness bitmap per year of the file names
+    first_year = int(year.min()) if len(year) else 0
+    n_years = int(year.max()) - first_year + 1 if len(year) else 0
+    slot = year - first_year
+    counts = {
+        name: np.bincount(slot, weights=flags, minlength=n_years).astype(np.int32)
+        for name, flags in [
+            ('rows', np.ones(len(year))), ('sentinels', sentinel), ('negatives', (rainfall < 0) & ~sentinel),
+            ('empty', np.isnan(rainfall)), ('invalid_dates', ~dated),
+        ]
+    }
+    day_of_year = (dates - dates.astype('datetime64[Y]')).astype(np.int64)
+    bits = np.zeros((n_years, 366), dtype=bool)
+    bits[slot[valid], day_of_year[valid]] = True
+    counts['valid_days'] = bits.sum(axis=1).astype(np.int32)
+
+    # Dates found more than once, and whether their values disagree
+    order = np.argsort(day[dated], kind='stable')
+    dated_days, dated_rainfall = day[dated][order], rainfall[dated][order]
+    unique_days, starts, repeats = np.unique(dated_days, return_index=True, return_counts=True)
+    with np.errstate(invalid='ignore'):
+        conflicting = (np.fmax.reduceat(dated_rainfall, starts) != np.fmin.reduceat(dated_rainfall, starts)) \
+            if len(starts) else np.empty(0, dtype=bool)
+    duplicated = repeats > 1
+
+    # Runs of days without a valid value between the first and the last valid day
+    valid_days = np.unique(day[valid])
+    have = np.zeros(int(valid_days[-1] - valid_days[0]) + 1 if len(valid_days) else 0, dtype=np.int8)
+    have[valid_days - valid_days[0]] = 1
+    edges = np.diff(np.concatenate([[1], have, [1]]))
+    missing_start, missing_end = np.flatnonzero(edges == -1), np.flatnonzero(edges == 1)
+
+    return {
+        'first_year': first_year,
+        'bitmap': np.packbits(bits, axis=1),
+        **counts,
+        'duplicate_day': unique_days[duplicated],
+        'duplicate_count': repeats[duplicated].astype(np.int32),
+        'duplicate_conflicting': conflicting[duplicated],
+        'missing_start': missing_start + (valid_days[0] if len(valid_days) else 0),
+        'missing_days': (missing_end - missing_start).astype(np.int32),
+        'files': np.array(paths, dtype=str),
+        'file_year': np.array([RainfallLoader.year_from_filename(path) for path in paths], dtype=np.int16),
+        'file_rows': np.bincount(file_index, minlength=len(paths)).astype(np.int32),
+        'file_invalid_dates': np.bincount(file_index, weights=~dated, minlength=len(paths)).astype(np.int32),
+        'file_weekday_mismatches': np.bincount(file_index, weights=mismatch, minlength=len(paths)).astype(np.int32),
+    }
+
+
+def quality_path(station_dir, cache_dir=RainfallLoader.CACHE_DIR):
+    """Return the persisted quality file of a station directory, in the cache folder of its data root."""
+    return os.path.join(RainfallLoader.station_cache_dir(station_dir, cache_dir), 'quality',
+                        f'{RainfallLoader.station_name(station_dir)}.npz')
+
+
+def write_station_quality(station_dir, cache_dir, paths, parts, keys=None):
+    """
+    Check the parsed files of a station and persist the result next to its loader cache.
+
+    Called by the loader whenever it writes the cache of a station; keys
+    are the (size, mtime) pairs of the files the result is valid for.
+    Returns the result.
+    """
+    keys = keys if keys is not None else [RainfallLoader._file_key(path) for path in paths]
+    result = check_parts(paths, parts)
+    path = quality_path(station_dir, cache_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as tmp_file:
+        np.savez(tmp_file, version=np.int64(QUALITY_VERSION),
+                 sizes=np.array([key[0] for key in keys], dtype=np.int64),
+                 mtimes=np.array([key[1] for key in keys], dtype=np.int64), **result)
+    os.replace(tmp_path, path)
+    return result
+
+
+def load_station_quality(station_dir, cache_dir=RainfallLoader.CACHE_DIR):
+    """Read the persisted quality of a station, or return None if there is none or a file changed since."""
+    path = quality_path(station_dir, cache_dir)
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            if int(data['version']) != QUALITY_VERSION:
+                return None
+            result = {name: data[name] for name in data.files if name != 'version'}
+    except (OSError, KeyError, ValueError):
+        return None
+
+    paths = RainfallLoader.list_station_files(station_dir)
+    keys = [RainfallLoader._file_key(path) for path in paths]
+    stored_keys = list(zip(result.pop('sizes').tolist(), result.pop('mtimes').tolist()))
+    if result['files'].tolist() != paths or stored_keys != keys:
+        return None
+    result['first_year'] = int(result['first_year'])
+    return result
+
+
+def station_quality(station_dir, cache_dir=RainfallLoader.CACHE_DIR, rebuild=False):
+    """
+    Return the quality of one station directory, from its persisted result if that is up to date.
+
+    Otherwise the station is loaded, which checks it again if any file
+    changed; with rebuild, it is always checked again.
+    """
+    result = None if rebuild else load_station_quality(station_dir, cache_dir)
+    if result is None:
+        paths, parts = RainfallLoader.load_station_parts(station_dir, cache_dir)
+        # The loader only checks the quality when it writes its cache
+        result = None if rebuild else load_station_quality(station_dir, cache_dir)
+        if result is None:
+            result = write_station_quality(station_dir, cache_dir, paths, parts)
+    return result
+
+
+def build_quality(station_dirs=None, data_root='Data', workers=None, cache_dir=RainfallLoader.CACHE_DIR,
+                  rebuild=False):
+    """
+    Collect the quality of the given station directories (default: all under data_root).
+
+    Stations without an up-to-date persisted result are checked in a
+    process pool like the loader. Counts and bitmaps are laid out as
+    stations × years over the years of all stations; dates are stored as
+    days since 1970-01-01.
+    """
+    if station_dirs is None:
+        station_dirs = RainfallLoader.discover_stations(data_root)
+    if workers == 1 or len(station_dirs) <= 1:
+        results = [station_quality(station_dir, cache_dir, rebuild) for station_dir in station_dirs]
+    else:
+        workers = min(workers or os.cpu_count() or 1, len(station_dirs))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(station_quality, station_dirs, repeat(cache_dir), repeat(rebuild)))
+
+    with_rows = [result for result in results if len(result['rows'])]
+    first_year = min((result['first_year'] for result in with_rows), default=0)
+    n_years = max((result['first_year'] + len(result['rows']) for result in with_rows), default=first_year) - first_year
+
+    quality = {
+        'stations': np.array([RainfallLoader.station_name(station_dir) for station_dir in station_dirs], dtype=str),
+        'first_year': np.int64(first_year),
+        'bitmap': np.zeros((len(results), n_years, 46), dtype=np.uint8),
+    }
+    for name in COUNTS:
+        quality[name] = np.zeros((len(results), n_years), dtype=np.int32)
+    for code, result in enumerate(results):
+        years = slice(result['first_year'] - first_year, result['first_year'] - first_year + len(result['rows']))
+        quality['bitmap'][code, years] = result['bitmap']
+        for name in COUNTS:
+            quality[name][code, years] = result[name]
+
+    # Per-date and per-file lists, with the station code of every entry
+    for prefix, key in [('duplicate', 'duplicate_day'), ('missing', 'missing_start'), ('file', 'files')]:
+        quality[f'{prefix}_station'] = np.repeat(np.arange(len(results), dtype=np.int32),
+                                                 [len(result[key]) for result in results])
+    for name in ['duplicate_day', 'duplicate_count', 'duplicate_conflicting', 'missing_start', 'missing_days',
+                 'files', 'file_year', 'file_rows', 'file_invalid_dates', 'file_weekday_mismatches']:
+        quality[name] = np.concatenate([result[name] for result in results]) if results else np.empty(0)
+    return quality
+
+
+def years(quality):
+    """Year of every column of the stations × years arrays."""
+    return int(quality['first_year']) + np.arange(quality['rows'].shape[1])
+
+
+def coverage(quality):
+    """Share of the days of every year with a valid value (stations × years)."""
+    year = years(quality)
+    days_in_year = 365 + ((year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0)))
+    return quality['valid_days'] / days_in_year
+
+
+def valid_mask(quality, station, year):
+    """Days of one year (index = day of the year - 1) on which a station has a valid value, from the bitmap."""
+    code = list(quality['stations']).index(station)
+    slot = year - int(quality['first_year'])
+    if not 0 <= slot < quality['bitmap'].shape[1]:
+        return np.zeros(365, dtype=bool)
+    days = 366 if year % 4 == 0 and (year % 100 != 0 or year % 400 == 0) else 365
+    return np.unpackbits(quality['bitmap'][code, slot])[:days].astype(bool)
+
+
+def coverage_table(quality):
+    """One row per station and year with data: the counts and the coverage."""
+    n_stations, n_years = quality['rows'].shape
+    table = pd.DataFrame({
+        STATION_COLUMN: np.repeat(quality['stations'], n_years),
+        'Year': np.tile(years(quality), n_stations),
+        **{name: quality[name].ravel() for name in COUNTS},
+        'coverage': coverage(quality).ravel(),
+    })
+    return table[table['rows'] > 0].reset_index(drop=True)
+
+
+def duplicate_dates(quality):
+    """Dates found more than once per station, with the number of rows and whether the values disagree."""
+    return pd.DataFrame({
+        STATION_COLUMN: quality['stations'][quality['duplicate_station']],
+        'date': _EPOCH + quality['duplicate_day'].astype(np.int64),
+        'count': quality['duplicate_count'],
+        'conflicting': quality['duplicate_conflicting'],
+    })
+
+
+def missing_dates(quality):
+    """Runs of days without a valid value per station: first and last date and number of days."""
+    start = _EPOCH + quality['missing_start'].astype(np.int64)
+    return pd.DataFrame({
+        STATION_COLUMN: quality['stations'][quality['missing_station']],
+        'first': start,
+        'last': start + (quality['missing_days'].astype(np.int64) - 1),
+        'days': quality['missing_days'],
+    })
+
+
+def file_table(quality):
+    """One row per file: its name year, rows, unparseable dates and weekday mismatches."""
+    return pd.DataFrame({
+        STATION_COLUMN: quality['stations'][quality['file_station']],
+        'file': quality['files'],
+        'Year': quality['file_year'],
+        'rows': quality['file_rows'],
+        'invalid_dates': quality['file_invalid_dates'],
+        'weekday_mismatches': quality['file_weekday_mismatches'],
+    })
+
+
+def complete_years(quality, min_coverage=MIN_COVERAGE):
+    """Boolean stations × years array of the years with at least min_coverage."""
+    return coverage(quality) >= min_coverage
+
+
+def filter_arrays(arrays, stations, quality, min_coverage=MIN_COVERAGE):
+    """Keep the rows of loader arrays (with a 'station' code array) that fall into complete years."""
+    complete = complete_years(quality, min_coverage)
+    codes = list(quality['stations'])
+    # Station rows of the complete array in the order of stations, plus an all-False row for unknown stations
+    complete = np.vstack([complete, np.zeros((1, complete.shape[1]), dtype=bool)])
+    rows = np.array([codes.index(station) if station in codes else -1 for station in stations], dtype=np.int64)
+    slot = arrays['year'].astype(np.int64) - int(quality['first_year'])
+    inside = (slot >= 0) & (slot < complete.shape[1])
+    keep = inside & complete[rows[arrays['station']], np.clip(slot, 0, max(complete.shape[1] - 1, 0))]
+    return {field: values[keep] for field, values in arrays.items()}
+
+
+def filter_complete(table, quality, min_coverage=MIN_COVERAGE):
+    """Keep the rows of a table with station and Year columns (e.g. df_final) that fall into complete years."""
+    table_coverage = coverage_table(quality)
+    complete = table_coverage[table_coverage['coverage'] >= min_coverage]
+    keys = pd.MultiIndex.from_arrays([complete[STATION_COLUMN], complete['Year'].astype(np.int64)])
+    rows = pd.MultiIndex.from_arrays([table[STATION_COLUMN].astype(str), table['Year'].astype(np.int64)])
+    return table[rows.isin(keys)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Report the data quality of the station files.')
+    parser.add_argument('--data-root', default='Data', help='folder with one sub folder per station')
+    parser.add_argument('--min-coverage', type=float, default=MIN_COVERAGE, help='coverage of a complete year (0-1)')
+    parser.add_argument('--station', nargs='*', default=None, help='station name(s), default all')
+    parser.add_argument('--rebuild', action='store_true', help='check the files again even if none changed')
+    parser.add_argument('--details', action='store_true', help='list every duplicate and missing date run')
+    parser.add_argument('--cache-dir', default=RainfallLoader.CACHE_DIR, help='folder of the loader cache')
+    args = parser.parse_args()
+
+    quality = build_quality(data_root=args.data_root, cache_dir=args.cache_dir, rebuild=args.rebuild)
+    tables = {
+        'coverage': coverage_table(quality), 'duplicates': duplicate_dates(quality),
+        'missing': missing_dates(quality), 'files': file_table(quality),
+    }
+    if args.station:
+        tables = {name: table[table[STATION_COLUMN].isin(args.station)] for name, table in tables.items()}
+
+    with pd.option_context('display.max_rows', None, 'display.width', 160):
+        incomplete = tables['coverage'][tables['coverage']['coverage'] < args.min_coverage]
+        print(f'Years with less than {args.min_coverage:.0%} coverage:')
+        print(incomplete.round(3).to_string(index=False) if len(incomplete) else '  none')
+        print()
+        summary = tables['coverage'].groupby(STATION_COLUMN)[COUNTS].sum()
+        summary['duplicate_dates'] = tables['duplicates'].groupby(STATION_COLUMN).size()
+        summary['conflicting_duplicates'] = tables['duplicates'].groupby(STATION_COLUMN)['conflicting'].sum()
+        summary['missing_runs'] = tables['missing'].groupby(STATION_COLUMN).size()
+        summary['missing_days'] = tables['missing'].groupby(STATION_COLUMN)['days'].sum()
+        print(summary.fillna(0).astype(np.int64).to_string())
+        print()
+        mismatched = tables['files'][(tables['files']['weekday_mismatches'] > 0) | (tables['files']['invalid_dates'] > 0)]
+        print('Files whose dates do not match their name year:')
+        print(mismatched.to_string(index=False) if len(mismatched) else '  none')
+        if args.details:
+            for name in ('duplicates', 'missing'):
+                print()
+                print(tables[name].to_string(index=False))
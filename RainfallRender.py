@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""
+Graphs of the rainfall statistics in English and German, and a headless
+batch renderer.
+
+The labels of both languages live in the LANGUAGES translation table, so
+one drawing function serves the En and the Ge script. The batch renderer
+computes the statistics once and renders every graph for every station
+and language on the non-interactive Agg backend, spread over a process
+pool. Graphs are saved as graphs/<station>/<label>_<min>-<max>.png.
+
+Rendering at 300 dpi is the slowest step, so the batch renderer keeps a
+manifest (graphs/.render_manifest.json) of the graphs it wrote, keyed by
+a hash of the drawn data and every plot setting. A graph whose key is in
+the manifest and whose file still exists is not drawn again; a graph
+that was replaced by one with a different file name (e.g. a new year
+range) is deleted.
+
+Run it from the project folder:
+
+    python RainfallRender.py --cutoff 5 --lang en de --workers 4
+
+@author: Merlin <|:3
+"""
+import os  # operating system dependent functionality
+import re  # Regex for cleaning the graph label
+import json
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+import matplotlib.style
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.cm import ScalarMappable
+from matplotlib.colors import Normalize
+from matplotlib.figure import Figure
+import pandas as pd
+
+import RainfallEngine
+import RainfallTrace
+
+# Graph kinds and their figure sizes
+FIGURE_SIZES = {
+    'weekday_mean': (8, 6),
+    'heavy_days': (8, 6),
+    'yearly': (10, 6),
+}
+GRAPHS = list(FIGURE_SIZES)
+
+# Translation tables for all graph labels
+LANGUAGES = {
+    'en': {
+        'weekday': 'Weekday',
+        'year': 'Year',
+        'weekday_mean_ylabel': 'Average Rainfall (Liters per m²)',
+        'weekday_mean_title': 'Average Rainfall per Weekday in Munich ({min_year}–{max_year})',
+        'heavy_days_ylabel': 'Number of Rainy Days (>{cutoff:g} L/m²)',
+        'heavy_days_title': 'Number of Rainy Days per Weekday ({min_year}–{max_year})',
+        'yearly_ylabel': 'Total Rainfall (Liters per m²)',
+        'yearly_title': 'Annual Total Rainfall\nColor scale by rainy days (> {cutoff:g} Liters/sqm)',
+        'yearly_colorbar': 'Number of Heavy Rain Days',
+    },
+    'de': {
+        'weekday': 'Wochentag',
+        'year': 'Jahr',
+        'weekday_mean_ylabel': 'Durchschnittlicher Niederschlag (Liter pro m²)',
+        'weekday_mean_title': 'Durchschnittlicher Regen pro Wochentag in München ({min_year}–{max_year})',
+        'heavy_days_ylabel': 'Anzahl der Regentage (>{cutoff:g} Liter/m²)',
+        'heavy_days_title': 'Anzahl der Regentage pro Wochentag ({min_year}–{max_year})',
+        'yearly_ylabel': 'Gesamtniederschlag (Liter/m²)',
+        'yearly_title': 'Jährlicher Gesamtniederschlag\nFarbskala nach Regentagen > {cutoff:g} Liter/qm',
+        'yearly_colorbar': 'Anzahl der starken Regentage',
+    },
+}
+
+DEFAULT_STYLE = 'dark_background'
+
+# Table and columns each graph is drawn from, and whether the cutoff appears in it (render cache key)
+GRAPH_INPUTS = {
+    'weekday_mean': ('weekday', ['Weekday', 'mean'], False),
+    'heavy_days': ('weekday', ['Weekday', 'heavy_days'], True),
+    'yearly': ('yearly', ['Year', 'total', 'heavy_days'], True),
+}
+
+# Manifest of the rendered graphs in the output folder; bump RENDER_VERSION when a drawing changes
+MANIFEST_NAME = '.render_manifest.json'
+RENDER_VERSION = 1
+
+
+def _title(text, station):
+    """Add the station name as an extra title line, if one is given."""
+    return f'{text}\n{station}' if station else text
+
+
+def _grid(ax):
+    """Dashed grid used by all graphs."""
+    ax.grid(visible=True, color='gray', linestyle='--', linewidth=1, alpha=0.5)
+
+
+def _bar_errors(table, column):
+    """
+    Error bar arguments of ax.bar from the <column>_low/<column>_high
+    interval columns (see RainfallSignificance.with_intervals), if present.
+    """
+    if f'{column}_low' not in table:
+        return {}
+    lower = (table[column] - table[f'{column}_low']).clip(lower=0).to_numpy()
+    upper = (table[f'{column}_high'] - table[column]).clip(lower=0).to_numpy()
+    return {'yerr': [lower, upper], 'capsize': 4, 'ecolor': matplotlib.rcParams['text.color']}
+
+
+def draw_weekday_mean(fig, weekday, min_year, max_year, lang='en', station=None):
+    """Bar chart of the average rainfall per weekday (from the engine's weekday table)."""
+    labels = LANGUAGES[lang]
+    ax = fig.add_subplot()
+    ax.bar(weekday['Weekday'].astype(str), weekday['mean'], color='deepskyblue', edgecolor='black', linewidth=0.8,
+           **_bar_errors(weekday, 'mean'))
+    ax.set_xlabel(labels['weekday'])
+    _grid(ax)
+    ax.set_ylabel(labels['weekday_mean_ylabel'])
+    ax.set_title(_title(labels['weekday_mean_title'].format(min_year=min_year, max_year=max_year), station))
+    return ax
+
+
+def draw_heavy_days(fig, weekday, min_year, max_year, cutoff, lang='en', station=None):
+    """Bar chart of the number of heavy rain days per weekday (from the engine's weekday table)."""
+    labels = LANGUAGES[lang]
+    ax = fig.add_subplot()
+    ax.bar(weekday['Weekday'].astype(str), weekday['heavy_days'], color='deepskyblue', edgecolor='black', linewidth=0.8,
+           **_bar_errors(weekday, 'heavy_days'))
+    ax.set_xlabel(labels['weekday'])
+    ax.set_ylabel(labels['heavy_days_ylabel'].format(cutoff=cutoff))
+    ax.set_title(_title(labels['heavy_days_title'].format(min_year=min_year, max_year=max_year), station))
+    _grid(ax)
+    fig.tight_layout()
+    return ax
+
+
+def draw_yearly(fig, yearly, cutoff, lang='en', station=None):
+    """Bar chart of the total rainfall per year, colored by heavy rain days (from the engine's yearly table)."""
+    labels = LANGUAGES[lang]
+
+    # Normalize rainy days count for color mapping (0 → light blue, max → dark blue)
+    min_rain_days = yearly['heavy_days'].min()
+    max_rain_days = yearly['heavy_days'].max()
+    span = (max_rain_days - min_rain_days) or 1
+    colors = matplotlib.colormaps['Blues']((yearly['heavy_days'] - min_rain_days) / span)
+
+    ax = fig.add_subplot()
+    ax.bar(yearly['Year'], yearly['total'], color=colors)
+    ax.set_xlabel(labels['year'])
+    ax.set_ylabel(labels['yearly_ylabel'])
+    ax.set_title(_title(labels['yearly_title'].format(cutoff=cutoff), station))
+    _grid(ax)
+
+    # Add color bar on the right side
+    sm = ScalarMappable(cmap='Blues', norm=Normalize(vmin=min_rain_days, vmax=max_rain_days))
+    sm.set_array([])  # Needed for matplotlib to properly show scalar mappable in colorbar
+    cbar = fig.colorbar(sm, ax=ax)
+    cbar.set_label(labels['yearly_colorbar'])
+    fig.tight_layout()
+    return ax
+
+
+def graph_filename(ax, min_year, max_year):
+    """File name from the Y-label and year range, e.g. "Average_Rainfall_1980-2024.png"."""
+    # Remove parentheses and their content, then strip and replace spaces with underscores
+    clean_ylabel = re.sub(r'\s*\([^)]*\)', '', ax.get_ylabel()).strip().replace(' ', '_')
+    return f'{clean_ylabel}_{min_year}-{max_year}.png'
+
+
+def save_graph(fig, ax, output_dir, min_year, max_year, dpi=300):
+    """Save a figure into output_dir with a clean file name and return its path."""
+    os.makedirs(output_dir, exist_ok=True)
+    output_path = os.path.join(output_dir, graph_filename(ax, min_year, max_year))
+    with RainfallTrace.stage('savefig', file=output_path):
+        fig.savefig(output_path, dpi=dpi)
+    return output_path
+
+
+def draw_graph(fig, graph, tables, cutoff, lang='en', station=None):
+    """Draw one graph kind from a station's statistics tables (see station_tables)."""
+    if graph == 'weekday_mean':
+        return draw_weekday_mean(fig, tables['weekday'], tables['min_year'], tables['max_year'], lang, station)
+    if graph == 'heavy_days':
+        return draw_heavy_days(fig, tables['weekday'], tables['min_year'], tables['max_year'], cutoff, lang, station)
+    if graph == 'yearly':
+        return draw_yearly(fig, tables['yearly'], cutoff, lang, station)
+    raise ValueError(f'Unknown graph: {graph}')
+
+
+def render_graph(task):
+    """Render one (graph, station, lang, tables, cutoff, output_dir, dpi, style) task headlessly."""
+    graph, station, lang, tables, cutoff, output_dir, dpi, style = task
+    with matplotlib.style.context(style):
+        fig = Figure(figsize=FIGURE_SIZES[graph])
+        FigureCanvasAgg(fig)  # Non-interactive Agg canvas, no window is ever opened
+        with RainfallTrace.stage('draw', file=f'{station}/{graph}/{lang}'):
+            ax = draw_graph(fig, graph, tables, cutoff, lang, station)
+        return save_graph(fig, ax, output_dir, tables['min_year'], tables['max_year'], dpi)
+
+
+def station_tables(statistics, station):
+    """Pick the weekday and yearly tables and the year range of one station."""
+    years = RainfallEngine.station_rows(statistics['years'], station)
+    return {
+        'weekday': RainfallEngine.station_rows(statistics['weekday'], station),
+        'yearly': RainfallEngine.station_rows(statistics['yearly'], station),
+        'min_year': int(years.loc[0, 'min_year']),
+        'max_year': int(years.loc[0, 'max_year']),
+    }
+
+
+def render_tasks(statistics, languages=('en', 'de'), graphs=GRAPHS, output_dir='graphs', dpi=300,
+                 style=DEFAULT_STYLE):
+    """List one render task per station, graph and language."""
+    tasks = []
+    for station in statistics['years']['station']:
+        tables = station_tables(statistics, station)
+        for graph in graphs:
+            for lang in languages:
+                tasks.append((graph, station, lang, tables, statistics['cutoff'],
+                              os.path.join(output_dir, station), dpi, style))
+    return tasks
+
+
+def render_key(task):
+    """
+    Hash of everything a render task draws: the data of the graph (its
+    columns plus any interval columns), the year range and the station,
+    language, cutoff (if shown), dpi, style and the matplotlib version.
+    """
+    graph, station, lang, tables, cutoff, _, dpi, style = task
+    table_name, columns, uses_cutoff = GRAPH_INPUTS[graph]
+    table = tables[table_name]
+    columns = columns + [column for column in table.columns
+                         if column.endswith(('_low', '_high')) and column.rsplit('_', 1)[0] in columns]
+    settings = [RENDER_VERSION, matplotlib.__version__, graph, station, lang, float(cutoff) if uses_cutoff else None,
+                dpi, style if isinstance(style, str) else repr(style), tables['min_year'], tables['max_year'], columns]
+    digest = hashlib.sha256(json.dumps(settings).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(table[columns].reset_index(drop=True), index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def load_manifest(output_dir):
+    """Read the render manifest of an output folder ({key: entry}), empty if there is none."""
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME), encoding='utf-8') as manifest_file:
+            return json.load(manifest_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(output_dir, manifest):
+    """Write the render manifest of an output folder, replacing it atomically."""
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    with open(path + '.tmp', 'w', encoding='utf-8') as manifest_file:
+        json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def render_all(statistics, languages=('en', 'de'), graphs=GRAPHS, output_dir='graphs', dpi=300,
+               style=DEFAULT_STYLE, workers=None, cache=True):
+    """
+    Render every graph for every station and language, spread over a process pool.
+
+    With cache, graphs listed in the render manifest with the same key
+    whose file still exists are skipped, and outputs replaced by a graph
+    with another file name are deleted. Returns the paths in task order.
+    """
+    tasks = render_tasks(statistics, languages, graphs, output_dir, dpi, style)
+    manifest = load_manifest(output_dir)
+    keys = [render_key(task) for task in tasks]
+    paths = [None] * len(tasks)
+    for i, key in enumerate(keys):
+        entry = manifest.get(key)
+        if cache and entry is not None and os.path.isfile(entry['path']) and os.path.getsize(entry['path']) == entry['size']:
+            paths[i] = entry['path']
+    missing = [i for i, path in enumerate(paths) if path is None]
+
+    with RainfallTrace.stage('render_all', rows=len(missing)):
+        if workers == 1 or len(missing) <= 1:
+            rendered = [render_graph(tasks[i]) for i in missing]
+        else:
+            with ProcessPoolExecutor(max_workers=min(workers or os.cpu_count() or 1, len(missing))) as pool:
+                rendered = list(pool.map(render_graph, [tasks[i] for i in missing]))
+    for i, path in zip(missing, rendered):
+        paths[i] = path
+
+    # Entries of the rendered slots (graph, station, language, folder) with another key are stale
+    slots = {(task[0], task[1], task[2], task[5]) for task in tasks}
+    current = set(paths)
+    for key, entry in list(manifest.items()):
+        if (entry['graph'], entry['station'], entry['lang'], entry['output_dir']) in slots and key not in keys:
+            if entry['path'] not in current and os.path.isfile(entry['path']):
+                os.remove(entry['path'])
+            del manifest[key]
+    for task, key, path in zip(tasks, keys, paths):
+        manifest[key] = {'graph': task[0], 'station': task[1], 'lang': task[2], 'output_dir': task[5],
+                         'path': path, 'size': os.path.getsize(path)}
+    save_manifest(output_dir, manifest)
+    return paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Render all rainfall graphs headlessly.')
+    parser.add_argument('--data-root', default='Data', help='folder with one sub folder per station')
+    parser.add_argument('--cutoff', type=float, default=RainfallEngine.RAINY_DAY_CUTOFF, help='heavy rain day threshold in l/m²')
+    parser.add_argument('--lang', nargs='*', default=list(LANGUAGES), choices=list(LANGUAGES), help='languages to render')
+    parser.add_argument('--graphs', nargs='*', default=GRAPHS, choices=GRAPHS, help='graphs to render')
+    parser.add_argument('--output-dir', default='graphs', help='graphs are saved in <output-dir>/<station>/')
+    parser.add_argument('--dpi', type=int, default=300, help='resolution of the PNG files')
+    parser.add_argument('--workers', type=int, default=None, help='number of render processes')
+    parser.add_argument('--force', action='store_true', help='render every graph, even if it is unchanged')
+    args = parser.parse_args()
+
+    statistics = RainfallEngine.analyze(data_root=args.data_root, cutoff=args.cutoff, workers=args.workers)
+    for output_path in render_all(statistics, args.lang, args.graphs, args.output_dir, args.dpi, workers=args.workers,
+                                  cache=not args.force):
+        print(f'Graph saved as: {output_path}')
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Compact array-backed representation of the daily rainfall series.
+
+Each observation takes 10 bytes: float32 rainfall, int32 days since
+1970-01-01, uint8 weekday code and a categorical station id. Year,
+weekday name and full date are derived on demand instead of being stored
+as strings and int64 columns on every row. RainfallEngine can run its
+analyses directly on this representation (analyze(..., compact=True)).
+
+Run it from the project folder for a memory footprint report:
+
+    python RainfallSeries.py
+
+@author: Merlin <|:3
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import RainfallLoader
+from RainfallLoader import STATION_COLUMN, WEEKDAY_ORDER
+
+# Column names of the compact frame
+DAY_COLUMN = 'day'
+WEEKDAY_COLUMN = 'weekday'
+RAINFALL_COLUMN = 'rainfall'
+
+
+def to_compact(arrays, stations=None, clean=True):
+    """
+    Build the compact frame from loader row arrays.
+
+    With clean, erroneous rainfall data is removed like in the loader.
+    Rows without a valid date cannot be placed on the day axis and are
+    always left out.
+    """
+    days = RainfallLoader.build_dates(
+        arrays['year'].astype(np.int64), arrays['month'].astype(np.int64), arrays['day'].astype(np.int64)
+    ).astype('datetime64[D]')
+    keep = ~np.isnat(days) & (arrays['weekday'] >= 0)
+    if clean:
+        keep &= arrays['rainfall'] >= 0
+
+    frame = pd.DataFrame({
+        DAY_COLUMN: days[keep].astype(np.int64).astype(np.int32),
+        WEEKDAY_COLUMN: arrays['weekday'][keep].astype(np.uint8),
+        RAINFALL_COLUMN: arrays['rainfall'][keep].astype(np.float32),
+    })
+    if 'station' in arrays:
+        frame.insert(0, STATION_COLUMN, pd.Categorical.from_codes(arrays['station'][keep], categories=stations))
+    return frame
+
+
+def load_compact(station_dirs=None, data_root='Data', workers=None, cache_dir=RainfallLoader.CACHE_DIR):
+    """Load the given station directories (default: all under data_root) into the compact frame."""
+    if station_dirs is None:
+        station_dirs = RainfallLoader.discover_stations(data_root)
+    arrays = RainfallLoader.load_stations_arrays(station_dirs, workers, cache_dir)
+    return to_compact(arrays, [RainfallLoader.station_name(station_dir) for station_dir in station_dirs])
+
+
+def dates(compact):
+    """Full dates of the compact frame, derived on demand."""
+    return compact[DAY_COLUMN].to_numpy().astype('datetime64[D]')
+
+
+def years(compact):
+    """Years of the compact frame, derived on demand."""
+    return (dates(compact).astype('datetime64[Y]').astype(np.int64) + 1970).astype(np.int16)
+
+
+def months(compact):
+    """Months (1-12) of the compact frame, derived on demand."""
+    return (dates(compact).astype('datetime64[M]').astype(np.int64) % 12 + 1).astype(np.int8)
+
+
+def weekdays(compact):
+    """Weekday initials of the compact frame as an ordered categorical, derived on demand."""
+    return pd.Categorical.from_codes(compact[WEEKDAY_COLUMN].to_numpy(np.int8), categories=WEEKDAY_ORDER, ordered=True)
+
+
+def to_frame(compact):
+    """Expand the compact frame into the full data frame of the loader."""
+    day_dates = dates(compact)
+    frame = pd.DataFrame({
+        'Date': pd.Series(day_dates).dt.strftime('%d.%m.').to_numpy(),
+        RainfallLoader.RAINFALL_COLUMN: compact[RAINFALL_COLUMN].to_numpy(np.float64),
+        'Year': years(compact).astype(np.int64),
+        'Weekday': weekdays(compact),
+        'Full_Date': day_dates.astype('datetime64[ns]'),
+    }, columns=RainfallLoader.COLUMNS)
+    if STATION_COLUMN in compact:
+        frame.insert(0, STATION_COLUMN, compact[STATION_COLUMN].array)
+    return frame
+
+
+def memory_report(df_final, compact):
+    """Compare the memory footprint of the full data frame and the compact frame, per column and per row."""
+    rows = []
+    for name, frame in (('df_final', df_final), ('compact', compact)):
+        usage = frame.memory_usage(index=True, deep=True)
+        for column, size in usage.items():
+            rows.append({'frame': name, 'column': column, 'bytes': int(size)})
+        rows.append({'frame': name, 'column': 'TOTAL', 'bytes': int(usage.sum())})
+        rows.append({'frame': name, 'column': 'bytes per row', 'bytes': round(usage.sum() / max(len(frame), 1), 1)})
+    return pd.DataFrame(rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the memory footprint of the compact representation.')
+    parser.add_argument('--data-root', default='Data', help='folder with one sub folder per station')
+    args = parser.parse_args()
+
+    station_dirs = RainfallLoader.discover_stations(args.data_root)
+    stations = [RainfallLoader.station_name(station_dir) for station_dir in station_dirs]
+    arrays = RainfallLoader.load_stations_arrays(station_dirs)
+    report = memory_report(RainfallLoader.to_frame(arrays, stations=stations), to_compact(arrays, stations))
+    print(report.to_string(index=False))
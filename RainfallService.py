@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+"""
+Local HTTP/JSON service for variations of the three graphs.
+
+The rows of all stations are loaded once at startup and kept in memory as
+NumPy arrays. Every question (station, year range, months, cutoff) is
+answered with a few bincounts over them, and the answers go through a
+bounded LRU cache keyed on the normalized parameters, so a dashboard
+asking the same thing again gets it from memory. Hits and misses are
+shown under /metrics.
+
+Endpoints (all GET, parameters optional):
+
+    /weekday?station=Muenchen-Stadt&years=1993-2024&months=6,7,8
+    /heavy?station=Muenchen-Stadt&cutoff=10
+    /yearly?station=Muenchen-Flughafen&years=2000-2024&format=png&lang=de
+    /stations
+    /metrics
+
+station can be given more than once or comma-separated (default: all),
+years as "first-last" or a single year, months as a comma-separated list
+of 1-12. format=png returns the graph of one station instead of JSON.
+Run it from the project folder:
+
+    python RainfallService.py --port 8050 --cache-size 256
+
+@author: Merlin <|:3
+"""
+import io
+import json
+import math
+import time
+import argparse
+import threading
+import functools
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+import RainfallLoader
+import RainfallEngine
+from RainfallLoader import STATION_COLUMN, WEEKDAY_ORDER
+
+CACHE_SIZE = 256
+QUERIES = ['weekday', 'heavy', 'yearly']
+
+# Graph of RainfallRender per query
+GRAPHS = {'weekday': 'weekday_mean', 'heavy': 'heavy_days', 'yearly': 'yearly'}
+
+
+class QueryError(ValueError):
+    """A query with invalid parameters (answered with 400 Bad Request)."""
+
+
+def load_data(data_root='Data', workers=None, cache_dir=RainfallLoader.CACHE_DIR):
+    """Load the valid rows of every station once (negative values, -999 and empty cells are left out)."""
+    station_dirs = RainfallLoader.discover_stations(data_root)
+    arrays = RainfallLoader.load_stations_arrays(station_dirs, workers, cache_dir)
+    keep = arrays['rainfall'] >= 0
+    year = arrays['year'][keep].astype(np.int64)
+    return {
+        'stations': [RainfallLoader.station_name(station_dir) for station_dir in station_dirs],
+        'station': arrays['station'][keep].astype(np.int64),
+        'year': year,
+        'month': arrays['month'][keep].astype(np.int64),
+        'weekday': arrays['weekday'][keep].astype(np.int64),
+        'rainfall': arrays['rainfall'][keep],
+        'milli': RainfallEngine.to_milli(arrays['rainfall'][keep]),
+        'first_year': int(year.min()) if len(year) else 0,
+        'last_year': int(year.max()) if len(year) else 0,
+    }
+
+
+def _values(params, name):
+    """All values of a parameter, comma-separated or repeated."""
+    return [value.strip() for raw in params.get(name, []) for value in raw.split(',') if value.strip()]
+
+
+def normalize(data, query, params):
+    """
+    Turn the parameters of a query into its cache key.
+
+    Equivalent questions get the same key: stations are sorted station
+    codes (all if none are given), the year range is clipped to the data,
+    months are a sorted tuple and the cutoff a float. Raises QueryError
+    for invalid parameters.
+    """
+    if query not in QUERIES:
+        raise QueryError(f'Unknown query: {query}')
+
+    names = _values(params, 'station')
+    unknown = [name for name in names if name not in data['stations']]
+    if unknown:
+        raise QueryError(f'Unknown station(s): {", ".join(unknown)}')
+    stations = tuple(sorted({data['stations'].index(name) for name in names})) if names \
+        else tuple(range(len(data['stations'])))
+
+    try:
+        # "1993-2024", "1993-" (open end) or "1993" (one year)
+        years = (_values(params, 'years') or [''])[0]
+        first, separator, last = years.partition('-')
+        first_year = int(first) if first else data['first_year']
+        last_year = int(last) if last else first_year if first and not separator else data['last_year']
+        first_year, last_year = max(first_year, data['first_year']), min(last_year, data['last_year'])
+        months = tuple(sorted({int(month) for month in _values(params, 'months')})) or tuple(range(1, 13))
+        cutoff = float((_values(params, 'cutoff') or [RainfallEngine.RAINY_DAY_CUTOFF])[0])
+    except ValueError as exc:
+        raise QueryError(f'Invalid parameter: {exc}') from None
+    if not all(1 <= month <= 12 for month in months):
+        raise QueryError('Months must be between 1 and 12')
+    if not math.isfinite(cutoff):
+        raise QueryError('cutoff must be a finite number')
+
+    output = (_values(params, 'format') or ['json'])[0]
+    lang = (_values(params, 'lang') or ['en'])[0]
+    if output not in ('json', 'png') or lang not in ('en', 'de'):
+        raise QueryError('format must be json or png, lang en or de')
+    if output == 'png' and len(stations) != 1:
+        raise QueryError('format=png needs exactly one station')
+    # Only PNGs depend on the language
+    return query, stations, first_year, last_year, months, cutoff, output, lang if output == 'png' else None
+
+
+def compute(data, key):
+    """
+    Answer a normalized query.
+
+    Returns the rows of the weekday table (station, Weekday, mean,
+    heavy_days, total, days) for weekday and heavy, or of the yearly table
+    (station, Year, total, heavy_days, days) for yearly, and the first and
+    last year with data per station.
+    """
+    query, stations, first_year, last_year, months, cutoff = key[:6]
+    selected = (np.isin(data['station'], stations) & (data['year'] >= first_year) & (data['year'] <= last_year)
+                & np.isin(data['month'], months))
+    station, year = data['station'][selected], data['year'][selected]
+    milli, heavy = data['milli'][selected], data['rainfall'][selected] > cutoff
+    n_years = max(last_year - first_year + 1, 0)
+
+    # Per station: first and last year with data
+    years = {}
+    for code in stations:
+        station_years = year[station == code]
+        if len(station_years):
+            years[data['stations'][code]] = [int(station_years.min()), int(station_years.max())]
+
+    if query == 'yearly':
+        cell, n_cells, labels = station * n_years + (year - first_year), len(data['stations']) * n_years, 'Year'
+    else:
+        known = data['weekday'][selected] >= 0
+        station, milli, heavy = station[known], milli[known], heavy[known]
+        cell, n_cells, labels = station * 7 + data['weekday'][selected][known], len(data['stations']) * 7, 'Weekday'
+    days = np.bincount(cell, minlength=n_cells)
+    total = np.bincount(cell, weights=milli, minlength=n_cells) / RainfallEngine.SUM_SCALE
+    heavy_days = np.bincount(cell, weights=heavy, minlength=n_cells).astype(np.int64)
+
+    rows = []
+    for code in stations:
+        if data['stations'][code] not in years:
+            continue
+        if query == 'yearly':
+            slots = [(code * n_years + i, first_year + i) for i in range(n_years) if days[code * n_years + i]]
+        else:
+            slots = [(code * 7 + i, weekday) for i, weekday in enumerate(WEEKDAY_ORDER)]
+        for slot, label in slots:
+            row = {STATION_COLUMN: data['stations'][code], labels: label}
+            if query != 'yearly':
+                row['mean'] = float(total[slot] / days[slot]) if days[slot] else None
+            row.update(heavy_days=int(heavy_days[slot]), total=float(total[slot]), days=int(days[slot]))
+            rows.append(row)
+    return {'rows': rows, 'years': years}
+
+
+_RENDER_LOCK = threading.Lock()
+
+
+def render(result, key, dpi=100):
+    """Render the graph of a one-station answer and return the PNG bytes (matplotlib is imported on first use)."""
+    import pandas as pd
+    import matplotlib.style
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    import RainfallRender
+
+    query, _, _, _, _, cutoff, _, lang = key
+    station, (min_year, max_year) = next(iter(result['years'].items()))
+    table = pd.DataFrame(result['rows'])
+    if query != 'yearly':
+        table['Weekday'] = pd.Categorical(table['Weekday'], categories=WEEKDAY_ORDER, ordered=True)
+    tables = {'weekday': table, 'yearly': table, 'min_year': min_year, 'max_year': max_year}
+
+    buffer = io.BytesIO()
+    with _RENDER_LOCK, matplotlib.style.context(RainfallRender.DEFAULT_STYLE):
+        fig = Figure(figsize=RainfallRender.FIGURE_SIZES[GRAPHS[query]])
+        FigureCanvasAgg(fig)
+        RainfallRender.draw_graph(fig, GRAPHS[query], tables, cutoff, lang, station)
+        fig.savefig(buffer, format='png', dpi=dpi)
+    return buffer.getvalue()
+
+
+def make_answer(data, cache_size=CACHE_SIZE, dpi=100):
+    """
+    Return the cached answer function of the service: normalized key → answer.
+
+    The answer is a dict for JSON queries and PNG bytes for format=png;
+    answer.cache_info() holds the hits and misses.
+    """
+    @functools.lru_cache(maxsize=cache_size)
+    def answer(key):
+        result = compute(data, key)
+        if key[6] == 'png':
+            if not result['years']:
+                raise QueryError('No data for this query')
+            return render(result, key, dpi)
+        query, stations, first_year, last_year, months, cutoff = key[:6]
+        return {
+            'query': {'query': query, 'stations': [data['stations'][code] for code in stations],
+                      'years': [first_year, last_year], 'months': list(months), 'cutoff': cutoff},
+            **result,
+        }
+    return answer
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """Answers the queries of the service; data, answer and started are set by make_server."""
+
+    protocol_version = 'HTTP/1.1'
+    data = None
+    answer = None
+    started = 0.0
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        params = urllib.parse.parse_qs(url.query)
+        path = url.path.strip('/')
+        start = time.perf_counter()
+        try:
+            if path == 'metrics':
+                body = self.metrics()
+            elif path == 'stations':
+                body = {'stations': self.data['stations'], 'years': [self.data['first_year'], self.data['last_year']]}
+            else:
+                body = self.answer(normalize(self.data, path, params))
+        except QueryError as exc:
+            self.send_json(400 if path in QUERIES else 404, {'error': str(exc)})
+            return
+        except Exception as exc:  # e.g. while rendering: answer instead of dropping the connection
+            self.send_json(500, {'error': f'{type(exc).__name__}: {exc}'})
+            return
+        if isinstance(body, bytes):
+            self.send_body(200, 'image/png', body, start)
+        else:
+            self.send_json(200, body, start)
+
+    def metrics(self):
+        info = self.answer.cache_info()
+        return {
+            'hits': info.hits, 'misses': info.misses, 'cached': info.currsize, 'cache_size': info.maxsize,
+            'hit_rate': info.hits / (info.hits + info.misses) if info.hits + info.misses else None,
+            'rows': int(len(self.data['year'])), 'uptime_s': round(time.time() - self.started, 1),
+        }
+
+    def send_json(self, status, body, start=None):
+        self.send_body(status, 'application/json', json.dumps(body, ensure_ascii=False).encode('utf-8'), start)
+
+    def send_body(self, status, content_type, body, start=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if start is not None:
+            self.send_header('Server-Timing', f'answer;dur={(time.perf_counter() - start) * 1000:.2f}')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(data, host='127.0.0.1', port=8050, cache_size=CACHE_SIZE, dpi=100):
+    """Create the (not yet serving) service for loaded data; its port is server.server_address[1]."""
+    handler = type('Handler', (ServiceHandler,), {
+        'data': data, 'answer': staticmethod(make_answer(data, cache_size, dpi)), 'started': time.time(),
+    })
+    return ThreadingHTTPServer((host, port), handler)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve rainfall queries as JSON or PNG over HTTP.')
+    parser.add_argument('--data-root', default='Data', help='folder with one sub folder per station')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=8050, help='port to listen on')
+    parser.add_argument('--cache-size', type=int, default=CACHE_SIZE, help='answers kept in the LRU cache')
+    parser.add_argument('--dpi', type=int, default=100, help='resolution of PNG answers')
+    args = parser.parse_args()
+
+    server = make_server(load_data(args.data_root), args.host, args.port, args.cache_size, args.dpi)
+    print(f'Serving {len(server.RequestHandlerClass.data["stations"])} stations on '
+          f'http://{args.host}:{server.server_address[1]}/')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+Significance of the weekday effect: permutation tests and bootstrap
+confidence intervals, computed in batches of resamples at once.
+
+Permutation test: the weekday labels are shuffled among the days of a
+station. How often a shuffled weekday mean (or heavy rain day count)
+deviates from the station's overall value at least as much as the
+observed one gives the weekday's p-value; the same is done for the range
+between the wettest and the driest weekday. Heavy rain day counts of a
+shuffle follow a multivariate hypergeometric distribution and are drawn
+directly. For the means only the days with rain are shuffled (dry days
+add nothing to the sums), and the sums of all weekdays of all resamples
+in a batch are taken with one reduceat call.
+
+Bootstrap: the days of each weekday are resampled with replacement to
+get percentile intervals of the weekday mean; heavy rain day counts of a
+resample are binomial and drawn directly.
+
+Weekdays without any day (e.g. in a narrow selection of years or months)
+are left out of the tests and the results.
+
+The resamples of every station are split into fixed shards with their own
+seeds (spawned from one seed), so the results are reproducible and do not
+depend on how many worker processes run the shards.
+
+Run it from the project folder:
+
+    python RainfallSignificance.py --resamples 100000 --seed 1 --render
+
+@author: Merlin <|:3
+"""
+import os  # operating system dependent functionality
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import RainfallLoader
+import RainfallEngine
+from RainfallLoader import RAINFALL_COLUMN, STATION_COLUMN, WEEKDAY_ORDER
+
+# Resamples per shard (the unit of work of a worker process) and per vectorized batch
+SHARD_SIZE = 10000
+BATCH_SIZE = 256
+
+# Tolerance when comparing resampled with observed statistics
+_TOLERANCE = 1e-9
+
+
+def station_samples(df_final):
+    """Return {station: (rainfall, weekday codes)} of the days with a known weekday."""
+    known = df_final['Weekday'].cat.codes.to_numpy() >= 0
+    rainfall = df_final[RAINFALL_COLUMN].to_numpy(np.float64)[known]
+    weekday = df_final['Weekday'].cat.codes.to_numpy(np.int64)[known]
+    if STATION_COLUMN not in df_final:
+        return {'': (rainfall, weekday)}
+    codes = df_final[STATION_COLUMN].cat.codes.to_numpy()[known]
+    return {
+        station: (rainfall[codes == code], weekday[codes == code])
+        for code, station in enumerate(df_final[STATION_COLUMN].cat.categories)
+        if (codes == code).any()
+    }
+
+
+def _observed(rainfall, weekday, cutoff):
+    """Days, rainfall sums and heavy rain day counts per weekday."""
+    days = np.bincount(weekday, minlength=7)
+    sums = np.bincount(weekday, weights=rainfall, minlength=7)
+    heavy = np.bincount(weekday, weights=rainfall > cutoff, minlength=7)
+    return days, sums, heavy
+
+
+def _spread(values):
+    """Range between the largest and the smallest weekday value, per resample."""
+    return values.max(axis=-1) - values.min(axis=-1)
+
+
+def permutation_shard(task):
+    """
+    Run one shard of the permutation test for one station.
+
+    task is (rainfall, weekday, cutoff, n_resamples, seed_sequence,
+    batch_size). Returns the number of resamples at least as extreme as
+    the observation, per weekday and for the range, for means and heavy
+    rain day counts.
+    """
+    rainfall, weekday, cutoff, n_resamples, seed_sequence, batch_size = task
+    rng = np.random.default_rng(seed_sequence)
+    days, sums, heavy = _observed(rainfall, weekday, cutoff)
+    overall_mean, heavy_rate = sums.sum() / days.sum(), heavy.sum() / days.sum()
+    # Weekdays without days have no mean; they are left out of the comparisons
+    present = days > 0
+    observed_mean = sums[present] / days[present]
+    observed_rate = heavy[present] / days[present]
+
+    # Only days with rain contribute to the sums
+    wet = rainfall[rainfall != 0]
+    n_wet, n_heavy = len(wet), int(heavy.sum())
+
+    counts = {name: np.zeros(7, dtype=np.int64) for name in ('mean', 'heavy_days')}
+    counts.update(mean_range=0, heavy_days_range=0)
+    for start in range(0, n_resamples, batch_size):
+        size = min(batch_size, n_resamples - start)
+
+        # Heavy rain days per weekday of a shuffle: a multivariate hypergeometric draw
+        rate = rng.multivariate_hypergeometric(days, n_heavy, size=size)[:, present] / days[present]
+        counts['heavy_days'][present] += (
+            np.abs(rate - heavy_rate) >= np.abs(observed_rate - heavy_rate) - _TOLERANCE
+        ).sum(axis=0)
+        counts['heavy_days_range'] += int((_spread(rate) >= _spread(observed_rate) - _TOLERANCE).sum())
+
+        # Wet days per weekday of a shuffle, then a random split of the shuffled wet days
+        wet_days = rng.multivariate_hypergeometric(days, n_wet, size=size)
+        shuffled = rng.permuted(np.broadcast_to(wet, (size, n_wet)), axis=1).ravel()
+        shuffled = np.append(shuffled, 0.0)  # so a start index at the very end stays valid
+        bounds = np.concatenate([np.zeros((size, 1), dtype=np.int64), wet_days[:, :-1].cumsum(axis=1)], axis=1)
+        bounds += np.arange(size)[:, None] * n_wet
+        resampled = np.add.reduceat(shuffled, bounds.ravel())[:size * 7].reshape(size, 7)
+        resampled[wet_days == 0] = 0  # reduceat returns an element for empty slices
+        mean = resampled[:, present] / days[present]
+        counts['mean'][present] += (np.abs(mean - overall_mean) >= np.abs(observed_mean - overall_mean) - _TOLERANCE).sum(axis=0)
+        counts['mean_range'] += int((_spread(mean) >= _spread(observed_mean) - _TOLERANCE).sum())
+    return counts
+
+
+def bootstrap_shard(task):
+    """
+    Run one shard of the bootstrap for one station.
+
+    task is (rainfall, weekday, cutoff, n_resamples, seed_sequence,
+    batch_size). Returns resampled weekday means and heavy rain day
+    counts, one row per resample.
+    """
+    rainfall, weekday, cutoff, n_resamples, seed_sequence, batch_size = task
+    rng = np.random.default_rng(seed_sequence)
+    days, _, heavy = _observed(rainfall, weekday, cutoff)
+    by_weekday = [rainfall[weekday == code] for code in range(7)]
+
+    means = np.full((n_resamples, 7), np.nan)
+    for start in range(0, n_resamples, batch_size):
+        size = min(batch_size, n_resamples - start)
+        for code, values in enumerate(by_weekday):
+            if len(values):
+                means[start:start + size, code] = values[rng.integers(0, len(values), (size, len(values)))].mean(axis=1)
+
+    # Heavy rain days of a resample of n days with rate heavy / n: binomial
+    heavy_days = rng.binomial(days, np.divide(heavy, days, out=np.zeros(7), where=days > 0), size=(n_resamples, 7))
+    return {'mean': means, 'heavy_days': heavy_days}
+
+
+def _shards(samples, kind, cutoff, n_resamples, seed, batch_size):
+    """Split every station's resamples into shard tasks with their own spawned seeds."""
+    tasks = []
+    station_seeds = np.random.SeedSequence([seed, 0 if kind == 'permutation' else 1]).spawn(len(samples))
+    for (station, (rainfall, weekday)), station_seed in zip(samples.items(), station_seeds):
+        sizes = [min(SHARD_SIZE, n_resamples - start) for start in range(0, n_resamples, SHARD_SIZE)]
+        for size, shard_seed in zip(sizes, station_seed.spawn(len(sizes))):
+            tasks.append((station, (rainfall, weekday, cutoff, size, shard_seed, batch_size)))
+    return tasks
+
+
+def _run(function, tasks, workers):
+    """Run shard tasks serially (workers=1) or in a process pool, keeping their order."""
+    if workers == 1 or len(tasks) <= 1:
+        return [function(task) for _, task in tasks]
+    with ProcessPoolExecutor(max_workers=min(workers or os.cpu_count() or 1, len(tasks))) as pool:
+        return list(pool.map(function, [task for _, task in tasks]))
+
+
+def significance(df_final, cutoff=RainfallEngine.RAINY_DAY_CUTOFF, n_resamples=10000, seed=0, confidence=0.95,
+                 workers=None, batch_size=BATCH_SIZE):
+    """
+    Permutation p-values and bootstrap intervals of the weekday means and heavy rain day counts.
+
+    Returns a dict with a 'weekday' table (station, Weekday, mean,
+    mean_low, mean_high, mean_p, heavy_days, heavy_days_low,
+    heavy_days_high, heavy_days_p) and a 'stations' table with the
+    p-values of the range between the wettest and the driest weekday.
+    """
+    samples = station_samples(df_final)
+    alpha = (1 - confidence) / 2
+
+    permutation_tasks = _shards(samples, 'permutation', cutoff, n_resamples, seed, batch_size)
+    bootstrap_tasks = _shards(samples, 'bootstrap', cutoff, n_resamples, seed, batch_size)
+    permutation_results = _run(permutation_shard, permutation_tasks, workers)
+    bootstrap_results = _run(bootstrap_shard, bootstrap_tasks, workers)
+
+    weekday_rows, station_rows = [], []
+    for station, (rainfall, weekday) in samples.items():
+        days, sums, heavy = _observed(rainfall, weekday, cutoff)
+        counts = [result for (name, _), result in zip(permutation_tasks, permutation_results) if name == station]
+        resamples = [result for (name, _), result in zip(bootstrap_tasks, bootstrap_results) if name == station]
+        exceed = {key: sum(count[key] for count in counts) for key in counts[0]}
+        p_value = {key: (exceed[key] + 1) / (n_resamples + 1) for key in exceed}
+        means = np.concatenate([result['mean'] for result in resamples])
+        heavy_days = np.concatenate([result['heavy_days'] for result in resamples])
+
+        mean_low, mean_high = np.quantile(means, [alpha, 1 - alpha], axis=0)
+        heavy_low, heavy_high = np.quantile(heavy_days, [alpha, 1 - alpha], axis=0)
+        for code in np.flatnonzero(days):
+            weekday_rows.append({
+                STATION_COLUMN: station, 'Weekday': WEEKDAY_ORDER[code],
+                'mean': sums[code] / days[code], 'mean_low': mean_low[code], 'mean_high': mean_high[code],
+                'mean_p': p_value['mean'][code],
+                'heavy_days': int(heavy[code]), 'heavy_days_low': heavy_low[code], 'heavy_days_high': heavy_high[code],
+                'heavy_days_p': p_value['heavy_days'][code],
+            })
+        station_rows.append({STATION_COLUMN: station, 'days': int(days.sum()), 'resamples': n_resamples,
+                             'mean_range_p': p_value['mean_range'], 'heavy_days_range_p': p_value['heavy_days_range']})
+
+    weekday_table = pd.DataFrame(weekday_rows)
+    weekday_table['Weekday'] = pd.Categorical(weekday_table['Weekday'], categories=WEEKDAY_ORDER, ordered=True)
+    return {'weekday': weekday_table, 'stations': pd.DataFrame(station_rows)}
+
+
+def with_intervals(statistics, result):
+    """Add the bootstrap interval columns to the engine's weekday table, so the graphs draw error bars."""
+    columns = [STATION_COLUMN, 'Weekday', 'mean_low', 'mean_high', 'heavy_days_low', 'heavy_days_high']
+    intervals = result['weekday'][columns].astype({STATION_COLUMN: str, 'Weekday': str})
+    weekday = statistics['weekday']
+    merged = weekday.astype({STATION_COLUMN: str, 'Weekday': str}).merge(intervals, on=[STATION_COLUMN, 'Weekday'], how='left')
+    for column in columns[2:]:
+        weekday = weekday.assign(**{column: merged[column].to_numpy()})
+    return {**statistics, 'weekday': weekday}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Test the significance of the weekday effect.')
+    parser.add_argument('--data-root', default='Data', help='folder with one sub folder per station')
+    parser.add_argument('--cutoff', type=float, default=RainfallEngine.RAINY_DAY_CUTOFF, help='heavy rain day threshold in l/m²')
+    parser.add_argument('--resamples', type=int, default=10000, help='permutations and bootstrap resamples per station')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--confidence', type=float, default=0.95, help='confidence level of the intervals')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes')
+    parser.add_argument('--render', action='store_true', help='render the weekday graphs with error bars')
+    parser.add_argument('--output-dir', default='graphs', help='graphs are saved in <output-dir>/<station>/')
+    args = parser.parse_args()
+
+    df_final = RainfallLoader.load_all_stations(args.data_root, args.workers)
+    result = significance(df_final, args.cutoff, args.resamples, args.seed, args.confidence, args.workers)
+    with pd.option_context('display.max_rows', None, 'display.width', 160):
+        print(result['weekday'].to_string(index=False))
+        print()
+        print(result['stations'].to_string(index=False))
+
+    if args.render:
+        import RainfallRender  # matplotlib is only needed for the graphs
+
+        statistics = with_intervals(RainfallEngine.compute_statistics(df_final, args.cutoff), result)
+        for output_path in RainfallRender.render_all(statistics, graphs=['weekday_mean', 'heavy_days'],
+                                                     output_dir=args.output_dir, workers=args.workers):
+            print(f'Graph saved as: {output_path}')
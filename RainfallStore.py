@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""
+Append-only store for incremental ingestion of newly arrived files.
+
+The store keeps a manifest of every ingested file (path, size, mtime),
+the parsed rows of each file as a small segment, and running aggregates
+in the layout of the aggregate cube (station × year × month × weekday).
+The aggregates are split into one slice file per station and year, so
+when a new quarter arrives, only the new files are parsed and only the
+slices of the years they touch are read and written again; changed or
+removed files are first subtracted again using their stored segment. The
+cost of an update depends on the new files, not on how many years or
+stations are stored. Rewritten slices get a new generation number in
+their file name and the manifest, which names the slice of every station
+and year, is replaced atomically last, so a crash in between leaves the
+previous store intact.
+
+Rainfall sums are kept as integer thousandths of a l/m² and the stations
+stay sorted by name, so adding and subtracting is exact and an updated
+store is bit-identical to a full rebuild, no matter in which order the
+files arrived.
+
+Run it from the project folder after new files were saved to Data/:
+
+    python RainfallStore.py --data-root Data
+
+@author: Merlin <|:3
+"""
+import os  # operating system dependent functionality
+import json
+import shutil
+import argparse
+
+import numpy as np
+
+import RainfallLoader
+import RainfallCube
+import RainfallEngine
+
+# Default location of the store
+STORE_DIR = os.path.join(RainfallLoader.CACHE_DIR, 'store')
+STORE_VERSION = 3
+MANIFEST_NAME = 'manifest.json'
+
+# Rainfall sums are stored as integers in this fraction of a l/m²
+SUM_SCALE = RainfallEngine.SUM_SCALE
+
+_N_BINS = len(RainfallCube.BIN_EDGES) + 1
+
+
+def open_store(path=STORE_DIR):
+    """Read the manifest of a store (an empty store if there is none)."""
+    manifest_path = os.path.join(path, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return {'path': path, 'generation': 0, 'files': {}, 'slices': {}}
+
+    with open(manifest_path, encoding='utf-8') as manifest_file:
+        manifest = json.load(manifest_file)
+    if manifest['version'] != STORE_VERSION:
+        raise ValueError(f'Unsupported store version {manifest["version"]} in {path}')
+    return {'path': path, 'generation': manifest['generation'], 'files': manifest['files'],
+            'slices': manifest['slices']}
+
+
+def _save_manifest(store):
+    """Write the manifest, replacing it atomically."""
+    path = store['path']
+    os.makedirs(path, exist_ok=True)
+    manifest = {'version': STORE_VERSION, 'generation': store['generation'],
+                'files': store['files'], 'slices': store['slices']}
+    tmp_path = os.path.join(path, MANIFEST_NAME + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as tmp_file:
+        json.dump(manifest, tmp_file)
+    os.replace(tmp_path, os.path.join(path, MANIFEST_NAME))
+
+
+def store_stations(store):
+    """Return the sorted names of the stations with ingested files."""
+    return sorted({entry['station'] for entry in store['files'].values()})
+
+
+def _slice_path(store, station, year, generation):
+    """Return the file holding the aggregates of one station and year."""
+    return os.path.join(store['path'], 'slices', station, f'{year}_{generation}.npz')
+
+
+def _empty_slice():
+    """Aggregates of one station and year without any data."""
+    return {
+        'total_milli': np.zeros((12, 7), dtype=np.int64),
+        'days': np.zeros((12, 7), dtype=np.int32),
+        'missing': np.zeros((12, 7), dtype=np.int32),
+        'histogram': np.zeros((12, 7, _N_BINS), dtype=np.int32),
+    }
+
+
+def _read_slice(store, station, year):
+    """Read the aggregates of one station and year (empty ones if the store has none)."""
+    generation = store['slices'].get(station, {}).get(str(year))
+    if generation is None:
+        return _empty_slice()
+    with np.load(_slice_path(store, station, year, generation), allow_pickle=False) as data:
+        return {name: data[name] for name in data.files}
+
+
+def _write_slice(slice_path, aggregates):
+    """Store the aggregates of one station and year."""
+    os.makedirs(os.path.dirname(slice_path), exist_ok=True)
+    with open(slice_path, 'wb') as slice_file:
+        np.savez(slice_file, **aggregates)
+
+
+def _segment_path(store, station, filename):
+    """Return the segment file holding the parsed rows of one source file."""
+    return os.path.join(store['path'], 'segments', station, os.path.basename(filename) + '.npz')
+
+
+def _write_segment(segment_path, part):
+    """Store the parsed rows of one file."""
+    os.makedirs(os.path.dirname(segment_path), exist_ok=True)
+    with open(segment_path, 'wb') as segment_file:
+        np.savez(segment_file, **part)
+
+
+def _read_segment(segment_path):
+    """Read the parsed rows of one file."""
+    with np.load(segment_path, allow_pickle=False) as data:
+        return {field: data[field] for field in RainfallLoader.ROW_FIELDS}
+
+
+def _add_cells(values, cells, amounts, sign):
+    """Add sign × amounts to the flat cells of values, in place, touching only the cells that occur."""
+    touched, inverse = np.unique(cells, return_inverse=True)
+    sums = np.zeros(len(touched), dtype=values.dtype)
+    np.add.at(sums, inverse, amounts)
+    # The aggregate arrays are contiguous, so reshape(-1) is a view
+    np.add.at(values.reshape(-1), touched, sign * sums)
+
+
+def _accumulate(store, touched, station, part, sign):
+    """
+    Add (sign=1) or subtract (sign=-1) the rows of one file to the slices they fall into.
+
+    The slices are read on first use and collected in touched, keyed by
+    (station, year), until they are written.
+    """
+    placed = (part['month'] >= 1) & (part['month'] <= 12) & (part['weekday'] >= 0)
+    year = part['year'][placed]
+    for slice_year in np.unique(year).tolist():
+        key = (station, slice_year)
+        if key not in touched:
+            touched[key] = _read_slice(store, station, slice_year)
+        aggregates = touched[key]
+
+        rows = year == slice_year
+        cell = np.ravel_multi_index((
+            part['month'][placed][rows].astype(np.int64) - 1,
+            part['weekday'][placed][rows].astype(np.int64),
+        ), (12, 7))
+
+        rainfall = part['rainfall'][placed][rows]
+        valid = rainfall >= 0
+        milli = RainfallEngine.to_milli(rainfall[valid])
+        bins = np.searchsorted(RainfallCube.BIN_EDGES, rainfall[valid], side='left')
+
+        # Exact integer sums per touched cell; the cost depends on the rows of the file only
+        _add_cells(aggregates['total_milli'], cell[valid], milli, sign)
+        _add_cells(aggregates['days'], cell[valid], 1, sign)
+        _add_cells(aggregates['missing'], cell[~valid], 1, sign)
+        _add_cells(aggregates['histogram'], cell[valid] * _N_BINS + bins, 1, sign)
+
+
+def update_store(data_root='Data', path=STORE_DIR):
+    """
+    Bring the store up to date with the files under data_root.
+
+    Only new or changed files are parsed. Returns the lists of 'added',
+    'changed' and 'removed' file paths.
+    """
+    store = open_store(path)
+    files = store['files']
+
+    current = {}
+    for station_dir in RainfallLoader.discover_stations(data_root):
+        station = RainfallLoader.station_name(station_dir)
+        for filename in RainfallLoader.list_station_files(station_dir):
+            stat = os.stat(filename)
+            current[filename] = (station, stat.st_size, stat.st_mtime_ns)
+
+    added = [name for name in current if name not in files]
+    changed = [name for name in current if name in files
+               and (files[name]['size'], files[name]['mtime']) != current[name][1:]]
+    removed = [name for name in files if name not in current]
+    if not (added or changed or removed):
+        return {'added': [], 'changed': [], 'removed': []}
+
+    # Subtract the old rows of changed and removed files
+    touched = {}
+    removed_segments = []
+    for filename in changed + removed:
+        entry = files.pop(filename)
+        _accumulate(store, touched, entry['station'], _read_segment(entry['segment']), -1)
+        if filename in removed:
+            removed_segments.append(entry['segment'])
+
+    # Parse only the new and changed files, in one bulk pass
+    to_parse = sorted(added + changed)
+    parts = RainfallLoader.parse_files(to_parse)
+    for filename, part in zip(to_parse, parts):
+        station, size, mtime = current[filename]
+        segment_path = _segment_path(store, station, filename)
+        _write_segment(segment_path, part)
+        _accumulate(store, touched, station, part, 1)
+        files[filename] = {'station': station, 'size': size, 'mtime': mtime,
+                           'rows': int(len(part['year'])), 'segment': segment_path}
+
+    # Write the touched slices under the next generation; slices left
+    # without any rows are dropped, as a rebuild would never create them
+    old_slices = []
+    store['generation'] += 1
+    for (station, year), aggregates in sorted(touched.items()):
+        station_slices = store['slices'].setdefault(station, {})
+        if str(year) in station_slices:
+            old_slices.append(_slice_path(store, station, year, station_slices.pop(str(year))))
+        if aggregates['days'].any() or aggregates['missing'].any():
+            _write_slice(_slice_path(store, station, year, store['generation']), aggregates)
+            station_slices[str(year)] = store['generation']
+        if not station_slices:
+            del store['slices'][station]
+
+    _save_manifest(store)
+    # Old slices and segments of removed files are only deleted once the manifest no longer lists them
+    for stale_path in old_slices + removed_segments:
+        os.remove(stale_path)
+        if not os.listdir(os.path.dirname(stale_path)):
+            os.rmdir(os.path.dirname(stale_path))
+    return {'added': sorted(added), 'changed': sorted(changed), 'removed': sorted(removed)}
+
+
+def rebuild_store(data_root='Data', path=STORE_DIR):
+    """Delete the store and ingest every file under data_root again."""
+    shutil.rmtree(path, ignore_errors=True)
+    return update_store(data_root, path)
+
+
+def store_cube(path=STORE_DIR):
+    """Assemble the store's slices into a cube for RainfallCube.query."""
+    store = open_store(path)
+    stations = store_stations(store)
+    years = [int(year) for station_slices in store['slices'].values() for year in station_slices]
+    first_year = min(years, default=0)
+    n_years = max(years) - first_year + 1 if years else 0
+
+    cube = {name: np.zeros((len(stations), n_years) + values.shape, dtype=values.dtype)
+            for name, values in _empty_slice().items()}
+    for station, station_slices in store['slices'].items():
+        for year in station_slices:
+            aggregates = _read_slice(store, station, int(year))
+            for name, values in aggregates.items():
+                cube[name][stations.index(station), int(year) - first_year] = values
+    return {
+        'stations': np.array(stations, dtype=str),
+        'first_year': first_year,
+        'total': cube['total_milli'] / SUM_SCALE,
+        'days': cube['days'],
+        'missing': cube['missing'],
+        'histogram': cube['histogram'],
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Ingest new rainfall files into the incremental store.')
+    parser.add_argument('--data-root', default='Data', help='folder with one sub folder per station')
+    parser.add_argument('--store', default=STORE_DIR, help='store folder')
+    parser.add_argument('--rebuild', action='store_true', help='rebuild the store from scratch')
+    args = parser.parse_args()
+
+    summary = (rebuild_store if args.rebuild else update_store)(args.data_root, args.store)
+    for kind in ('added', 'changed', 'removed'):
+        print(f'{kind.capitalize()}: {len(summary[kind])} file(s)')
+        for filename in summary[kind]:
+            print(f'  {filename}')
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Bounded-memory streaming aggregation of the rainfall statistics.
+
+Instead of loading every station into one data frame, the files are read
+in chunks of at most max_chunk_bytes of CSV text. Every chunk is reduced
+to the small grouped table of RainfallEngine.aggregate and folded into a
+running table right away, so the peak memory depends on the chunk size
+and the number of (station, year, weekday) groups, not on how many years
+or stations are processed. Because the engine sums rainfall as integer
+thousandths, the result is identical to RainfallEngine.analyze for any
+chunk size.
+
+Run it from the project folder, e.g.:
+
+    python RainfallStreaming.py --max-chunk-mb 1 --cutoff 5
+
+@author: Merlin <|:3
+"""
+import os  # operating system dependent functionality
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import RainfallLoader
+import RainfallEngine
+
+# Default upper bound of CSV text parsed at once
+MAX_CHUNK_BYTES = 16 * 1024 * 1024
+
+
+def iter_files(station_dirs):
+    """Yield (station index, file path) for every file of the given station directories."""
+    for station_index, station_dir in enumerate(station_dirs):
+        for filename in RainfallLoader.list_station_files(station_dir):
+            yield station_index, filename
+
+
+def iter_chunks(station_dirs, max_chunk_bytes=MAX_CHUNK_BYTES):
+    """
+    Yield row arrays (with a 'station' code array) of consecutive files.
+
+    Files are grouped until their size reaches max_chunk_bytes; a single
+    larger file still forms a chunk of its own.
+    """
+    chunk, chunk_bytes = [], 0
+    for station_index, filename in iter_files(station_dirs):
+        size = os.path.getsize(filename)
+        if chunk and chunk_bytes + size > max_chunk_bytes:
+            yield _parse_chunk(chunk)
+            chunk, chunk_bytes = [], 0
+        chunk.append((station_index, filename))
+        chunk_bytes += size
+    if chunk:
+        yield _parse_chunk(chunk)
+
+
+def _parse_chunk(chunk):
+    """Bulk-parse the files of one chunk into row arrays with station codes."""
+    parts = RainfallLoader.parse_files([filename for _, filename in chunk])
+    arrays = RainfallLoader.concat_parts(parts)
+    counts = [len(part['year']) for part in parts]
+    arrays['station'] = np.repeat(np.array([station_index for station_index, _ in chunk], dtype=np.int32), counts)
+    return arrays
+
+
+def iter_partials(chunks, stations, cutoff=RainfallEngine.RAINY_DAY_CUTOFF):
+    """Reduce every chunk of row arrays to a partial table of RainfallEngine.aggregate."""
+    for arrays in chunks:
+        yield RainfallEngine.aggregate(RainfallLoader.to_frame(arrays, stations=stations), cutoff)
+
+
+def fold_partials(partials):
+    """Fold partial tables into one as they arrive, keeping only the running table in memory."""
+    running = None
+    for partial in partials:
+        running = partial if running is None else RainfallEngine.merge_partials([running, partial])
+    return running
+
+
+def analyze_streaming(station_dirs=None, data_root='Data', cutoff=RainfallEngine.RAINY_DAY_CUTOFF,
+                      max_chunk_bytes=MAX_CHUNK_BYTES):
+    """
+    Compute the same statistics as RainfallEngine.analyze chunk by chunk.
+
+    Returns the dict of RainfallEngine.statistics_from_partial.
+    """
+    if station_dirs is None:
+        station_dirs = RainfallLoader.discover_stations(data_root)
+    stations = [RainfallLoader.station_name(station_dir) for station_dir in station_dirs]
+    partial = fold_partials(iter_partials(iter_chunks(station_dirs, max_chunk_bytes), stations, cutoff))
+    if partial is None:
+        raise ValueError(f'No rainfall files found in {", ".join(station_dirs) or data_root}')
+    return RainfallEngine.statistics_from_partial(partial, cutoff)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compute the rainfall statistics with bounded memory.')
+    parser.add_argument('--data-root', default='Data', help='folder with one sub folder per station')
+    parser.add_argument('--cutoff', type=float, default=RainfallEngine.RAINY_DAY_CUTOFF, help='heavy rain day threshold in l/m²')
+    parser.add_argument('--max-chunk-mb', type=float, default=MAX_CHUNK_BYTES / 1024 / 1024,
+                        help='maximum CSV text parsed at once, in MB')
+    args = parser.parse_args()
+
+    statistics = analyze_streaming(data_root=args.data_root, cutoff=args.cutoff,
+                                   max_chunk_bytes=int(args.max_chunk_mb * 1024 * 1024))
+    with pd.option_context('display.max_rows', None, 'display.width', 120):
+        for name in ['years', 'weekday', 'yearly']:
+            print(statistics[name].to_string(index=False))
+            print()
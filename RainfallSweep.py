@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Threshold sweep of the heavy rain day cutoff.
+
+Instead of re-filtering the data frame once per RainyDayCutoff, every
+daily value is placed once among the sorted cutoffs. Counting how many
+values land in each cutoff interval and taking the cumulative count from
+the top gives the number of days above every cutoff at once:
+O(rows · log(cutoffs) + groups · cutoffs) instead of O(rows · cutoffs).
+
+Run it from the project folder, e.g.:
+
+    python RainfallSweep.py --start 0.1 --stop 50 --step 0.1 --csv-prefix sweep
+
+@author: Merlin <|:3
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import RainfallLoader
+from RainfallLoader import RAINFALL_COLUMN, STATION_COLUMN, WEEKDAY_ORDER
+
+
+def cutoff_range(start, stop, step):
+    """Return the cutoffs start, start + step, ..., stop (inclusive), rounded to avoid 0.30000000000000004."""
+    count = int(np.floor((stop - start) / step + 1e-9)) + 1
+    return np.round(start + step * np.arange(count), 6)
+
+
+def count_above(groups, n_groups, values, cutoffs):
+    """
+    Count the values above every cutoff, per group.
+
+    groups holds the group index (0 .. n_groups-1) of each value. Returns a
+    cutoffs × groups matrix with the number of values > cutoff.
+    """
+    cutoffs = np.asarray(cutoffs, dtype=np.float64)
+    order = np.argsort(cutoffs, kind='stable')
+    sorted_cutoffs = cutoffs[order]
+
+    # Number of cutoffs strictly below each value: the value counts for exactly those
+    below = np.searchsorted(sorted_cutoffs, values, side='left')
+    n_slots = len(sorted_cutoffs) + 1
+    counts = np.bincount(groups * n_slots + below, minlength=n_groups * n_slots).reshape(n_groups, n_slots)
+
+    # Days above sorted cutoff j are the values with more than j cutoffs below them
+    above = counts[:, :0:-1].cumsum(axis=1)[:, ::-1]
+
+    result = np.empty((len(cutoffs), n_groups), dtype=np.int64)
+    result[order] = above.T
+    return result
+
+
+def sweep(df_final, cutoffs):
+    """
+    Compute the heavy rain day counts per weekday and per year for every cutoff.
+
+    Returns a dict with a cutoff × weekday matrix ('weekday') and a cutoff ×
+    year matrix ('yearly'), both data frames with the cutoffs as index and
+    (station, weekday) or (station, year) columns.
+    """
+    if STATION_COLUMN in df_final:
+        station = df_final[STATION_COLUMN].cat.codes.to_numpy(np.int64)
+        stations = list(df_final[STATION_COLUMN].cat.categories)
+    else:
+        station = np.zeros(len(df_final), dtype=np.int64)
+        stations = ['']
+    values = df_final[RAINFALL_COLUMN].to_numpy(np.float64)
+    cutoffs = np.asarray(cutoffs, dtype=np.float64)
+    cutoff_index = pd.Index(cutoffs, name='cutoff')
+
+    # Per station and weekday (rows without a weekday are left out)
+    weekday = df_final['Weekday'].cat.codes.to_numpy(np.int64)
+    known = weekday >= 0
+    weekday_counts = count_above(station[known] * 7 + weekday[known], len(stations) * 7, values[known], cutoffs)
+    weekday_matrix = pd.DataFrame(
+        weekday_counts, index=cutoff_index,
+        columns=pd.MultiIndex.from_product([stations, WEEKDAY_ORDER], names=[STATION_COLUMN, 'Weekday']),
+    )
+
+    # Per station and year, keeping only the years a station has data for
+    year = df_final['Year'].to_numpy(np.int64)
+    first_year = int(year.min()) if len(year) else 0
+    n_years = int(year.max()) - first_year + 1 if len(year) else 0
+    year_counts = count_above(station * n_years + year - first_year, len(stations) * n_years, values, cutoffs)
+    year_columns = pd.MultiIndex.from_product(
+        [stations, range(first_year, first_year + n_years)], names=[STATION_COLUMN, 'Year']
+    )
+    has_data = np.bincount(station * n_years + year - first_year, minlength=len(stations) * n_years) > 0
+    yearly_matrix = pd.DataFrame(year_counts[:, has_data], index=cutoff_index, columns=year_columns[has_data])
+
+    return {'weekday': weekday_matrix, 'yearly': yearly_matrix}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sweep the heavy rain day cutoff.')
+    parser.add_argument('--data-root', default='Data', help='folder with one sub folder per station')
+    parser.add_argument('--start', type=float, default=0.1, help='first cutoff in l/m²')
+    parser.add_argument('--stop', type=float, default=50, help='last cutoff in l/m²')
+    parser.add_argument('--step', type=float, default=0.1, help='cutoff step in l/m²')
+    parser.add_argument('--csv-prefix', default=None, help='write <prefix>_weekday.csv and <prefix>_yearly.csv')
+    args = parser.parse_args()
+
+    result = sweep(RainfallLoader.load_all_stations(args.data_root), cutoff_range(args.start, args.stop, args.step))
+    if args.csv_prefix:
+        for name, matrix in result.items():
+            matrix.to_csv(f'{args.csv_prefix}_{name}.csv')
+            print(f'Sweep saved as: {args.csv_prefix}_{name}.csv')
+    else:
+        print(result['weekday'].to_string(max_rows=20))
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Generator of realistic synthetic station directories for benchmarks.
+
+The files look like the wetterkontor.de downloads in Data/: one folder per
+station with <Station>_<YYYY>T1..T3.csv (four-month files) up to 2019 and
+<Station>_<YYYY>Q1..Q4.csv (quarter files) from 2020 on, a BOM header
+"category,Niederschlag (6 bis 6 UTC)", "Mo 01.01." date cells and daily
+rainfall in 0.1 l/m² steps. A few short runs of the -999 sentinel mark
+missing data. Any number of stations × years can be written, e.g. to see
+how the pipeline behaves as the data grows.
+
+Run it from the project folder:
+
+    python RainfallSynthetic.py --output-root Synthetic --stations 10 --years 45
+
+@author: Merlin <|:3
+"""
+import os  # operating system dependent functionality
+import argparse
+
+import numpy as np
+
+from RainfallLoader import WEEKDAY_ORDER, QUARTER_YEAR, PERIODS, period_dates
+
+HEADER = '\ufeffcategory,Niederschlag (6 bis 6 UTC)\n'
+
+# Probability of a wet day and mean amount on wet days (l/m²), per month
+WET_PROBABILITY = np.array([0.45, 0.42, 0.48, 0.47, 0.55, 0.58, 0.55, 0.52, 0.46, 0.44, 0.47, 0.49])
+WET_MEAN = np.array([2.8, 2.7, 3.3, 3.8, 5.0, 6.3, 6.6, 6.2, 4.7, 3.6, 3.4, 3.3])
+
+# Expected number of -999 runs per station and year, and their maximum length in days
+SENTINEL_RUNS = 0.15
+SENTINEL_MAX_DAYS = 10
+
+
+def station_names(n_stations):
+    """
+    Names of n synthetic stations, e.g. "Synth-Station-AAA", "Synth-Station-AAB".
+
+    The numbers are written with letters (at least three, in sort order),
+    so no name holds a run of digits that could be read as the file year.
+    """
+    width = 3
+    while 26 ** width < n_stations:
+        width += 1
+    names = []
+    for number in range(n_stations):
+        letters = ''
+        for _ in range(width):
+            number, letter = divmod(number, 26)
+            letters = chr(ord('A') + letter) + letters
+        names.append(f'Synth-Station-{letters}')
+    return names
+
+
+def daily_rainfall(rng, dates):
+    """Draw daily rainfall for the given dates: dry days are 0, wet days gamma distributed, in 0.1 steps."""
+    month = dates.astype('datetime64[M]').astype(np.int64) % 12
+    wet = rng.random(len(dates)) < WET_PROBABILITY[month]
+    amount = rng.gamma(0.7, WET_MEAN[month] / 0.7)
+    rainfall = np.where(wet, np.round(amount, 1), 0.0)
+
+    # Occasional runs of missing data
+    for _ in range(rng.poisson(SENTINEL_RUNS * len(dates) / 365.25)):
+        start = rng.integers(len(dates))
+        rainfall[start:start + rng.integers(1, SENTINEL_MAX_DAYS + 1)] = -999
+    return rainfall
+
+
+def format_file(dates, rainfall):
+    """Return the text of one file: header, then "Mo 01.01.,4.2" lines without a trailing newline."""
+    weekday = (dates.astype(np.int64) + 3) % 7  # 1970-01-01 was a Thursday
+    labels = np.datetime_as_string(dates, unit='D')
+    lines = [
+        f'{WEEKDAY_ORDER[code]} {label[8:10]}.{label[5:7]}.,{value:g}'
+        for code, label, value in zip(weekday, labels, rainfall)
+    ]
+    return HEADER + '\n'.join(lines)
+
+
+def generate_station(station_dir, first_year, last_year, rng):
+    """Write the files of one synthetic station and return their paths."""
+    os.makedirs(station_dir, exist_ok=True)
+    prefix = os.path.basename(os.path.normpath(station_dir)).replace('-', '_')
+    paths = []
+    for year in range(first_year, last_year + 1):
+        kind = 'Q' if year >= QUARTER_YEAR else 'T'
+        months = 12 // len(PERIODS[kind])
+        for number, first_month in enumerate(PERIODS[kind], start=1):
+            dates = period_dates(year, first_month, months)
+            path = os.path.join(station_dir, f'{prefix}_{year}{kind}{number}.csv')
+            with open(path, 'w', encoding='utf-8', newline='') as csv_file:
+                csv_file.write(format_file(dates, daily_rainfall(rng, dates)))
+            paths.append(path)
+    return paths
+
+
+def generate_dataset(output_root, n_stations, n_years, last_year=2024, seed=0):
+    """
+    Write n_stations synthetic stations with n_years each (ending in last_year).
+
+    The same seed always writes the same files. Returns the station
+    directories.
+    """
+    rng = np.random.default_rng(seed)
+    station_dirs = []
+    for name in station_names(n_stations):
+        station_dir = os.path.join(output_root, name)
+        generate_station(station_dir, last_year - n_years + 1, last_year, rng)
+        station_dirs.append(station_dir)
+    return station_dirs
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write synthetic rainfall station directories.')
+    parser.add_argument('--output-root', default='Synthetic', help='folder that receives one sub folder per station')
+    parser.add_argument('--stations', type=int, default=3, help='number of stations')
+    parser.add_argument('--years', type=int, default=45, help='number of years per station')
+    parser.add_argument('--last-year', type=int, default=2024, help='last year of every station')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    args = parser.parse_args()
+
+    station_dirs = generate_dataset(args.output_root, args.stations, args.years, args.last_year, args.seed)
+    print(f'Wrote {len(station_dirs)} station(s) with {args.years} year(s) each to {args.output_root}')
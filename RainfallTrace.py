@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+Per-stage timing and memory instrumentation of the rainfall pipeline.
+
+The loader, engine and renderer wrap their stages (glob, read, read_csv,
+decode_dates, build_dates, concat, groupby, draw, savefig, ...) in
+stage() blocks. While tracing is enabled, every block records its wall
+time, CPU time, row and byte counts, the file it worked on, the peak
+resident memory of the process so far (it never goes down) and how much
+the stage raised it. The peak comes from the resource module on Unix and
+from psutil on Windows, if it is installed; without either the memory
+fields are empty. While tracing is disabled, stage() returns one shared
+no-op object, so the hooks cost a function call and a None check.
+
+Records are only collected in the process that enables tracing; stages
+running in pool workers are covered by the enclosing stage of the parent
+process. Use workers=1 (or --workers 1) for per-file records of a
+parallel run.
+
+Run any script of the project with tracing, e.g.:
+
+    python RainfallTrace.py --output trace.json RainfallRender.py --workers 1
+    python RainfallTrace.py --output trace.csv AverageRainfallWeekdayScriptEn.py
+
+@author: Merlin <|:3
+"""
+import os  # operating system dependent functionality
+import csv
+import sys
+import json
+import time
+import runpy
+import argparse
+import functools
+
+# Columns of a trace record
+FIELDS = ['stage', 'parent', 'depth', 'file', 'rows', 'bytes', 'wall_s', 'cpu_s', 'peak_rss_so_far_mb',
+          'rss_growth_mb']
+
+_records = None  # list of finished records while tracing is enabled
+_open = []  # stack of running stages
+
+
+@functools.lru_cache(maxsize=None)
+def _peak_rss_reader():
+    """Function returning the peak resident set size in bytes, or None if the platform offers none."""
+    try:
+        import resource  # Unix only
+    except ImportError:
+        try:
+            import psutil
+        except ImportError:
+            return None
+        process = psutil.Process()
+        # peak_wset is the peak working set on Windows
+        return lambda: getattr(process.memory_info(), 'peak_wset', None)
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    unit = 1 if sys.platform == 'darwin' else 1024
+    return lambda: resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit
+
+
+def _peak_rss_mb():
+    """Peak resident set size of this process so far (it never goes down), in MB; None if unknown."""
+    reader = _peak_rss_reader()
+    peak = reader() if reader else None
+    return None if peak is None else peak / 1024 / 1024
+
+
+class _NoStage:
+    """Stand-in returned by stage() while tracing is disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **fields):
+        """Ignore the fields."""
+
+
+_NO_STAGE = _NoStage()
+
+
+class _Stage:
+    """One running stage; set() adds counts like rows or bytes to its record."""
+
+    def __init__(self, name, fields):
+        self.record = {'stage': name, **fields}
+
+    def set(self, **fields):
+        """Add or update fields of the record, e.g. rows=len(table)."""
+        self.record.update(fields)
+
+    def __enter__(self):
+        self.record['parent'] = _open[-1].record['stage'] if _open else ''
+        self.record['depth'] = len(_open)
+        _open.append(self)
+        self._peak_before = _peak_rss_mb()
+        self._cpu = time.process_time()
+        self._wall = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        wall = time.perf_counter() - self._wall
+        cpu = time.process_time() - self._cpu
+        peak = _peak_rss_mb()
+        _open.pop()
+        # The peak only tells how far this stage raised the highest memory use so far
+        growth = None if peak is None else peak - self._peak_before
+        self.record.update(wall_s=wall, cpu_s=cpu, peak_rss_so_far_mb=peak, rss_growth_mb=growth)
+        if _records is not None:
+            _records.append(self.record)
+        return False
+
+
+def stage(name, **fields):
+    """
+    Context manager timing one pipeline stage.
+
+    Extra fields (e.g. file=filename) are stored with the record; counts
+    known only at the end can be added with set(), e.g.
+
+        with RainfallTrace.stage('read_csv') as traced:
+            table = pd.read_csv(...)
+            traced.set(rows=len(table))
+    """
+    if _records is None:
+        return _NO_STAGE
+    return _Stage(name, fields)
+
+
+def enable():
+    """Start collecting records (dropping any earlier ones)."""
+    global _records
+    _records = []
+    _open.clear()
+
+
+def disable():
+    """Stop collecting and return the records collected so far."""
+    global _records
+    records, _records = _records or [], None
+    return records
+
+
+def enabled():
+    """Whether records are being collected."""
+    return _records is not None
+
+
+def records():
+    """The records collected so far, in the order the stages finished."""
+    return list(_records or [])
+
+
+def write_trace(path, trace_records):
+    """Save records as JSON or, for a .csv path, as CSV with one row per record."""
+    if path.lower().endswith('.csv'):
+        with open(path, 'w', encoding='utf-8', newline='') as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=FIELDS, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(trace_records)
+    else:
+        with open(path, 'w', encoding='utf-8') as json_file:
+            json.dump({'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'records': trace_records}, json_file, indent=1)
+
+
+def summary(trace_records, slowest_files=5):
+    """Human-readable table of the time, rows and memory per stage, plus the slowest files."""
+    stages = {}
+    for record in trace_records:
+        total = stages.setdefault(record['stage'], {'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'rows': 0,
+                                                    'peak_rss_so_far_mb': None, 'rss_growth_mb': None})
+        total['calls'] += 1
+        total['wall_s'] += record['wall_s']
+        total['cpu_s'] += record['cpu_s']
+        total['rows'] += record.get('rows') or 0
+        if record['peak_rss_so_far_mb'] is not None:
+            total['peak_rss_so_far_mb'] = max(total['peak_rss_so_far_mb'] or 0.0, record['peak_rss_so_far_mb'])
+            total['rss_growth_mb'] = (total['rss_growth_mb'] or 0.0) + record['rss_growth_mb']
+
+    def megabytes(value, width):
+        return f"{'-':>{width}}" if value is None else f'{value:>{width}.1f}'
+
+    lines = [f"{'stage':<16}{'calls':>7}{'wall s':>10}{'cpu s':>10}{'rows':>12}{'peak so far MB':>16}{'growth MB':>11}"]
+    for name, total in sorted(stages.items(), key=lambda item: -item[1]['wall_s']):
+        lines.append(f"{name:<16}{total['calls']:>7}{total['wall_s']:>10.3f}{total['cpu_s']:>10.3f}"
+                     f"{total['rows']:>12}{megabytes(total['peak_rss_so_far_mb'], 16)}"
+                     f"{megabytes(total['rss_growth_mb'], 11)}")
+
+    per_file = [record for record in trace_records if record.get('file')]
+    if per_file and slowest_files:
+        lines.append('')
+        lines.append('Slowest files:')
+        for record in sorted(per_file, key=lambda record: -record['wall_s'])[:slowest_files]:
+            lines.append(f"  {record['wall_s'] * 1000:8.2f} ms  {record['stage']:<8} {record['file']}")
+    return '\n'.join(lines)
+
+
+def run_traced(script, arguments=(), output=None):
+    """Run a script as __main__ with tracing enabled, save the trace and return its records."""
+    enable()
+    sys.argv = [script, *arguments]
+    try:
+        with stage('script'):
+            runpy.run_path(script, run_name='__main__')
+    finally:
+        trace_records = disable()
+        if output:
+            write_trace(output, trace_records)
+    return trace_records
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a rainfall script with per-stage timing and memory tracing.')
+    parser.add_argument('--output', default='trace.json', help='trace file (.json or .csv)')
+    parser.add_argument('--slowest-files', type=int, default=5, help='number of slowest files in the summary')
+    parser.add_argument('script', help='script to run, e.g. RainfallRender.py')
+    parser.add_argument('arguments', nargs=argparse.REMAINDER, help='arguments of the script')
+    args = parser.parse_args()
+
+    # The pipeline imports this file as RainfallTrace: let it record into this copy
+    sys.modules.setdefault('RainfallTrace', sys.modules[__name__])
+    sys.path.insert(0, os.path.dirname(os.path.abspath(args.script)))
+    trace_records = run_traced(args.script, args.arguments, args.output)
+    print()
+    print(summary(trace_records, args.slowest_files))
+    print(f'Trace saved as: {args.output}')
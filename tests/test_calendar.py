@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""Date ranges of the calendar index, in particular over the turn of the year."""
+import numpy as np
+import pytest
+
+import RainfallCalendar
+
+FIRST_YEAR, LAST_YEAR = 2000, 2002
+
+
+@pytest.fixture(scope='module')
+def calendar():
+    """Index of one station with a value for every day of 2000-2002, except 02.01. of every year."""
+    days = np.arange(np.datetime64(f'{FIRST_YEAR}-01-01'), np.datetime64(f'{LAST_YEAR + 1}-01-01'))
+    days = days[~((days.astype('datetime64[M]').astype(np.int64) % 12 == 0)
+                  & ((days - days.astype('datetime64[M]')).astype(np.int64) == 1))]
+    arrays = {
+        'station': np.zeros(len(days), dtype=np.int64),
+        'year': days.astype('datetime64[Y]').astype(np.int64) + 1970,
+        'month': days.astype('datetime64[M]').astype(np.int64) % 12 + 1,
+        'day': (days - days.astype('datetime64[M]')).astype(np.int64) + 1,
+        'rainfall': np.ones(len(days)),
+    }
+    return RainfallCalendar.calendar_from_arrays(arrays, ['Station'])
+
+
+def _single_dates(first, last):
+    """All (month, day) of a leap year from first to last, wrapping over the turn of the year."""
+    dates = np.arange(np.datetime64('2000-01-01'), np.datetime64('2001-01-01'))
+    all_dates = [(int(date.astype('datetime64[M]').astype(np.int64) % 12 + 1),
+                  int((date - date.astype('datetime64[M]')).astype(np.int64) + 1)) for date in dates]
+    start, stop = all_dates.index(first), all_dates.index(last)
+    return (all_dates[start:] + all_dates[:start])[:(stop - start) % len(all_dates) + 1]
+
+
+@pytest.mark.parametrize('date, until', [
+    ('02.01.', '01.01.'), ('31.12.', '01.01.'), ('01.07.', '31.08.'), ('24.12.', '06.01.'), ('01.01.', '31.12.'),
+])
+def test_range_matches_single_dates(calendar, date, until):
+    first, last = RainfallCalendar.parse_date(date), RainfallCalendar.parse_date(until)
+    expected = sum(len(RainfallCalendar.lookup(calendar, 'Station', *single)[0])
+                   for single in _single_dates(first, last))
+    assert len(RainfallCalendar.lookup_range(calendar, 'Station', first, last)[0]) == expected
+
+
+def test_range_over_the_turn_of_the_year(calendar):
+    # 02.01. has no values: the range from it to 01.01. still covers the whole rest of the year
+    years, _ = RainfallCalendar.lookup_range(calendar, 'Station', (1, 2), (1, 1))
+    assert len(years) == 366 + 365 + 365 - 3
+    years, _ = RainfallCalendar.lookup_range(calendar, 'Station', (12, 31), (1, 1))
+    assert len(years) == 6